@@ -1,5 +1,11 @@
 import os
+import time
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from app import logs
 
 # === Visitor Logs (Passive) ===
 AIRTABLE_PASSIVE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
@@ -8,75 +14,242 @@ AIRTABLE_PASSIVE_TABLE_NAME = "Visitors Log"
 # === GA4 Sessions (Raw GA4 Data) ===
 AIRTABLE_GA_BASE_ID = os.getenv("AIRTABLE_GA_BASE_ID")
 AIRTABLE_GA_TABLE_NAME = "Sessions"
+AIRTABLE_GA_DEDUPE_FIELD = os.getenv("AIRTABLE_GA_DEDUPE_FIELD")   # e.g. "Session Key"; switches GA pushes to upserts
 
 AIRTABLE_TOKEN = os.getenv("AIRTABLE_TOKEN")
-DEBUG = True
-
-def log_to_airtable(data):
-    url = f"https://api.airtable.com/v0/{AIRTABLE_PASSIVE_BASE_ID}/{AIRTABLE_PASSIVE_TABLE_NAME}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {"fields": data}
-
-    if DEBUG:
-        print("🔄 Sending to Airtable (Passive Visitor Log):")
-        print("🔗 URL:", url)
-        print("📝 Headers:", headers)
-        print("📦 Payload:", payload)
-
-    response = requests.post(url, json=payload, headers=headers)
-
-    if DEBUG:
-        print("📨 Airtable raw response:", response.text)
-
-    return response.json()
-
-def push_ga_sessions_to_airtable(sessions):
-    url = f"https://api.airtable.com/v0/{AIRTABLE_GA_BASE_ID}/{AIRTABLE_GA_TABLE_NAME}"
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
-    inserted_ids = []
-    for session in sessions:
-        # Handle singleSelect field for 'Device'
-        device_raw = session.get("device")
-        device_value = {"name": device_raw} if isinstance(device_raw, str) else device_raw
-
-        fields = {
-            "Timestamp": session.get("timestamp"),
-            "Page": session.get("page"),
-            "Device": device_value,
-            "City": session.get("city"),
-            "Country": session.get("country"),
-            "Sessions": int(session.get("sessions", 0))
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com/v0")
+AIRTABLE_BATCH_SIZE = 10                                              # Airtable's per-request record cap
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))    # Requests/second per base
+AIRTABLE_MAX_RETRIES = int(os.getenv("AIRTABLE_MAX_RETRIES", "5"))
+AIRTABLE_TIMEOUT = float(os.getenv("AIRTABLE_TIMEOUT", "10"))
+
+
+class AirtableError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Airtable request failed ({status_code}): {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+# Token bucket: `rate` tokens/second, bursts up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Pooled HTTP session + per-base rate limiting + retry on 429/5xx
+class AirtableClient:
+    def __init__(self, token=AIRTABLE_TOKEN, api_url=AIRTABLE_API_URL, rate=AIRTABLE_RATE_LIMIT,
+                 max_retries=AIRTABLE_MAX_RETRIES):
+        self.api_url = api_url.rstrip("/")
+        self.rate = rate
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        })
+        self.limiters = {}
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def limiter(self, base_id):
+        if base_id not in self.limiters:
+            self.limiters[base_id] = TokenBucket(self.rate)
+        return self.limiters[base_id]
+
+    def request(self, method, base_id, table, payload):
+        url = f"{self.api_url}/{base_id}/{table}"
+        for attempt in range(self.max_retries + 1):
+            self.limiter(base_id).acquire()
+            self.stats["requests"] += 1
+            try:
+                response = self.session.request(method, url, json=payload, timeout=AIRTABLE_TIMEOUT)
+            except requests.RequestException as ex:
+                response, error = None, ex
+            else:
+                if response.status_code < 400:
+                    return response.json()
+                error = AirtableError(response.status_code, response.text)
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+
+            if attempt == self.max_retries:
+                raise error
+            self.stats["retries"] += 1
+            delay = min(30.0, 0.5 * 2 ** attempt)
+            if response is not None and response.status_code == 429:
+                self.stats["throttled"] += 1
+                delay = float(response.headers.get("Retry-After", delay))
+            logs.warning("airtable_retry", attempt=attempt + 1, max_retries=self.max_retries, delay=delay,
+                         error=str(error))
+            time.sleep(delay)
+
+    # Batch create (≤10 records/request); returns created record ids
+    def create_records(self, base_id, table, fields_list):
+        response = self.request("POST", base_id, table, {"records": [{"fields": f} for f in fields_list]})
+        return [record.get("id") for record in response.get("records", [])]
+
+    # Batch upsert keyed on `merge_on` field names; returns record ids (created or updated)
+    def upsert_records(self, base_id, table, fields_list, merge_on):
+        payload = {
+            "performUpsert": {"fieldsToMergeOn": list(merge_on)},
+            "records": [{"fields": f} for f in fields_list],
         }
+        response = self.request("PATCH", base_id, table, payload)
+        return [record.get("id") for record in response.get("records", [])]
+
+
+client = AirtableClient()
+
+
+# Push records in 10-record batches. With `checkpoint` (name) + `keys` (one value per record, in
+# push order), the checkpoint moves to the key of each batch's last record once the batch succeeds;
+# callers select what to push from the checkpoint in SQL (see push_stored_ga_sessions).
+def sync_records(base_id, table, records, merge_on=None, checkpoint=None, keys=None, db=None, airtable=None):
+    from app.checkpoints import set_checkpoint
+
+    airtable = airtable or client
+    started = time.perf_counter()
+    requests_before, retries_before = airtable.stats["requests"], airtable.stats["retries"]
+    result = {"ids": [], "records": 0, "batches": 0, "failed_batches": 0}
+
+    for i in range(0, len(records), AIRTABLE_BATCH_SIZE):
+        batch = records[i:i + AIRTABLE_BATCH_SIZE]
+        try:
+            if merge_on:
+                ids = airtable.upsert_records(base_id, table, batch, merge_on)
+            else:
+                ids = airtable.create_records(base_id, table, batch)
+        except Exception as ex:
+            # Stop here so the checkpoint never skips past an unsynced batch
+            logs.error("airtable_batch_failed", table=table, records=len(batch), error=str(ex))
+            result["failed_batches"] += 1
+            break
+
+        result["ids"].extend(ids)
+        result["records"] += len(batch)
+        result["batches"] += 1
+        if checkpoint and db is not None:
+            set_checkpoint(db, checkpoint, keys[i + len(batch) - 1])
+
+    elapsed = time.perf_counter() - started
+    result.update({
+        "requests": airtable.stats["requests"] - requests_before,
+        "retries": airtable.stats["retries"] - retries_before,
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(result["records"] / elapsed, 1) if elapsed > 0 else None,
+    })
+    logs.info("airtable_sync", table=table, **{k: v for k, v in result.items() if k != "ids"})
+    return result
 
-        # Optional field
-        session_source = session.get("session_source")
-        if session_source:
-            fields["Session Source"] = session_source
-
-        payload = {"fields": fields}
-
-        if DEBUG:
-            print("🌀 Pushing GA session to Airtable:", fields)
 
-        response = requests.post(url, json=payload, headers=headers)
-
-        if response.status_code == 200:
-            inserted_ids.append(response.json().get("id"))
-        else:
-            print("⚠️ Airtable GA insert failed:")
-            print("   🔴 Status Code:", response.status_code)
-            try:
-                print("   📩 Response JSON:", response.json())
-            except Exception as e:
-                print("   ⚠️ Failed to parse JSON response:", str(e))
-                print("   📄 Raw Response:", response.text)
-            print("   📦 Payload was:", payload)
+def log_to_airtable(data):
+    logs.debug("airtable_send", table=AIRTABLE_PASSIVE_TABLE_NAME, record=data)
+
+    try:
+        response = client.request("POST", AIRTABLE_PASSIVE_BASE_ID, AIRTABLE_PASSIVE_TABLE_NAME, {"fields": data})
+    except AirtableError as ex:
+        response = {"error": {"status": ex.status_code, "body": ex.body}}
+        logs.error("airtable_send_failed", table=AIRTABLE_PASSIVE_TABLE_NAME, status=ex.status_code, error=ex.body)
+    else:
+        logs.debug("airtable_response", table=AIRTABLE_PASSIVE_TABLE_NAME, id=response.get("id"))
+
+    return response
+
+# Batched variant for backfills / queued visitor rows
+def log_many_to_airtable(records):
+    return sync_records(AIRTABLE_PASSIVE_BASE_ID, AIRTABLE_PASSIVE_TABLE_NAME, list(records))
+
+
+def ga_session_fields(session):
+    # Handle singleSelect field for 'Device'
+    device_raw = session.get("device")
+    device_value = {"name": device_raw} if isinstance(device_raw, str) else device_raw
+
+    fields = {
+        "Timestamp": session.get("timestamp"),
+        "Page": session.get("page"),
+        "Device": device_value,
+        "City": session.get("city"),
+        "Country": session.get("country"),
+        "Sessions": int(session.get("sessions", 0))
+    }
 
-    return inserted_ids
\ No newline at end of file
+    # Optional field
+    session_source = session.get("session_source")
+    if session_source:
+        fields["Session Source"] = session_source
+
+    if AIRTABLE_GA_DEDUPE_FIELD:
+        fields[AIRTABLE_GA_DEDUPE_FIELD] = ga_session_key(fields)
+    return fields
+
+# Stable per-row key: the dedupe value Airtable upserts merge on
+def ga_session_key(fields):
+    device = fields.get("Device")
+    device = device.get("name") if isinstance(device, dict) else device
+    return "|".join(str(v or "") for v in (fields.get("Timestamp"), fields.get("Page"), device,
+                                           fields.get("City"), fields.get("Country")))
+
+def push_ga_sessions_to_airtable(sessions, airtable=None):
+    records = [ga_session_fields(s) for s in sessions]
+
+    logs.info("airtable_ga_push", records=len(records))
+
+    result = sync_records(
+        AIRTABLE_GA_BASE_ID,
+        AIRTABLE_GA_TABLE_NAME,
+        records,
+        merge_on=[AIRTABLE_GA_DEDUPE_FIELD] if AIRTABLE_GA_DEDUPE_FIELD else None,
+        airtable=airtable,
+    )
+    return result["ids"]
+
+# Incremental push of ga_sessions: rows stored or revised since the last push, oldest change first,
+# `chunk_size` rows per query. Revised rows go out again, so set AIRTABLE_GA_DEDUPE_FIELD to have them
+# update the existing Airtable record (plain creates would add a second one).
+GA_SYNC_CHECKPOINT = "airtable.ga_sessions.cursor"
+
+def push_stored_ga_sessions(db, chunk_size: int = 1000, airtable=None) -> dict:
+    from app.ga import ga_sessions_changed_since
+    from app.checkpoints import get_checkpoint
+
+    totals = {"records": 0, "batches": 0, "failed_batches": 0, "requests": 0, "retries": 0}
+    while True:
+        rows = ga_sessions_changed_since(db, get_checkpoint(db, GA_SYNC_CHECKPOINT), chunk_size)
+        if not rows:
+            break
+        result = sync_records(
+            AIRTABLE_GA_BASE_ID,
+            AIRTABLE_GA_TABLE_NAME,
+            [ga_session_fields(session) for session, _ in rows],
+            merge_on=[AIRTABLE_GA_DEDUPE_FIELD] if AIRTABLE_GA_DEDUPE_FIELD else None,
+            checkpoint=GA_SYNC_CHECKPOINT,
+            keys=[cursor for _, cursor in rows],
+            db=db,
+            airtable=airtable,
+        )
+        for key in totals:
+            totals[key] += result[key]
+        if result["failed_batches"] or len(rows) < chunk_size:
+            break
+    totals["checkpoint"] = get_checkpoint(db, GA_SYNC_CHECKPOINT)
+    return totals
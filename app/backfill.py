@@ -0,0 +1,113 @@
+# Purpose: One-off rebuilds for databases that predate a derived table (entropy signature index, visit
+# rollups, unique visitor sketches). They replace whole tables while holding off ingest writes to them,
+# so they run here, as a deploy step after `alembic upgrade head` (render.yaml preDeployCommand), not in
+# every worker's startup. Each one takes a cross-worker advisory lock and is skipped when another process
+# holds it; a backfill whose table is already populated does nothing. Startup only logs
+# `backfill_pending` for the ones still due.
+#
+# CLI: python -m app.backfill [--only signatures,rollups,uniques] [--force]
+
+import sys
+import argparse
+
+from sqlalchemy.orm import Session
+
+from app import logs
+
+SIGNATURE_LOCK_ID = 73_451_003
+ROLLUP_LOCK_ID = 73_451_004
+UNIQUES_LOCK_ID = 73_451_005
+
+
+def signatures_due(db: Session) -> bool:
+    from app.fuzzy import ENTROPY_FUZZY
+    from app.models import VisitorLog, EntropySignature, EntropyFuzzyValue
+
+    if db.query(EntropySignature.id).first() is None:
+        return db.query(VisitorLog.id).filter(VisitorLog.entropy_profile_id.isnot(None)).first() is not None
+    return ENTROPY_FUZZY and db.query(EntropyFuzzyValue.id).first() is None   # Index predates its LSH bands
+
+def backfill_signatures(db: Session):
+    from app.intel import rebuild_signature_index
+
+    rebuild_signature_index(db)
+
+
+def rollups_due(db: Session) -> bool:
+    from app.models import VisitorLog, VisitRollup
+
+    return db.query(VisitRollup.id).first() is None and db.query(VisitorLog.id).first() is not None
+
+def backfill_rollups(db: Session):
+    from app.rollups import rebuild_rollups
+
+    rebuild_rollups(db)
+
+
+def uniques_due(db: Session) -> bool:
+    from app.models import VisitorLog, UniqueSketch
+
+    return db.query(UniqueSketch.id).first() is None and db.query(VisitorLog.id).first() is not None
+
+def backfill_uniques(db: Session):
+    from app.uniques import rebuild_uniques
+
+    rebuild_uniques(db)
+
+
+# name -> (lock id, due check, rebuild)
+BACKFILLS = {
+    "signatures": (SIGNATURE_LOCK_ID, signatures_due, backfill_signatures),
+    "rollups": (ROLLUP_LOCK_ID, rollups_due, backfill_rollups),
+    "uniques": (UNIQUES_LOCK_ID, uniques_due, backfill_uniques),
+}
+
+
+def pending_backfills(db: Session) -> list:
+    return [name for name, (_, due, _) in BACKFILLS.items() if due(db)]
+
+# Run the due backfills among `names` (all of them with `force`); returns {name: "done" | "not needed" | "locked"}
+def run_backfills(db: Session, names=None, force: bool = False) -> dict:
+    from app.db import try_advisory_lock
+
+    results = {}
+    for name in names or BACKFILLS:
+        lock_id, due, rebuild = BACKFILLS[name]
+        with try_advisory_lock(lock_id) as acquired:
+            if not acquired:
+                logs.warning("backfill_locked", backfill=name)
+                results[name] = "locked"
+            elif force or due(db):   # Checked under the lock: another process may just have finished it
+                rebuild(db)
+                results[name] = "done"
+            else:
+                results[name] = "not needed"
+        db.rollback()
+    return results
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Run the one-off derived-table backfills this database still needs")
+    parser.add_argument("--only", default="", help=f"comma-separated subset of {', '.join(BACKFILLS)}")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild even if already populated (e.g. after a change to how index terms are computed)")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.only.split(",") if name.strip()]
+    if any(name not in BACKFILLS for name in names):
+        parser.error(f"--only takes {', '.join(BACKFILLS)}")
+
+    db = SessionLocal()
+    try:
+        results = run_backfills(db, names, args.force)
+    finally:
+        db.close()
+    for name, outcome in results.items():
+        print(f"{'🔒' if outcome == 'locked' else '✅'} {name}: {outcome}")
+    return 1 if "locked" in results.values() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
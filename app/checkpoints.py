@@ -0,0 +1,23 @@
+# Purpose: Persist job progress (last synced key, watermarks) in sync_checkpoints
+
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app.models import SyncCheckpoint
+
+
+def get_checkpoint(db: Session, name: str, default=None):
+    row = db.get(SyncCheckpoint, name)
+    return row.value if row is not None and row.value is not None else default
+
+
+def set_checkpoint(db: Session, name: str, value, commit: bool = True):
+    row = db.get(SyncCheckpoint, name)
+    if row is None:
+        db.add(SyncCheckpoint(name=name, value=str(value)))
+    else:
+        row.value = str(value)
+        row.updated_at = datetime.utcnow()
+    if commit:
+        db.commit()
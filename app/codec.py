@@ -0,0 +1,109 @@
+# Purpose: Pluggable JSON codec for the ingest and dashboard hot paths.
+# JSON_CODEC=auto (orjson when installed, else stdlib) / orjson / msgspec / std. Request bodies are decoded
+# straight from bytes into the pydantic models (no request.json() + Model(**body) round); dashboard rows
+# are encoded from plain row dicts, datetimes included, by the codec itself.
+
+import os
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+JSON_CODEC = os.getenv("JSON_CODEC", "auto")
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError as ex:
+        raise RuntimeError("JSON_CODEC=orjson needs orjson (pip install orjson)") from ex
+    return orjson
+
+
+def _msgspec():
+    try:
+        import msgspec
+    except ImportError as ex:
+        raise RuntimeError("JSON_CODEC=msgspec needs msgspec (pip install msgspec)") from ex
+    return msgspec
+
+
+# Whatever the codec can't encode natively (matches the stdlib paths' default=str / isoformat)
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _resolve(name: str) -> str:
+    if name != "auto":
+        return name
+    try:
+        _orjson()
+        return "orjson"
+    except RuntimeError:
+        return "std"
+
+
+codec_name = _resolve(JSON_CODEC)
+
+if codec_name == "orjson":
+    _oj = _orjson()
+    _OPTIONS = _oj.OPT_NON_STR_KEYS | _oj.OPT_SERIALIZE_NUMPY
+
+    loads = _oj.loads
+
+    def dumps(obj) -> bytes:
+        return _oj.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps_line(obj) -> bytes:
+        return _oj.dumps(obj, default=_default, option=_OPTIONS | _oj.OPT_APPEND_NEWLINE)
+
+    _decode_errors = (_oj.JSONDecodeError,)
+
+elif codec_name == "msgspec":
+    _ms = _msgspec()
+    _encoder = _ms.json.Encoder(enc_hook=_default)
+
+    loads = _ms.json.decode
+    dumps = _encoder.encode
+
+    def dumps_line(obj) -> bytes:
+        return _encoder.encode(obj) + b"\n"
+
+    _decode_errors = (_ms.DecodeError,)
+
+elif codec_name == "std":
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj) -> bytes:
+        return dumps(obj) + b"\n"
+
+    _decode_errors = ()
+
+else:
+    raise RuntimeError(f"Unknown JSON_CODEC {JSON_CODEC!r} (auto / orjson / msgspec / std)")
+
+
+# Request bytes -> validated pydantic model. Malformed JSON surfaces as a pydantic ValidationError
+# (json_invalid) whichever codec is active; without a fast codec pydantic-core parses the bytes itself.
+def decode_model(raw: bytes, model):
+    if not _decode_errors:
+        return model.model_validate_json(raw)
+    try:
+        data = loads(raw)
+    except _decode_errors:
+        return model.model_validate_json(raw)
+    return model.model_validate(data)
+
+
+# Default response class for the app: same JSON as JSONResponse, encoded by the codec
+class CodecJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
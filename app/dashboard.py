@@ -1,37 +1,248 @@
 # Purpose: Serve raw data from all logs (VisitorLog, VisitorEventLog, VisitorDerivedLog)
 
-from fastapi import APIRouter, Depends
+import os
+import tempfile
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from datetime import datetime
 
-from app.db import get_db
-from app.models import VisitorLog, VisitorEventLog, VisitorDerivedLog
+from app.db import get_read_db, ReadSessionLocal, pool_snapshot
+from app.models import VisitorLog, VisitorEventLog, VisitorDerivedLog, VisitRollup, GASession, to_naive_utc
+from app.ipinfo import cache_stats
+from app.event_buffer import event_buffer
+from app.spool import ingest_spool
+from app.export import EXPORT_FORMATS, export_to_file
+from app.profiles import log_columns, with_profile
+from app.rollups import DIMENSIONS
+from app.codec import CodecJSONResponse, dumps_line
+from app import uniques
 
 router = APIRouter()
 
-# ✅ Helper to serialize SQLAlchemy records (including datetime fields like client_timestamp)
-def serialize(model):
-    return {
-        k: (v.isoformat() if isinstance(v, datetime) else v)
-        for k, v in vars(model).items()
-        if not k.startswith("_") and k != "metadata"
-    }
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+
+# ✅ Helper to serialize rows (column name → value mappings, including datetime fields like client_timestamp)
+def serialize_row(row):
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
+
+
+# ✅ Shared query params: keyset cursor, projection, time range, output format
+class PageParams:
+    def __init__(
+        self,
+        after_id: Optional[int] = Query(None, description="Cursor: continue after this id (in `order` direction)"),
+        limit: Optional[int] = Query(None, ge=1, description=f"Rows per page (JSON max {MAX_PAGE_SIZE}; NDJSON unlimited)"),
+        fields: Optional[str] = Query(None, description="Comma-separated column names to return"),
+        since: Optional[datetime] = Query(None, description="Only rows with timestamp >= since"),
+        until: Optional[datetime] = Query(None, description="Only rows with timestamp < until"),
+        order: Literal["asc", "desc"] = "desc",
+        format: Literal["json", "ndjson"] = "json",
+    ):
+        self.after_id = after_id
+        self.limit = limit
+        self.fields = fields
+        self.since = since
+        self.until = until
+        self.order = order
+        self.format = format
+
+
+# Visit/event rows come back with their entropy profile fields rejoined, as if still stored inline
+def build_query(model, params: PageParams):
+    available = log_columns(model)
+    if params.fields:
+        names = [name.strip() for name in params.fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in names:
+            names.insert(0, "id")  # Needed for the next cursor
+        columns = [available[name] for name in names]
+    else:
+        columns = list(available.values())
+
+    query = with_profile(select(*columns), model, columns)
+    if params.after_id is not None:
+        query = query.where(model.id < params.after_id if params.order == "desc" else model.id > params.after_id)
+    if params.since is not None:
+        query = query.where(model.timestamp >= to_naive_utc(params.since))
+    if params.until is not None:
+        query = query.where(model.timestamp < to_naive_utc(params.until))
+    return query.order_by(model.id.desc() if params.order == "desc" else model.id.asc())
+
+
+# NDJSON export on its own session: the server-side cursor outlives the request dependency
+def stream_rows(query):
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(query.execution_options(stream_results=True, yield_per=STREAM_CHUNK_SIZE))
+        keys = list(result.keys())
+        for partition in result.partitions():
+            yield b"".join(dumps_line(dict(zip(keys, row))) for row in partition)
+    finally:
+        db.close()
+
+
+def dashboard_rows(model, db: Session, params: PageParams):
+    query = build_query(model, params)
+
+    if params.format == "ndjson":
+        if params.limit is not None:
+            query = query.limit(params.limit)
+        return StreamingResponse(stream_rows(query), media_type="application/x-ndjson")
+
+    # Plain row dicts straight from the result tuples; the codec encodes datetimes itself
+    limit = min(params.limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    result = db.execute(query.limit(limit))
+    keys = list(result.keys())
+    rows = [dict(zip(keys, row)) for row in result]
+    headers = {}
+    if len(rows) == limit:
+        headers["X-Next-After-Id"] = str(rows[-1]["id"])
+    return CodecJSONResponse(rows, headers=headers)
+
 
 # ✅ Route: All visitor logs (passive logger)
 @router.get("/dashboard/visits")
-def dashboard_visits(db: Session = Depends(get_db)):
-    records = db.query(VisitorLog).order_by(VisitorLog.id.desc()).limit(100).all()
-    return JSONResponse([serialize(r) for r in records])
+def dashboard_visits(params: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return dashboard_rows(VisitorLog, db, params)
 
 # ✅ Route: All event logs (event logger)
 @router.get("/dashboard/events")
-def dashboard_events(db: Session = Depends(get_db)):
-    records = db.query(VisitorEventLog).order_by(VisitorEventLog.id.desc()).limit(100).all()
-    return JSONResponse([serialize(r) for r in records])
+def dashboard_events(params: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return dashboard_rows(VisitorEventLog, db, params)
 
 # ✅ Route: All derived logs (derived enrichments)
 @router.get("/dashboard/derived")
-def dashboard_derived(db: Session = Depends(get_db)):
-    records = db.query(VisitorDerivedLog).order_by(VisitorDerivedLog.id.desc()).limit(100).all()
-    return JSONResponse([serialize(r) for r in records])
\ No newline at end of file
+def dashboard_derived(params: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return dashboard_rows(VisitorDerivedLog, db, params)
+
+# ✅ Route: GA4 sessions stored by the incremental ingest (no GA API call)
+@router.get("/dashboard/ga-sessions")
+def dashboard_ga_sessions(params: PageParams = Depends(), db: Session = Depends(get_read_db)):
+    return dashboard_rows(GASession, db, params)
+
+# ✅ Route: Columnar download (Parquet / Arrow IPC) of a whole table, or rows after `after_id`
+@router.get("/dashboard/export/{table}")
+def dashboard_export(
+    table: Literal["visits", "events", "derived"],
+    after_id: int = 0,
+    format: Literal["parquet", "arrow"] = "parquet",
+    db: Session = Depends(get_read_db),
+):
+    ext = EXPORT_FORMATS[format]
+    fd, path = tempfile.mkstemp(suffix=f".{ext}")
+    os.close(fd)
+    try:
+        rows = export_to_file(db, table, path, format, after_id)
+    except RuntimeError as ex:
+        os.remove(path)
+        raise HTTPException(status_code=501, detail=str(ex))
+
+    return FileResponse(
+        path,
+        filename=f"{table}-after-{after_id}.{ext}",
+        media_type="application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file",
+        headers={"X-Row-Count": str(rows)},
+        background=BackgroundTask(os.remove, path),
+    )
+
+# ✅ Helper: aggregate visit_rollups (dimension filters come straight from the query string, e.g. ?country=IN)
+def rollup_stats(db: Session, request: Request, granularity: str, group_by: Optional[str],
+                 since: Optional[datetime], until: Optional[datetime], per_bucket: bool):
+    dims = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+
+    keys = ([VisitRollup.bucket] if per_bucket else []) + [getattr(VisitRollup, d) for d in dims]
+    query = (
+        select(
+            *keys,
+            func.sum(VisitRollup.visits).label("visits"),
+            func.sum(VisitRollup.sessions).label("sessions"),
+            func.sum(VisitRollup.bounced_sessions).label("bounced_sessions"),
+        )
+        .where(VisitRollup.granularity == granularity)
+    )
+    if since is not None:
+        query = query.where(VisitRollup.bucket >= to_naive_utc(since))
+    if until is not None:
+        query = query.where(VisitRollup.bucket < to_naive_utc(until))
+    for name, value in request.query_params.items():
+        if name in DIMENSIONS:
+            query = query.where(getattr(VisitRollup, name) == value)
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+
+    results = []
+    for row in db.execute(query).mappings():
+        item = serialize_row(row)
+        for d in dims:
+            item[d] = item[d] or None
+        item["bounce_rate"] = round(row["bounced_sessions"] / row["sessions"], 4) if row["sessions"] else None
+        results.append(item)
+    return results
+
+# Day buckets when the range is day-aligned, hour buckets otherwise
+def _granularity_for(since: Optional[datetime], until: Optional[datetime]):
+    aligned = all(ts is None or to_naive_utc(ts).time() == datetime.min.time() for ts in (since, until))
+    return "day" if aligned else "hour"
+
+# ✅ Route: Visits / sessions / bounces per hour or day bucket
+@router.get("/dashboard/stats/timeseries")
+def dashboard_stats_timeseries(
+    request: Request,
+    granularity: Literal["hour", "day"] = "day",
+    group_by: Optional[str] = Query(None, description=f"Comma-separated: {', '.join(DIMENSIONS)}"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+):
+    return rollup_stats(db, request, granularity, group_by, since, until, per_bucket=True)
+
+# ✅ Route: Totals (incl. bounce rate) per dimension over a time range
+@router.get("/dashboard/stats/breakdown")
+def dashboard_stats_breakdown(
+    request: Request,
+    group_by: Optional[str] = Query(None, description=f"Comma-separated: {', '.join(DIMENSIONS)}"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+):
+    return rollup_stats(db, request, _granularity_for(since, until), group_by, since, until, per_bucket=False)
+
+# ✅ Route: Distinct visitors / sessions from merged HyperLogLog sketches (app.uniques), e.g.
+# ?since=2026-10-12&group_by=country or ?since=...&interval=day&page=/blog. Counts are estimates:
+# relative standard error 1.04/sqrt(2^UNIQUES_PRECISION) (±1.6% at the default precision), returned as `error`.
+@router.get("/dashboard/uniques")
+def dashboard_uniques(
+    request: Request,
+    interval: Literal["total", "day", "hour"] = "total",
+    group_by: Optional[str] = Query(None, description=f"Comma-separated: {', '.join(uniques.DIMENSIONS)}"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
+):
+    dims = [d.strip() for d in (group_by or "").split(",") if d.strip()]
+    unknown = [d for d in dims if d not in uniques.DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+    filters = {name: value for name, value in request.query_params.items() if name in uniques.DIMENSIONS}
+    return {
+        "error": uniques.error_bound(),
+        "results": uniques.unique_counts(db, since, until, dims, filters, interval),
+    }
+
+# ✅ Route: Ingest internals (IP cache, event write-behind buffer, DB connection pools)
+@router.get("/dashboard/ingest-stats")
+def dashboard_ingest_stats():
+    return {"ip_cache": cache_stats(), "event_buffer": event_buffer.snapshot(), "spool": ingest_spool.snapshot(),
+            "db_pools": pool_snapshot()}
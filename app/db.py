@@ -1,21 +1,174 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from app.models import Base
+from app.metrics import instrument_engine, db_pool_wait_seconds
+from app import logs
 
 # Read from .env or environment variable
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")   # Optional read replica for the dashboard
 
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Pool settings (per engine, per worker process). Recycle stays under Render's idle-connection cutoff,
+# pre-ping replaces connections the server closed while the pool sat idle.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))        # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))        # Seconds; -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))   # PostgreSQL only; 0 disables
+
+# Migrations marked `heavy = True` rewrite the log tables; on an existing database startup stops short
+# of them and they run as a separate deploy step (`alembic upgrade head`, render.yaml preDeployCommand)
+MIGRATE_HEAVY_ON_STARTUP = os.getenv("MIGRATE_HEAVY_ON_STARTUP", "0") == "1"
+
+
+# ✅ Pool statistics: checkouts, time spent waiting for a connection, timeouts, invalidations
+class PoolStats:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.counts = {"checkouts": 0, "connects": 0, "invalidated": 0, "timeouts": 0}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.engine = None   # Sync engine; its pool is replaced on dispose()
+
+    def add(self, key, amount=1):
+        with self.lock:
+            self.counts[key] += amount
+
+    def waited(self, seconds):
+        with self.lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+        db_pool_wait_seconds.observe(self.name, value=seconds)
+
+    def snapshot(self):
+        pool = self.engine.pool if self.engine is not None else None
+        with self.lock:
+            checkouts = self.counts["checkouts"]
+            stats = {
+                **self.counts,
+                "avg_wait_ms": round(self.wait_total / checkouts * 1000, 3) if checkouts else None,
+                "max_wait_ms": round(self.wait_max * 1000, 3),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=max(0, pool.overflow()),
+                         idle=pool.checkedin(), max_overflow=pool._max_overflow)
+        return stats
+
+
+pool_stats = {}   # engine name -> PoolStats
+
+# Queue pool that times every checkout (including the wait for a free slot) for `stats`
+def timed_pool(base, stats):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return base._do_get(self)
+        except PoolTimeoutError:
+            stats.add("timeouts")
+            raise
+        finally:
+            stats.waited(time.perf_counter() - started)
+
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+
+def engine_options(url, name: str, is_async: bool = False) -> dict:
+    url = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options   # In-memory SQLite keeps SQLAlchemy's single-connection pool
+
+    stats = pool_stats.setdefault(name, PoolStats(name))
+    options.update(
+        poolclass=timed_pool(AsyncAdaptedQueuePool if is_async else QueuePool, stats),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+# Engine with the configured pool, statement timeout and instrumentation (`name` labels its stats)
+def make_engine(url, name: str = "primary", is_async: bool = False, **overrides):
+    options = {**engine_options(url, name, is_async), **overrides}
+    engine = create_async_engine(url, **options) if is_async else create_engine(url, **options)
+    sync_engine = engine.sync_engine if is_async else engine
+    instrument_engine(sync_engine)
+
+    stats = pool_stats.get(name)
+    if stats is not None:
+        stats.engine = sync_engine
+        event.listen(sync_engine.pool, "checkout", lambda *args: stats.add("checkouts"))
+        event.listen(sync_engine.pool, "connect", lambda *args: stats.add("connects"))
+        event.listen(sync_engine.pool, "invalidate", lambda *args: stats.add("invalidated"))
+    return engine
+
+def pool_snapshot() -> dict:
+    return {name: stats.snapshot() for name, stats in pool_stats.items()}
+
+
 # PostgreSQL engine
-engine = create_engine(DATABASE_URL)
+engine = make_engine(DATABASE_URL)
 
 # DB session setup
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Dashboard reads go to the replica when one is configured (replication lag is acceptable there)
+read_engine = make_engine(DATABASE_REPLICA_URL, name="replica") if DATABASE_REPLICA_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# INSERT construct with ON CONFLICT support for the session's dialect (PostgreSQL or SQLite)
+def dialect_insert(db, table):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+# Cross-worker guard for one-off jobs (backfills, partition maintenance): a session-level advisory lock
+# on its own connection, taken without waiting. Yields False while another process holds it (the caller
+# skips its work). Other dialects have no advisory locks: always True.
+@contextmanager
+def try_advisory_lock(key: int):
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
+
+# Rebuilds of derived tables: hold off ingest writes to `tables` until the caller commits, so the rows
+# it reads and the rows it replaces agree. PostgreSQL waits for in-flight writers, then blocks new ones
+# (reads continue); on SQLite the rebuild's first DELETE takes the database write lock.
+def lock_for_rebuild(db, *tables):
+    if db.bind.dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {', '.join(table.name for table in tables)} IN EXCLUSIVE MODE"))
+
 # Dependency to inject DB session
 def get_db():
     db = SessionLocal()
@@ -24,7 +177,125 @@ def get_db():
     finally:
         db.close()
 
-# Create tables if not exist
+# Dependency to inject a read-only DB session (replica if configured)
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Same database through an async driver (asyncpg / aiosqlite) for the ingest routes
+def async_database_url(url: str):
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    if url.get_backend_name() == "postgresql":
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        if sslmode:
+            query["ssl"] = sslmode
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+async_engine = make_engine(async_database_url(DATABASE_URL), name="async", is_async=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Dependency to inject an async DB session (ingest routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def close_async_db():
+    await async_engine.dispose()
+
+def alembic_config():
+    from alembic.config import Config
+
+    config = Config(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini"))
+    config.attributes["configure_logging"] = False
+    return config
+
+# Apply pending Alembic migrations (creates the schema on a fresh database)
+def run_migrations(revision: str = "head"):
+    from alembic import command
+
+    command.upgrade(alembic_config(), revision)
+
+# Startup upgrade: everything on a fresh database, otherwise pending migrations up to the first heavy
+# one. Refuses to start on a schema that is still behind, rather than serving against it.
+def migrate_on_startup():
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory.from_config(alembic_config())
+    with engine.connect() as conn:
+        current = MigrationContext.configure(conn).get_current_revision()
+    if current is None or MIGRATE_HEAVY_ON_STARTUP:
+        return run_migrations()
+
+    target, blocked = current, None
+    for revision in reversed(list(script.iterate_revisions("head", current))):   # Oldest first
+        if getattr(revision.module, "heavy", False):
+            blocked = revision
+            break
+        target = revision.revision
+    if target != current:
+        run_migrations(target)
+    if blocked is not None:
+        raise RuntimeError(
+            f"Database schema is at {target}; migration {blocked.revision} ({blocked.doc}) rewrites large tables "
+            f"and does not run on startup. Run `alembic upgrade head` first (or set MIGRATE_HEAVY_ON_STARTUP=1)."
+        )
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
-    print("PostgreSQL tables created successfully.")
\ No newline at end of file
+    migrate_on_startup()
+    logs.info("db_migrated", sampled=False)
+    check_backfills()
+    backfill_labels()
+    maintain_table_partitions()
+
+# Whole-table rebuilds don't run in the workers (app.backfill); flag the ones this database still needs
+def check_backfills():
+    from app.backfill import pending_backfills
+
+    db = SessionLocal()
+    try:
+        pending = pending_backfills(db)
+        if pending:
+            logs.warning("backfill_pending", backfills=pending, command="python -m app.backfill")
+    except Exception as ex:
+        logs.warning("backfill_check_skipped", error=str(ex))
+    finally:
+        db.close()
+
+# Seed label counters and fingerprint/session → label mappings from existing visits
+def backfill_labels():
+    from app.labels import backfill_label_mappings
+
+    db = SessionLocal()
+    try:
+        backfill_label_mappings(db)
+    except Exception as ex:
+        db.rollback()
+        logs.warning("label_backfill_skipped", error=str(ex))
+    finally:
+        db.close()
+
+# Keep monthly partitions ahead of the clock (app.partitions). Retention runs from `python -m app.partitions`;
+# a worker that finds another pass in progress moves on instead of waiting for it.
+def maintain_table_partitions():
+    from app.partitions import maintain_partitions
+
+    db = SessionLocal()
+    try:
+        report = maintain_partitions(db, retention=False)
+        if report["skipped"]:
+            logs.info("partitions_busy", sampled=False)
+        elif report["created"]:
+            logs.info("partitions_created", sampled=False, created=report["created"])
+    except Exception as ex:
+        db.rollback()
+        logs.warning("partition_maintenance_skipped", error=str(ex))
+    finally:
+        db.close()
@@ -0,0 +1,130 @@
+# Write-behind buffer for /log-event: rows are queued in memory and bulk-inserted
+# into visitor_event_logs on a size or time threshold. Opt-in via EVENT_WRITE_BEHIND=1.
+
+import os
+import time
+import uuid
+import asyncio
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.models import VisitorEventLog
+from app.uniques import add_uniques
+from app import logs
+
+EVENT_WRITE_BEHIND = os.getenv("EVENT_WRITE_BEHIND", "0") == "1"
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))   # Seconds
+EVENT_QUEUE_MAX = int(os.getenv("EVENT_QUEUE_MAX", "50000"))
+EVENT_FLUSH_RETRIES = int(os.getenv("EVENT_FLUSH_RETRIES", "3"))
+EVENT_BATCH_MAX_EVENTS = int(os.getenv("EVENT_BATCH_MAX_EVENTS", "500"))   # Per /log-events request
+
+
+class EventBuffer:
+    def __init__(self, enabled=EVENT_WRITE_BEHIND, batch_size=EVENT_BATCH_SIZE,
+                 flush_interval=EVENT_FLUSH_INTERVAL, max_queue=EVENT_QUEUE_MAX):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.pending = []
+        self.wakeup = None
+        self.task = None
+        self.stopping = False
+        self.stats = {
+            "queued": 0,
+            "flushed": 0,
+            "dropped_queue_full": 0,
+            "dropped_flush_failed": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    # Queue one row; returns an ack token, or None if the event was dropped
+    def submit(self, row: dict):
+        if len(self.pending) >= self.max_queue:
+            self.stats["dropped_queue_full"] += 1
+            return None
+
+        ack = uuid.uuid4().hex
+        self.pending.append(row)
+        self.stats["queued"] += 1
+        if len(self.pending) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+        return ack
+
+    def start(self):
+        if not self.enabled or self.task is not None:
+            return
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        logs.info("event_buffer_started", sampled=False, batch_size=self.batch_size, flush_interval=self.flush_interval)
+
+    # Stop the flusher and drain whatever is still queued
+    async def stop(self):
+        if self.task is None:
+            return
+        self.stopping = True
+        self.wakeup.set()
+        await self.task
+        self.task = None
+        logs.info("event_buffer_drained", sampled=False, **self.snapshot())
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            while self.pending:
+                await self.flush()
+                if len(self.pending) < self.batch_size and not self.stopping:
+                    break
+
+    async def flush(self):
+        from app.db import async_engine
+
+        batch = self.pending[:self.batch_size]
+        del self.pending[:len(batch)]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        for attempt in range(EVENT_FLUSH_RETRIES):
+            try:
+                async with async_engine.begin() as conn:
+                    await conn.execute(insert(VisitorEventLog), batch)
+                    await conn.run_sync(lambda sync_conn: add_uniques(Session(bind=sync_conn), batch))
+                break
+            except Exception as ex:
+                self.stats["flush_failures"] += 1
+                logs.warning("event_flush_failed", attempt=attempt + 1, rows=len(batch), error=str(ex))
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        else:
+            self.stats["dropped_flush_failed"] += len(batch)
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["flushes"] += 1
+        self.stats["flushed"] += len(batch)
+        self.stats["last_flush_ms"] = round(elapsed_ms, 2)
+        self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 2)
+        self.stats["total_flush_ms"] += elapsed_ms
+
+    def snapshot(self):
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "queue_depth": len(self.pending),
+            "avg_flush_ms": round(self.stats["total_flush_ms"] / flushes, 2) if flushes else None,
+        }
+
+
+event_buffer = EventBuffer()
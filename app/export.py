@@ -0,0 +1,206 @@
+# Purpose: Columnar (Parquet / Arrow IPC) export of VisitorLog, VisitorEventLog and VisitorDerivedLog.
+# Files are partitioned by day and exports are incremental: each run picks up after the last exported id.
+#
+# CLI: python -m app.export [--table visits|events|derived|all] [--format parquet|arrow] [--full]
+
+import os
+import json
+import argparse
+from datetime import datetime
+
+from sqlalchemy import select, DateTime, Float, Integer
+from sqlalchemy.orm import Session
+
+from app.models import VisitorLog, VisitorEventLog, VisitorDerivedLog
+from app.intel import WEIGHTS, extract_entropy_field
+from app.profiles import log_columns, with_profile
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "50000"))
+
+EXPORT_TABLES = {
+    "visits": VisitorLog,
+    "events": VisitorEventLog,
+    "derived": VisitorDerivedLog,
+}
+EXPORT_FORMATS = {"parquet": "parquet", "arrow": "arrow"}   # format -> file extension
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError as ex:
+        raise RuntimeError("Columnar export needs pyarrow (pip install pyarrow)") from ex
+    return pyarrow
+
+
+# Arrow schema: every scalar column, with the entropy JSONB flattened into the WEIGHTS fields
+def export_schema(model):
+    pa = _pyarrow()
+    fields = []
+    for column in log_columns(model).values():
+        if column.name == "entropy_data":
+            continue
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _flatten(model, row: dict) -> dict:
+    if "entropy_data" not in log_columns(model):
+        return row
+    row = dict(row)
+    entropy = row.pop("entropy_data", None) or {}
+    for key in WEIGHTS:
+        value = extract_entropy_field(entropy, key) if entropy else row.get(key)
+        row[key] = str(value) if value is not None else None
+    return row
+
+
+def rows_to_table(model, rows):
+    pa = _pyarrow()
+    schema = export_schema(model)
+    flat = [_flatten(model, row) for row in rows]
+    columns = {}
+    for field in schema:
+        values = [row.get(field.name) for row in flat]
+        if pa.types.is_string(field.type):
+            values = [str(v) if v is not None else None for v in values]
+        columns[field.name] = values
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+# Row mappings in id order, fetched through a server-side cursor one chunk at a time
+def iter_chunks(db: Session, model, after_id: int = 0, chunk_size: int = EXPORT_CHUNK_SIZE, where=()):
+    columns = list(log_columns(model).values())
+    query = (
+        with_profile(select(*columns), model, columns)
+        .where(model.id > after_id, *where)
+        .order_by(model.id.asc())
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for partition in db.execute(query).mappings().partitions():
+        yield [dict(row) for row in partition]
+
+
+def write_table(table, path: str, fmt: str):
+    pa = _pyarrow()
+    if fmt == "parquet":
+        pa.parquet.write_table(table, path, compression="zstd")
+    else:
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _day(row):
+    ts = row.get("timestamp")
+    return ts.strftime("%Y-%m-%d") if isinstance(ts, datetime) else "unknown"
+
+
+def _state_path(out_dir):
+    return os.path.join(out_dir, "_export_state.json")
+
+def load_state(out_dir: str = EXPORT_DIR) -> dict:
+    try:
+        with open(_state_path(out_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_state(state: dict, out_dir: str = EXPORT_DIR):
+    tmp = _state_path(out_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, _state_path(out_dir))
+
+
+# Export rows newer than the stored watermark into <out_dir>/<name>/date=YYYY-MM-DD/part-<first>-<last>.<ext>
+def export_table(db: Session, name: str, out_dir: str = EXPORT_DIR, fmt: str = "parquet",
+                 chunk_size: int = EXPORT_CHUNK_SIZE, full: bool = False) -> dict:
+    model = EXPORT_TABLES[name]
+    ext = EXPORT_FORMATS[fmt]
+    os.makedirs(out_dir, exist_ok=True)
+
+    state = load_state(out_dir)
+    state_key = f"{name}.{fmt}"
+    after_id = 0 if full else state.get(state_key, 0)
+    stats = {"table": name, "format": fmt, "after_id": after_id, "rows": 0, "files": 0, "bytes": 0}
+
+    for chunk in iter_chunks(db, model, after_id, chunk_size):
+        by_day = {}
+        for row in chunk:
+            by_day.setdefault(_day(row), []).append(row)
+
+        for day, rows in by_day.items():
+            partition = os.path.join(out_dir, name, f"date={day}")
+            os.makedirs(partition, exist_ok=True)
+            path = os.path.join(partition, f"part-{rows[0]['id']:012d}-{rows[-1]['id']:012d}.{ext}")
+            write_table(rows_to_table(model, rows), path, fmt)
+            stats["files"] += 1
+            stats["bytes"] += os.path.getsize(path)
+
+        # Advance the watermark only after the whole chunk is on disk
+        stats["rows"] += len(chunk)
+        state[state_key] = chunk[-1]["id"]
+        save_state(state, out_dir)
+
+    stats["last_id"] = state.get(state_key, after_id)
+    print(f"📦 Exported {stats['rows']} {name} rows → {stats['files']} {fmt} files ({stats['bytes']} bytes)")
+    return stats
+
+
+# Single-file export for the download endpoint (row groups written chunk by chunk)
+def export_to_file(db: Session, name: str, path: str, fmt: str = "parquet", after_id: int = 0,
+                   chunk_size: int = EXPORT_CHUNK_SIZE, where=()) -> int:
+    pa = _pyarrow()
+    model = EXPORT_TABLES[name]
+    schema = export_schema(model)
+    rows = 0
+
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(path, schema, compression="zstd")
+    else:
+        sink = pa.OSFile(path, "wb")
+        writer = pa.ipc.new_file(sink, schema)
+    try:
+        for chunk in iter_chunks(db, model, after_id, chunk_size, where):
+            writer.write_table(rows_to_table(model, chunk))
+            rows += len(chunk)
+    finally:
+        writer.close()
+        if fmt != "parquet":
+            sink.close()
+    return rows
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Columnar export of visitor logs")
+    parser.add_argument("--table", choices=[*EXPORT_TABLES, "all"], default="all")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and export everything")
+    args = parser.parse_args(argv)
+
+    names = list(EXPORT_TABLES) if args.table == "all" else [args.table]
+    db = SessionLocal()
+    try:
+        results = [export_table(db, name, args.out, args.format, args.chunk_size, args.full) for name in names]
+    finally:
+        db.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Purpose: MinHash / LSH index over the free-text entropy fields (user agent, GPU renderer), so
+# near matches — browser version bumps, driver updates — are shortlisted without a pairwise
+# SequenceMatcher scan. Every distinct value is stored once (entropy_fuzzy_values) with LSH_BANDS
+# band keys (entropy_fuzzy_bands); values sharing a band are verified with fuzzy_match and add
+# weight × ratio to the weighted score of every signature carrying them.
+#
+# Bands shared by more than FUZZY_BUCKET_MAX distinct values (boilerplate such as "Mozilla/5.0 ...")
+# are ignored, the same way a text index skips stop words.
+
+import os
+import json
+import zlib
+import hashlib
+
+import numpy as np
+
+ENTROPY_FUZZY = os.getenv("ENTROPY_FUZZY", "false").lower() in ("1", "true", "yes")
+FUZZY_FIELDS = ["user_agent", "gpu_renderer"]
+FUZZY_THRESHOLD = float(os.getenv("ENTROPY_FUZZY_THRESHOLD", "0.9"))      # Min SequenceMatcher ratio
+FUZZY_SHORTLIST_MAX = int(os.getenv("ENTROPY_FUZZY_SHORTLIST", "50"))     # Near values verified per field
+FUZZY_BUCKET_MAX = int(os.getenv("ENTROPY_FUZZY_BUCKET_MAX", "500"))      # Larger buckets are stop-bands
+
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16   # 16 bands × 4 rows: shingle Jaccard 0.7 collides with p ≈ 0.99, 0.3 with p ≈ 0.12
+
+# Fixed seed: band keys are persisted, so the permutations must never change between processes
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(73_451_014)
+_A = _rng.integers(1, int(_PRIME), MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+# Text the fuzzy comparison sees (same as fuzzy_match's str())
+def fuzzy_text(value) -> str:
+    return str(value)
+
+
+def shingles(text: str) -> np.ndarray:
+    grams = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)) % _PRIME
+
+def minhash(text: str) -> np.ndarray:
+    return ((np.outer(shingles(text), _A) + _B) % _PRIME).min(axis=0)
+
+# LSH band keys for one field value (hashed like entropy_term so they fit the same column)
+def band_terms(key: str, value) -> list:
+    signature = minhash(fuzzy_text(value))
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [
+        hashlib.sha1(f"{key}\x1f{band}\x1f{signature[band * rows:(band + 1) * rows].tobytes().hex()}".encode()).hexdigest()[:24]
+        for band in range(LSH_BANDS)
+    ]
+
+# Top `limit` near values by shared bands (ties: text order), as (value, shared) pairs
+def rank_near(shared: dict, limit: int = FUZZY_SHORTLIST_MAX) -> list:
+    return sorted(shared.items(), key=lambda item: (-item[1], fuzzy_text(item[0])))[:limit]
+
+
+# Batch variant for app.rescore: near (query code, candidate code, ratio) pairs for one field, with the
+# same stop-bands, ranking and cap as the live lookup. `values` is the field vocabulary (JSON text per
+# code); the candidate side is every value carried by a signature.
+def near_pairs(key: str, values: list, query_codes: np.ndarray, cand_codes: np.ndarray,
+               limit: int = FUZZY_SHORTLIST_MAX, bucket_max: int = FUZZY_BUCKET_MAX):
+    from app.intel import fuzzy_match
+
+    texts = [fuzzy_text(json.loads(v)) for v in values]
+    cand_codes = cand_codes[cand_codes >= 0]
+    codes = np.union1d(np.unique(query_codes[query_codes >= 0]), np.unique(cand_codes))
+    if not len(codes):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+
+    # Band id per (code, band); bucket sizes count distinct candidate values, like entropy_fuzzy_bands
+    term_ids = {}
+    bands = np.full((len(values), LSH_BANDS), -1, dtype=np.int64)
+    for code in codes.tolist():
+        bands[code] = [term_ids.setdefault(term, len(term_ids)) for term in band_terms(key, json.loads(values[code]))]
+    cand_values = np.unique(cand_codes)
+    usable = np.bincount(bands[cand_values].reshape(-1), minlength=len(term_ids)) <= bucket_max
+
+    # Candidate values per bucket, then (query value, candidate value, shared bands)
+    c_bands = bands[cand_values].reshape(-1)
+    c_code = np.repeat(cand_values, LSH_BANDS)
+    keep = usable[c_bands]
+    c_bands, c_code = c_bands[keep], c_code[keep]
+    order = np.argsort(c_bands, kind="stable")
+    c_sorted, c_code = c_bands[order], c_code[order]
+
+    q_values = np.unique(query_codes[query_codes >= 0])
+    q_bands = bands[q_values].reshape(-1)
+    q_code = np.repeat(q_values, LSH_BANDS)
+    lo = np.searchsorted(c_sorted, q_bands, side="left")
+    counts = np.searchsorted(c_sorted, q_bands, side="right") - lo
+    counts[~usable[q_bands]] = 0
+    starts = np.cumsum(counts) - counts
+    qa = np.repeat(q_code, counts)
+    cb = c_code[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+    distinct = qa != cb
+    pairs, shared = np.unique(np.column_stack([qa[distinct], cb[distinct]]), axis=0, return_counts=True)
+    if not len(pairs):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+
+    # Keep the top `limit` per query value (shared desc, text asc) and verify with SequenceMatcher
+    text_rank = np.empty(len(values), dtype=np.int64)
+    text_rank[np.argsort(np.asarray(texts, dtype=object), kind="stable")] = np.arange(len(values))
+    order = np.lexsort((text_rank[pairs[:, 1]], -shared, pairs[:, 0]))
+    pairs = pairs[order]
+    first = np.searchsorted(pairs[:, 0], pairs[:, 0], side="left")
+    pairs = pairs[np.arange(len(pairs)) - first < limit]
+
+    ratios = np.asarray([fuzzy_match(texts[a], texts[b]) for a, b in pairs.tolist()], dtype=np.float64)
+    near = ratios >= FUZZY_THRESHOLD
+    return pairs[near, 0], pairs[near, 1], ratios[near]
@@ -1,62 +1,223 @@
 import os
 import json
-from google.oauth2 import service_account
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+import argparse
+from datetime import datetime
 
-# Load GA4 credentials from Render environment
-credentials_json = os.getenv("GA4_CREDENTIALS_JSON")
-if not credentials_json:
-    raise ValueError("GA4_CREDENTIALS_JSON is missing.")
+from sqlalchemy import select, case, tuple_
+from sqlalchemy.orm import Session
+from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, OrderBy, RunReportRequest
 
-credentials_dict = json.loads(credentials_json)
-credentials = service_account.Credentials.from_service_account_info(credentials_dict)
+from app import logs
+from app.models import GASession
+from app.checkpoints import get_checkpoint, set_checkpoint
 
-# GA4 Property ID
-GA4_PROPERTY_ID = os.getenv("GA4_PROPERTY_ID")
-if not GA4_PROPERTY_ID:
-    raise ValueError("GA4_PROPERTY_ID is missing.")
+GA4_PAGE_SIZE = int(os.getenv("GA4_PAGE_SIZE", "10000"))        # Rows per run_report call (API max 250k)
+GA4_BACKFILL_DAYS = int(os.getenv("GA4_BACKFILL_DAYS", "30"))   # First ingest window
+GA4_WATERMARK = "ga4.sessions.watermark"                        # Checkpoint: latest stored dateHourMinute
+
+DIMENSIONS = ["dateHourMinute", "pagePath", "deviceCategory", "city", "country"]
+
+_client = None
+
+
+# GA4 client, built on first use so importing this module never needs credentials
+def get_client():
+    global _client
+    if _client is None:
+        from google.oauth2 import service_account
+        from google.analytics.data_v1beta import BetaAnalyticsDataClient
+
+        # Load GA4 credentials from Render environment
+        credentials_json = os.getenv("GA4_CREDENTIALS_JSON")
+        if not credentials_json:
+            raise ValueError("GA4_CREDENTIALS_JSON is missing.")
+
+        credentials_dict = json.loads(credentials_json)
+        credentials = service_account.Credentials.from_service_account_info(credentials_dict)
+        _client = BetaAnalyticsDataClient(credentials=credentials)
+    return _client
+
+def get_property_id():
+    # GA4 Property ID
+    property_id = os.getenv("GA4_PROPERTY_ID")
+    if not property_id:
+        raise ValueError("GA4_PROPERTY_ID is missing.")
+    return property_id
+
+
+def _session_row(row):
+    return {
+        "timestamp": row.dimension_values[0].value,
+        "page": row.dimension_values[1].value,
+        "device": row.dimension_values[2].value,
+        "city": row.dimension_values[3].value,
+        "country": row.dimension_values[4].value,
+        "sessions": row.metric_values[0].value
+    }
+
+# Page through run_report (offset/limit until row_count) — yields session dicts
+def iter_ga_sessions(start_date: str, end_date: str, client=None, property_id=None,
+                     page_size: int = GA4_PAGE_SIZE, max_rows: int = None):
+    client = client or get_client()
+    property_id = property_id or get_property_id()
+    offset = 0
+
+    while True:
+        limit = page_size if max_rows is None else min(page_size, max_rows - offset)
+        if limit <= 0:
+            return
+
+        request = RunReportRequest(
+            property=f"properties/{property_id}",
+            dimensions=[Dimension(name=name) for name in DIMENSIONS],
+            metrics=[Metric(name="sessions")],
+            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+            order_bys=[OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name="dateHourMinute"))],
+            limit=limit,
+            offset=offset,
+        )
+        response = client.run_report(request)
+
+        for row in response.rows:
+            yield _session_row(row)
+
+        offset += len(response.rows)
+        if not response.rows or offset >= response.row_count:
+            return
 
-# Client
-client = BetaAnalyticsDataClient(credentials=credentials)
 
 def fetch_ga_sessions(start_days_ago=7, end_days_ago=0, limit=10):
-    print("GA4 Property ID:", GA4_PROPERTY_ID)
 
     # Convert numeric days ago to GA4-compatible date strings
     start = f"{start_days_ago}daysAgo"
     end = f"{end_days_ago}daysAgo" if end_days_ago > 0 else "today"
 
-    request = RunReportRequest(
-        property=f"properties/{GA4_PROPERTY_ID}",
-        dimensions=[
-            Dimension(name="dateHourMinute"),
-            Dimension(name="pagePath"),
-            Dimension(name="deviceCategory"),
-            Dimension(name="city"),
-            Dimension(name="country")
-        ],
-        metrics=[Metric(name="sessions")],
-        date_ranges=[DateRange(start_date=start, end_date=end)],
-        limit=limit
+    session_data = list(iter_ga_sessions(start, end, max_rows=limit))
+
+    logs.info("ga_sessions_fetched", property_id=get_property_id(), sessions=len(session_data))
+    return session_data
+
+
+def _parse_dhm(value: str) -> datetime:
+    return datetime.strptime(value, "%Y%m%d%H%M")
+
+# Upsert a chunk of session dicts into ga_sessions (GA may still revise recent minutes). fetched_at
+# only moves when a row is new or its count changed, so Airtable pushes re-send exactly those rows.
+def store_ga_sessions(db: Session, sessions) -> int:
+    from app.db import dialect_insert
+
+    rows = [
+        {
+            "date_hour_minute": s["timestamp"],
+            "timestamp": _parse_dhm(s["timestamp"]),
+            "page": s.get("page") or "",
+            "device": s.get("device") or "",
+            "city": s.get("city") or "",
+            "country": s.get("country") or "",
+            "sessions": int(s.get("sessions") or 0),
+            "fetched_at": datetime.utcnow(),
+        }
+        for s in sessions
+    ]
+    if not rows:
+        return 0
+
+    table = GASession.__table__
+    stmt = dialect_insert(db, table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["date_hour_minute", "page", "device", "city", "country"],
+        set_={"sessions": stmt.excluded.sessions,
+              "fetched_at": case((table.c.sessions != stmt.excluded.sessions, stmt.excluded.fetched_at),
+                                 else_=table.c.fetched_at)},
     )
+    db.execute(stmt)
+    return len(rows)
+
+
+# Incremental ingest: GA date ranges are day-granular, so re-read from the watermark's day and keep
+# only minutes at or after the watermark (the watermark minute itself may have been partial)
+def ingest_ga_sessions(db: Session, client=None, property_id=None, page_size: int = GA4_PAGE_SIZE,
+                       chunk_size: int = 1000) -> dict:
+    watermark = get_checkpoint(db, GA4_WATERMARK)
+    start = _parse_dhm(watermark).strftime("%Y-%m-%d") if watermark else f"{GA4_BACKFILL_DAYS}daysAgo"
+
+    stats = {"start_date": start, "fetched": 0, "stored": 0, "watermark": watermark}
+    newest = watermark
+    chunk = []
+    for session in iter_ga_sessions(start, "today", client, property_id, page_size):
+        stats["fetched"] += 1
+        if watermark and session["timestamp"] < watermark:
+            continue
+        chunk.append(session)
+        if newest is None or session["timestamp"] > newest:
+            newest = session["timestamp"]
+        if len(chunk) >= chunk_size:
+            stats["stored"] += store_ga_sessions(db, chunk)
+            chunk = []
+    stats["stored"] += store_ga_sessions(db, chunk)
+
+    if newest is not None:
+        set_checkpoint(db, GA4_WATERMARK, newest, commit=False)
+    db.commit()
 
-    response = client.run_report(request)
+    stats["watermark"] = newest
+    logs.info("ga_ingest", sampled=False, **stats)
+    return stats
 
-    if not response.rows:
-        print("No data returned from GA4 API.")
 
-    session_data = []
-    for row in response.rows:
-        session = {
-            "timestamp": row.dimension_values[0].value,
-            "page": row.dimension_values[1].value,
-            "device": row.dimension_values[2].value,
-            "city": row.dimension_values[3].value,
-            "country": row.dimension_values[4].value,
-            "sessions": row.metric_values[0].value
+# Stored sessions in the shape fetch_ga_sessions returns (for Airtable pushes / dashboards)
+def stored_ga_sessions(db: Session, since: datetime = None, limit: int = None):
+    query = select(GASession).order_by(GASession.date_hour_minute.asc(), GASession.id.asc())
+    if since is not None:
+        query = query.where(GASession.timestamp >= since)
+    if limit is not None:
+        query = query.limit(limit)
+    return [
+        {
+            "timestamp": s.date_hour_minute,
+            "page": s.page,
+            "device": s.device,
+            "city": s.city,
+            "country": s.country,
+            "sessions": s.sessions,
         }
-        session_data.append(session)
+        for s in db.execute(query).scalars()
+    ]
+
+
+# Change cursor of a stored row: fetched_at, with the id breaking ties (sorts as text like the tuple)
+def ga_sync_cursor(fetched_at: datetime, row_id: int) -> str:
+    return f"{fetched_at:%Y-%m-%dT%H:%M:%S.%f}|{row_id:012d}"
+
+# Rows stored or revised after `cursor` (oldest change first), as (session dict, cursor) pairs
+def ga_sessions_changed_since(db: Session, cursor: str = None, limit: int = 1000) -> list:
+    query = select(GASession).order_by(GASession.fetched_at.asc(), GASession.id.asc()).limit(limit)
+    if cursor:
+        fetched_at, row_id = cursor.split("|")
+        query = query.where(tuple_(GASession.fetched_at, GASession.id) > (datetime.fromisoformat(fetched_at), int(row_id)))
+    return [
+        ({"timestamp": s.date_hour_minute, "page": s.page, "device": s.device, "city": s.city,
+          "country": s.country, "sessions": s.sessions}, ga_sync_cursor(s.fetched_at, s.id))
+        for s in db.execute(query).scalars()
+    ]
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+    from app.airtable import push_stored_ga_sessions
+
+    parser = argparse.ArgumentParser(description="Incremental GA4 session ingest")
+    parser.add_argument("--push-airtable", action="store_true", help="push new / revised sessions to Airtable afterwards")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        ingest_ga_sessions(db)
+        if args.push_airtable:
+            push_stored_ga_sessions(db)
+    finally:
+        db.close()
+
 
-    print("Sessions fetched:", session_data)
-    return session_data
\ No newline at end of file
+if __name__ == "__main__":
+    main()
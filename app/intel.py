@@ -1,8 +1,19 @@
 # app/intel.py
 
+import os
+import hashlib
+import json
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.models import VisitorLog
+from app.models import (
+    VisitorLog, EntropyProfile, EntropySignature, EntropySignatureTerm, EntropyFuzzyValue, EntropyFuzzyBand,
+)
+from app.fuzzy import (ENTROPY_FUZZY, FUZZY_FIELDS, FUZZY_THRESHOLD, FUZZY_BUCKET_MAX,
+                       band_terms, fuzzy_text, rank_near)
 from difflib import SequenceMatcher
+from app import logs
 
 # Field weights
 WEIGHTS = {
@@ -22,39 +33,121 @@ WEIGHTS = {
 
 THRESHOLD = 0.8  # Do NOT raise unless you're getting too many false positives.
 
+TOTAL_WEIGHT = sum(WEIGHTS.values())
+
+# High-weight fields used to shortlist candidates from the signature index
+BLOCKING_FIELDS = [key for key, weight in WEIGHTS.items() if weight >= 2.0]
+
+# Opt-in cap on the signatures (newest first) the non-blocking fallback scan may consider.
+# 0 (default) scans the whole index, which keeps the lookup exact.
+ALIAS_FALLBACK_CANDIDATES = int(os.getenv("ALIAS_FALLBACK_CANDIDATES", "0"))
+
 # Fuzzy match between two values
 def fuzzy_match(val1, val2):
     if not val1 or not val2:
         return 0.0
     return SequenceMatcher(None, str(val1), str(val2)).ratio()
 
+# Entropy payload keys for each weighted field
+ENTROPY_FIELD_MAP = {
+    "user_agent": ["userAgent"],
+    "screen_res": ["screen"],
+    "color_depth": ["colorDepth"],
+    "timezone": ["timezone"],
+    "language": ["language"],
+    "platform": ["platform"],
+    "device_memory": ["deviceMemory"],
+    "cpu_cores": ["hardwareConcurrency"],
+    "gpu_vendor": ["webglVendor"],
+    "gpu_renderer": ["webglRenderer"],
+    "canvas_hash": ["canvas"],
+    "audio_hash": ["audio"],
+}
+
 # Extract entropy fields
 def extract_entropy_field(entropy: dict, key: str):
-    field_map = {
-        "user_agent": ["userAgent"],
-        "screen_res": ["screen"],
-        "color_depth": ["colorDepth"],
-        "timezone": ["timezone"],
-        "language": ["language"],
-        "platform": ["platform"],
-        "device_memory": ["deviceMemory"],
-        "cpu_cores": ["hardwareConcurrency"],
-        "gpu_vendor": ["webglVendor"],
-        "gpu_renderer": ["webglRenderer"],
-        "canvas_hash": ["canvas"],
-        "audio_hash": ["audio"],
-    }
-    for alias in field_map.get(key, []):
+    for alias in ENTROPY_FIELD_MAP.get(key, []):
         if alias in entropy:
             return entropy[alias]
     return None
 
-# Compute most probable alias + best match always
-def get_probable_alias(db: Session, entropy_data: dict, current_fingerprint: str = None):
+# Values the reference scorer's == treats as equal (8 / 8.0, True / 1) must hash to the same term
+def canonical_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [canonical_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: canonical_value(item) for key, item in value.items()}
+    return value
+
+# Hashed index term for one entropy field value
+def entropy_term(key: str, value) -> str:
+    raw = f"{key}\x1f{json.dumps(canonical_value(value), sort_keys=True, default=str)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+# Terms for every weighted field present in an entropy payload
+def entropy_terms(entropy: dict) -> dict:
+    terms = {}
+    for key in WEIGHTS:
+        value = extract_entropy_field(entropy or {}, key)
+        if value is not None:
+            terms[key] = entropy_term(key, value)
+    return terms
+
+# Content hash of the weighted fields (rows with identical profiles share one signature)
+def entropy_signature(terms: dict) -> str:
+    raw = "|".join(f"{key}={terms[key]}" for key in sorted(terms))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _match_result(best_alias, best_score):
+    probable_alias = best_alias if best_score >= THRESHOLD else None
+
+    logs.debug("alias_match", probable_alias=probable_alias, best_alias=best_alias, score=round(best_score, 4))
+
+    return {
+        "probable_alias": probable_alias,
+        "probable_score": best_score if probable_alias else None,
+        "best_match_alias": best_alias,
+        "best_match_score": best_score,
+    }
+
+
+# Weighted share of fields two entropy payloads agree on (per-row reference scorer)
+def score_match(entropy_data: dict, past_entropy: dict) -> float:
+    match_score = 0.0
+    total_weight = 0.0
+    for key, weight in WEIGHTS.items():
+        current_value = extract_entropy_field(entropy_data, key)
+        past_value = extract_entropy_field(past_entropy or {}, key)
+        if current_value is not None and past_value is not None and current_value == past_value:
+            match_score += weight
+        total_weight += weight
+    if ENTROPY_FUZZY:
+        for key in FUZZY_FIELDS:
+            match_score += fuzzy_contribution(
+                key, extract_entropy_field(entropy_data, key), extract_entropy_field(past_entropy or {}, key)
+            )
+    return match_score / total_weight if total_weight > 0 else 0.0
+
+# Partial credit for a near (not equal) free-text value: weight × SequenceMatcher ratio
+def fuzzy_contribution(key: str, current_value, past_value) -> float:
+    if current_value is None or past_value is None or current_value == past_value:
+        return 0.0
+    ratio = fuzzy_match(fuzzy_text(current_value), fuzzy_text(past_value))
+    return WEIGHTS[key] * ratio if ratio >= FUZZY_THRESHOLD else 0.0
+
+
+# Reference scorer: scans every logged row (kept for parity checks and re-scoring jobs)
+def get_probable_alias_bruteforce(db: Session, entropy_data: dict, current_fingerprint: str = None):
     candidates = (
-        db.query(VisitorLog)
-        .filter(VisitorLog.entropy_data.isnot(None))
+        db.query(VisitorLog.visitor_alias, EntropyProfile.entropy_data)
+        .join(EntropyProfile, EntropyProfile.id == VisitorLog.entropy_profile_id)
         .filter(VisitorLog.fingerprint_id != current_fingerprint)
+        .order_by(VisitorLog.id.asc())
         .all()
     )
 
@@ -66,34 +159,294 @@ def get_probable_alias(db: Session, entropy_data: dict, current_fingerprint: str
             "best_match_score": 0.0,
         }
 
-    def score_match(past: VisitorLog) -> float:
-        match_score = 0.0
-        total_weight = 0.0
-        for key, weight in WEIGHTS.items():
-            current_value = extract_entropy_field(entropy_data, key)
-            past_value = extract_entropy_field(past.entropy_data or {}, key)
-            if current_value is not None and past_value is not None and current_value == past_value:
-                match_score += weight
-            total_weight += weight
-        return match_score / total_weight if total_weight > 0 else 0.0
-
     ranked = sorted(
-        [(p.visitor_alias, score_match(p)) for p in candidates if p.visitor_alias],
+        [(p.visitor_alias, score_match(entropy_data, p.entropy_data)) for p in candidates if p.visitor_alias],
         key=lambda x: x[1],
         reverse=True,
     )
 
     best_alias, best_score = ranked[0] if ranked else (None, 0.0)
-    probable_alias = best_alias if best_score >= THRESHOLD else None
+    return _match_result(best_alias, best_score)
 
-    if probable_alias:
-        print(f"🧠 Probable alias match: {probable_alias} (Score: {best_score:.2f})")
-    else:
-        print(f"🧐 No alias passed threshold. Best match: {best_alias} (Score: {best_score:.2f})")
 
-    return {
-        "probable_alias": probable_alias,
-        "probable_score": best_score if probable_alias else None,
-        "best_match_alias": best_alias,
-        "best_match_score": best_score,
-    }
\ No newline at end of file
+# Best-scoring signature among those sharing at least one of `terms`
+def _best_signature(db: Session, terms: list, current_fingerprint: str = None, shortlist_terms: list = None,
+                    before_id: int = None, after_signature_id: int = None):
+    weight = case(WEIGHTS, value=EntropySignatureTerm.field, else_=0.0)
+    score = func.sum(weight)
+
+    query = (
+        db.query(EntropySignature.visitor_alias, score.label("score"), EntropySignature.first_log_id)
+        .join(EntropySignatureTerm, EntropySignatureTerm.signature_id == EntropySignature.id)
+        .filter(EntropySignatureTerm.term.in_(terms))
+        .filter(EntropySignature.fingerprint_id != current_fingerprint)
+    )
+    if before_id is not None:
+        query = query.filter(EntropySignature.first_log_id < before_id)
+    if after_signature_id is not None:
+        query = query.filter(EntropySignature.id > after_signature_id)
+    if shortlist_terms is not None:
+        shortlist = (
+            db.query(EntropySignatureTerm.signature_id)
+            .filter(EntropySignatureTerm.term.in_(shortlist_terms))
+        )
+        query = query.filter(EntropySignature.id.in_(shortlist))
+
+    return (
+        query.group_by(EntropySignature.id, EntropySignature.visitor_alias, EntropySignature.first_log_id)
+        .order_by(score.desc(), EntropySignature.first_log_id.asc())
+        .first()
+    )
+
+# Signatures whose free-text fields are near (LSH shortlist, SequenceMatcher-verified) to the visitor's,
+# as (visitor_alias, exact + fuzzy score, first_log_id)
+def _fuzzy_candidates(db: Session, entropy_data: dict, terms: dict, current_fingerprint: str = None,
+                      before_id: int = None):
+    near = {}   # signature id -> {field: fuzzy contribution}
+    meta = {}   # signature id -> (visitor_alias, first_log_id)
+    for key in FUZZY_FIELDS:
+        value = extract_entropy_field(entropy_data, key)
+        if value is None:
+            continue
+        bands = (
+            db.query(EntropyFuzzyBand.band)
+            .filter(EntropyFuzzyBand.band.in_(band_terms(key, value)))
+            .group_by(EntropyFuzzyBand.band)
+            .having(func.count() <= FUZZY_BUCKET_MAX)
+        )
+        shared = func.count().label("shared")
+        rows = (
+            db.query(EntropyFuzzyValue.term, EntropyFuzzyValue.value, shared)
+            .join(EntropyFuzzyBand, EntropyFuzzyBand.value_id == EntropyFuzzyValue.id)
+            .filter(EntropyFuzzyBand.band.in_([band for band, in bands]))
+            .filter(EntropyFuzzyValue.term != terms[key])
+            .group_by(EntropyFuzzyValue.id, EntropyFuzzyValue.term, EntropyFuzzyValue.value)
+            .all()
+        )
+
+        contributions = {}   # value term -> weight × ratio
+        texts = {text: term for term, text, _ in rows}
+        for text, _ in rank_near({text: count for _, text, count in rows}):
+            contribution = fuzzy_contribution(key, value, text)
+            if contribution:
+                contributions[texts[text]] = contribution
+        if not contributions:
+            continue
+
+        carriers = (
+            db.query(EntropySignatureTerm.term, EntropySignature.id, EntropySignature.visitor_alias,
+                     EntropySignature.first_log_id)
+            .join(EntropySignature, EntropySignature.id == EntropySignatureTerm.signature_id)
+            .filter(EntropySignatureTerm.term.in_(list(contributions)))
+            .filter(EntropySignature.fingerprint_id != current_fingerprint)
+        )
+        if before_id is not None:
+            carriers = carriers.filter(EntropySignature.first_log_id < before_id)
+        for term, sig_id, alias, first_log_id in carriers:
+            meta[sig_id] = (alias, first_log_id)
+            near.setdefault(sig_id, {})[key] = contributions[term]
+
+    if not near:
+        return []
+
+    weight = case(WEIGHTS, value=EntropySignatureTerm.field, else_=0.0)
+    exact = dict(
+        db.query(EntropySignatureTerm.signature_id, func.sum(weight))
+        .filter(EntropySignatureTerm.term.in_(list(terms.values())))
+        .filter(EntropySignatureTerm.signature_id.in_(list(near)))
+        .group_by(EntropySignatureTerm.signature_id)
+        .all()
+    )
+    candidates = []
+    for sig_id, contributions in near.items():
+        score = exact.get(sig_id) or 0.0
+        for key in FUZZY_FIELDS:
+            score += contributions.get(key, 0.0)
+        alias, first_log_id = meta[sig_id]
+        candidates.append((alias, score, first_log_id))
+    return candidates
+
+# Compute most probable alias + best match always (indexed; same result as the brute-force scan
+# unless ALIAS_FALLBACK_CANDIDATES is set).
+# `before_id` restricts candidates to signatures first seen before that visit (deferred scoring).
+def get_probable_alias(db: Session, entropy_data: dict, current_fingerprint: str = None, before_id: int = None):
+    terms = entropy_terms(entropy_data)
+    best = None
+
+    blocking_terms = [term for key, term in terms.items() if key in BLOCKING_FIELDS]
+    if blocking_terms:
+        best = _best_signature(db, list(terms.values()), current_fingerprint, blocking_terms, before_id)
+
+    # A candidate outside the shortlist can score at most the weight of the non-blocking fields.
+    # Widen past the shortlist only when that could beat (or tie) the shortlisted best. That is the
+    # usual case for a new device, and common terms (timezone, language) match most of the index.
+    # With ALIAS_FALLBACK_CANDIDATES set, the widened scan only looks at that many newest signatures:
+    # best_match_* for such visitors can then name a weaker match than the brute-force scan (an older
+    # signature is missed). probable_alias is unaffected while the bound stays below THRESHOLD (with
+    # the default weights it is at most 8/19); if it could reach it, the scan stays unbounded.
+    bound = sum(WEIGHTS[key] for key in terms if key not in BLOCKING_FIELDS)
+    if terms and (best is None or best.score <= bound):
+        after_id = None
+        if ALIAS_FALLBACK_CANDIDATES > 0 and bound / TOTAL_WEIGHT < THRESHOLD:
+            newest = db.query(func.max(EntropySignature.id)).scalar() or 0
+            after_id = newest - ALIAS_FALLBACK_CANDIDATES if newest > ALIAS_FALLBACK_CANDIDATES else None
+        widened = _best_signature(db, list(terms.values()), current_fingerprint, before_id=before_id,
+                                  after_signature_id=after_id)
+        if widened is not None and (best is None or (widened.score, -widened.first_log_id) > (best.score, -best.first_log_id)):
+            best = widened
+
+    if best is not None:
+        best = (best.visitor_alias, best.score, best.first_log_id)
+    if ENTROPY_FUZZY:
+        for candidate in _fuzzy_candidates(db, entropy_data, terms, current_fingerprint, before_id):
+            if best is None or (candidate[1], -candidate[2]) > (best[1], -best[2]):
+                best = candidate
+
+    if best is not None:
+        return _match_result(best[0], best[1] / TOTAL_WEIGHT)
+
+    # Nothing shares a field: the brute-force scan reports the oldest candidate at 0.0
+    oldest = db.query(EntropySignature.visitor_alias).filter(EntropySignature.fingerprint_id != current_fingerprint)
+    if before_id is not None:
+        oldest = oldest.filter(EntropySignature.first_log_id < before_id)
+    oldest = oldest.order_by(EntropySignature.first_log_id.asc()).first()
+    if oldest is None:
+        return {
+            "probable_alias": None,
+            "probable_score": 0.0,
+            "best_match_alias": None,
+            "best_match_score": 0.0,
+        }
+    return _match_result(oldest.visitor_alias, 0.0)
+
+
+# Add a freshly inserted visit to the signature index (no-op if its profile is already known).
+# Callers that still hold the request payload pass it in to skip loading the visit's profile.
+def index_entropy_signature(db: Session, record: VisitorLog, entropy_data: dict = None):
+    if entropy_data is None:
+        entropy_data = record.entropy_data
+    if entropy_data is None or not record.visitor_alias or not record.fingerprint_id:
+        return
+
+    terms = entropy_terms(entropy_data)
+    signature = entropy_signature(terms)
+
+    exists = (
+        db.query(EntropySignature.id, EntropySignature.first_log_id)
+        .filter(EntropySignature.visitor_alias == record.visitor_alias)
+        .filter(EntropySignature.fingerprint_id == record.fingerprint_id)
+        .filter(EntropySignature.signature == signature)
+        .first()
+    )
+    if exists:
+        if exists.first_log_id > record.id:   # Visits indexed out of order (deferred workers)
+            db.query(EntropySignature).filter(EntropySignature.id == exists.id) \
+                .update({EntropySignature.first_log_id: record.id}, synchronize_session=False)
+        return
+
+    try:
+        with db.begin_nested():
+            entry = EntropySignature(
+                visitor_alias=record.visitor_alias,
+                fingerprint_id=record.fingerprint_id,
+                signature=signature,
+                first_log_id=record.id,
+            )
+            db.add(entry)
+            db.flush()
+            db.add_all([
+                EntropySignatureTerm(signature_id=entry.id, field=key, term=term)
+                for key, term in terms.items()
+            ])
+    except IntegrityError:
+        return  # Another worker indexed the same profile concurrently
+
+    if ENTROPY_FUZZY:
+        index_fuzzy_values(db, fuzzy_values(entropy_data, terms))
+
+
+# (field, exact term, text) for the free-text fields of a payload
+def fuzzy_values(entropy: dict, terms: dict) -> list:
+    values = []
+    for key in FUZZY_FIELDS:
+        value = extract_entropy_field(entropy or {}, key)
+        if value is not None:
+            values.append((key, terms[key], fuzzy_text(value)))
+    return values
+
+# Add unseen free-text values (and their LSH bands) to the fuzzy index
+def index_fuzzy_values(db: Session, values: list):
+    from app.db import dialect_insert
+
+    for key, term, text in values:
+        inserted = db.execute(
+            dialect_insert(db, EntropyFuzzyValue.__table__)
+            .values(field=key, term=term, value=text)
+            .on_conflict_do_nothing(index_elements=["term"])
+            .returning(EntropyFuzzyValue.id)
+        ).scalar()
+        if inserted is not None:
+            db.add_all([EntropyFuzzyBand(band=band, value_id=inserted) for band in band_terms(key, text)])
+    db.flush()
+
+
+# Rebuild the signature index from visitor_logs (backfill / after changing extract_entropy_field).
+# Ingest waits on the index tables until it commits (python -m app.backfill runs it as a deploy step).
+def rebuild_signature_index(db: Session, chunk_size: int = 5000) -> int:
+    from app.db import lock_for_rebuild
+
+    lock_for_rebuild(db, EntropySignature.__table__, EntropySignatureTerm.__table__,
+                     EntropyFuzzyValue.__table__, EntropyFuzzyBand.__table__)
+    db.query(EntropySignatureTerm).delete(synchronize_session=False)
+    db.query(EntropySignature).delete(synchronize_session=False)
+    db.query(EntropyFuzzyBand).delete(synchronize_session=False)
+    db.query(EntropyFuzzyValue).delete(synchronize_session=False)
+
+    seen = {}
+    fuzzy = {}   # exact term -> (field, text)
+    rows = (
+        db.query(VisitorLog.id, VisitorLog.visitor_alias, VisitorLog.fingerprint_id, EntropyProfile.entropy_data)
+        .join(EntropyProfile, EntropyProfile.id == VisitorLog.entropy_profile_id)
+        .filter(VisitorLog.visitor_alias.isnot(None))
+        .filter(VisitorLog.fingerprint_id.isnot(None))
+        .order_by(VisitorLog.id.asc())
+        .yield_per(chunk_size)
+    )
+    for log_id, alias, fingerprint_id, entropy in rows:
+        terms = entropy_terms(entropy)
+        key = (alias, fingerprint_id, entropy_signature(terms))
+        if key not in seen:
+            seen[key] = (log_id, terms)
+            if ENTROPY_FUZZY:
+                for field, term, text in fuzzy_values(entropy, terms):
+                    fuzzy.setdefault(term, (field, text))
+
+    entries = [
+        (EntropySignature(
+            visitor_alias=alias,
+            fingerprint_id=fingerprint_id,
+            signature=signature,
+            first_log_id=log_id,
+        ), terms)
+        for (alias, fingerprint_id, signature), (log_id, terms) in seen.items()
+    ]
+    db.add_all([entry for entry, _ in entries])
+    db.flush()
+    db.add_all([
+        EntropySignatureTerm(signature_id=entry.id, field=key, term=term)
+        for entry, terms in entries
+        for key, term in terms.items()
+    ])
+
+    values = [EntropyFuzzyValue(field=field, term=term, value=text) for term, (field, text) in fuzzy.items()]
+    db.add_all(values)
+    db.flush()
+    db.add_all([
+        EntropyFuzzyBand(band=band, value_id=value.id)
+        for value in values
+        for band in band_terms(value.field, value.value)
+    ])
+
+    db.commit()
+    logs.info("signature_index_rebuilt", sampled=False, signatures=len(seen))
+    return len(seen)
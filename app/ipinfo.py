@@ -1,19 +1,197 @@
 import os
+import time
+import asyncio
+import json
+import sqlite3
+import ipaddress
+import threading
+from collections import OrderedDict
+
+import httpx
 import requests
 
 IPINFO_TOKEN = os.getenv("IPINFO_TOKEN")
+IPINFO_TIMEOUT = float(os.getenv("IPINFO_TIMEOUT", "2.0"))
+
+# Cache settings (TTL in seconds). IPINFO_CACHE_PATH enables the SQLite tier that survives restarts.
+IPINFO_CACHE_SIZE = int(os.getenv("IPINFO_CACHE_SIZE", "10000"))
+IPINFO_CACHE_TTL = int(os.getenv("IPINFO_CACHE_TTL", str(24 * 3600)))
+IPINFO_NEGATIVE_TTL = int(os.getenv("IPINFO_NEGATIVE_TTL", "300"))
+IPINFO_CACHE_PATH = os.getenv("IPINFO_CACHE_PATH")
+
+
+# SQLite-backed second tier (one row per IP, expiry stored alongside)
+class DiskCache:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ip_cache (ip TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self.purge_expired()
+
+    def get(self, ip):
+        with self.lock:
+            row = self.conn.execute("SELECT data, expires_at FROM ip_cache WHERE ip = ?", (ip,)).fetchone()
+        if row is None:
+            return None
+        data, expires_at = row
+        if expires_at < time.time():
+            return None
+        return json.loads(data), expires_at
+
+    def set(self, ip, data, expires_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ip_cache (ip, data, expires_at) VALUES (?, ?, ?)",
+                (ip, json.dumps(data), expires_at),
+            )
+
+    def purge_expired(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM ip_cache WHERE expires_at < ?", (time.time(),))
+
+
+# Bounded in-process cache keyed by IP with per-entry TTL and LRU eviction
+class IPCache:
+    def __init__(self, max_size=IPINFO_CACHE_SIZE, disk=None):
+        self.max_size = max_size
+        self.disk = disk
+        self.entries = OrderedDict()   # ip -> (data, expires_at)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "disk_hits": 0, "negative_hits": 0}
+
+    def get(self, ip):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(ip)
+            if entry is not None:
+                if entry[1] >= now:
+                    self.entries.move_to_end(ip)
+                    self.stats["hits"] += 1
+                    if not entry[0]:
+                        self.stats["negative_hits"] += 1
+                    return entry[0]
+                del self.entries[ip]
+                self.stats["expired"] += 1
+
+        if self.disk is not None:
+            stored = self.disk.get(ip)
+            if stored is not None:
+                with self.lock:
+                    self._put(ip, *stored)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                return stored[0]
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, ip, data, ttl):
+        expires_at = time.time() + ttl
+        with self.lock:
+            self._put(ip, data, expires_at)
+        if self.disk is not None:
+            self.disk.set(ip, data, expires_at)
+
+    def _put(self, ip, data, expires_at):
+        self.entries[ip] = (data, expires_at)
+        self.entries.move_to_end(ip)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+ip_cache = IPCache(disk=DiskCache(IPINFO_CACHE_PATH) if IPINFO_CACHE_PATH else None)
+http = requests.Session()
+async_http = None   # httpx.AsyncClient, created on first use inside the running loop
+
+
+# Private, loopback, link-local and malformed addresses never resolve on ipinfo.io
+def is_routable_ip(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except (TypeError, ValueError):
+        return False
+    return addr.is_global
+
+
+def cache_stats():
+    with ip_cache.lock:
+        return {**ip_cache.stats, "size": len(ip_cache.entries), "max_size": ip_cache.max_size}
+
+
+def _ipinfo_url(ip):
+    return f"https://ipinfo.io/{ip}?token={IPINFO_TOKEN}"
+
+def _enriched_fields(ip, data):
+    return {
+        "IP Address": ip,
+        "City": data.get("city"),
+        "Region": data.get("region"),
+        "Country": data.get("country"),
+        "Organization": data.get("org")
+    }
 
 def enrich_ip_data(ip):
-    url = f"https://ipinfo.io/{ip}?token={IPINFO_TOKEN}"
+    cached = ip_cache.get(ip)
+    if cached is not None:
+        return cached
+
+    if not is_routable_ip(ip):
+        ip_cache.set(ip, {}, IPINFO_CACHE_TTL)
+        return {}
+
+    try:
+        response = http.get(_ipinfo_url(ip), timeout=IPINFO_TIMEOUT)
+        response.raise_for_status()
+        enriched = _enriched_fields(ip, response.json())
+        ip_cache.set(ip, enriched, IPINFO_CACHE_TTL)
+        return enriched
+    except Exception:
+        # Negative-cache failures briefly so a flapping upstream isn't hammered per event
+        ip_cache.set(ip, {}, IPINFO_NEGATIVE_TTL)
+        return {}
+
+
+# Non-blocking variant for async routes; the SQLite tier (if enabled) is touched off the loop
+async def _cache_call(method, *args):
+    if ip_cache.disk is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+async def enrich_ip_data_async(ip):
+    global async_http
+
+    cached = await _cache_call(ip_cache.get, ip)
+    if cached is not None:
+        return cached
+
+    if not is_routable_ip(ip):
+        await _cache_call(ip_cache.set, ip, {}, IPINFO_CACHE_TTL)
+        return {}
+
+    if async_http is None:
+        async_http = httpx.AsyncClient(timeout=IPINFO_TIMEOUT)
+
     try:
-        response = requests.get(url)
-        data = response.json()
-        return {
-            "IP Address": ip,
-            "City": data.get("city"),
-            "Region": data.get("region"),
-            "Country": data.get("country"),
-            "Organization": data.get("org")
-        }
+        response = await async_http.get(_ipinfo_url(ip))
+        response.raise_for_status()
+        enriched = _enriched_fields(ip, response.json())
+        await _cache_call(ip_cache.set, ip, enriched, IPINFO_CACHE_TTL)
+        return enriched
     except Exception:
-        return {}
\ No newline at end of file
+        await _cache_call(ip_cache.set, ip, {}, IPINFO_NEGATIVE_TTL)
+        return {}
+
+async def close_async_http():
+    global async_http
+    if async_http is not None:
+        await async_http.aclose()
+        async_http = None
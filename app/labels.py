@@ -0,0 +1,139 @@
+# Allocates Visitor_NNN / Session_NNN labels from counter rows instead of
+# COUNT(DISTINCT) scans, and remembers fingerprint/session → label mappings.
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+from app import logs
+from app.models import VisitorLog, LabelCounter, VisitorAliasMap, SessionLabelMap
+
+LABEL_CACHE_SIZE = int(os.getenv("LABEL_CACHE_SIZE", "50000"))
+LABEL_BACKFILL_LOCK_ID = 73_451_006
+
+# kind -> (mapping model, key column, label column, label prefix)
+LABEL_KINDS = {
+    "visitor": (VisitorAliasMap, "fingerprint_id", "visitor_alias", "Visitor"),
+    "session": (SessionLabelMap, "session_id", "session_label", "Session"),
+}
+
+
+# Mappings never change once committed, so every worker can cache them freely
+class LabelCache:
+    def __init__(self, max_size=LABEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            label = self.entries.get(key)
+            if label is not None:
+                self.entries.move_to_end(key)
+            return label
+
+    def set(self, key, label):
+        with self.lock:
+            self.entries[key] = label
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+label_cache = LabelCache()
+
+
+def format_label(prefix: str, number: int) -> str:
+    return f"{prefix}_{str(number).zfill(3)}"
+
+
+# Missing ids share one mapping, as the old `fingerprint_id IS NULL` lookup did
+def _mapping_key(value):
+    return value if value is not None else ""
+
+
+def _lookup(db: Session, kind: str, key: str):
+    model, key_column, label_column, _ = LABEL_KINDS[kind]
+    return db.execute(
+        select(getattr(model, label_column)).where(getattr(model, key_column) == key)
+    ).scalar()
+
+
+# Returns (label, existed). Runs inside the caller's transaction; new labels become visible on commit.
+def resolve_label(db: Session, kind: str, value):
+    key = _mapping_key(value)
+    cached = label_cache.get((kind, key))
+    if cached is not None:
+        return cached, True
+
+    label = _lookup(db, kind, key)
+    if label is not None:
+        label_cache.set((kind, key), label)
+        return label, True
+
+    # Miss: serialize allocators on the counter row, then re-check in case another request won
+    model, key_column, label_column, prefix = LABEL_KINDS[kind]
+    db.execute(select(LabelCounter.value).where(LabelCounter.name == kind).with_for_update()).scalar_one()
+
+    label = _lookup(db, kind, key)
+    if label is not None:
+        label_cache.set((kind, key), label)
+        return label, True
+
+    number = db.execute(
+        update(LabelCounter)
+        .where(LabelCounter.name == kind)
+        .values(value=LabelCounter.value + 1)
+        .returning(LabelCounter.value)
+    ).scalar_one()
+    label = format_label(prefix, number)
+    db.add(model(**{key_column: key, label_column: label}))
+    db.flush()
+    return label, False
+
+
+# Migration: build the mapping tables + counters from existing visitor_logs rows (init_db, every worker).
+# On first boot one worker backfills and the others wait on a transaction-level advisory lock, then find
+# the counter committed; they can't serve without it, so they wait rather than skip.
+def backfill_label_mappings(db: Session, chunk_size: int = 5000):
+    for kind, (model, key_column, label_column, prefix) in LABEL_KINDS.items():
+        if db.get(LabelCounter, kind) is not None:
+            continue
+        if db.bind.dialect.name == "postgresql":
+            db.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LABEL_BACKFILL_LOCK_ID})
+            if db.execute(select(LabelCounter.value).where(LabelCounter.name == kind)).first() is not None:
+                db.rollback()   # Another worker finished it while we waited
+                continue
+
+        log_key = getattr(VisitorLog, key_column)
+        log_label = getattr(VisitorLog, label_column)
+        first_labels = {}
+        rows = (
+            db.query(log_key, log_label)
+            .filter(log_label.isnot(None))
+            .order_by(VisitorLog.id.asc())
+            .yield_per(chunk_size)
+        )
+        for key, label in rows:
+            first_labels.setdefault(_mapping_key(key), label)
+
+        db.bulk_insert_mappings(model, [
+            {key_column: key, label_column: label} for key, label in first_labels.items()
+        ])
+
+        # Continue numbering after both the highest label and the old COUNT(DISTINCT) value
+        pattern = re.compile(rf"^{prefix}_(\d+)$")
+        numbers = [int(m.group(1)) for m in map(pattern.match, set(first_labels.values())) if m]
+        start = max([len(set(first_labels.values()))] + numbers)
+
+        db.add(LabelCounter(name=kind, value=start))
+        db.commit()
+        logs.info("labels_backfilled", sampled=False, kind=kind, labels=len(first_labels), counter=start)
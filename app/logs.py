@@ -0,0 +1,65 @@
+# Purpose: Leveled, sampled structured logging for the request paths (one JSON object per line).
+#
+# LOG_LEVEL=OFF silences it entirely; LOG_SAMPLE_RATE keeps only a fraction of the per-request
+# INFO/DEBUG lines (warnings and errors are never sampled out). Request bodies are only logged at
+# DEBUG. Callers pass fields as-is; the line is only formatted (timestamp, JSON) once it passes the
+# level and sample checks, so a disabled line costs one level check.
+# Lifecycle lines (startup, shutdown, backfills) pass sampled=False so sampling never drops them.
+
+import os
+import sys
+import json
+import random
+import logging
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))   # Fraction of sampled lines kept
+
+
+# Resolves sys.stdout per record, so contextlib.redirect_stdout (benchmarks, CLI jobs) still captures lines
+class StdoutHandler(logging.StreamHandler):
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+logger = logging.getLogger("visitor_intel")
+logger.propagate = False
+
+if LOG_LEVEL == "OFF":
+    logger.disabled = True
+else:
+    logger.setLevel(LOG_LEVEL)
+    handler = StdoutHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+
+def enabled(level: int, sampled: bool = False) -> bool:
+    if not logger.isEnabledFor(level):
+        return False
+    return not sampled or level >= logging.WARNING or random.random() < LOG_SAMPLE_RATE
+
+# One structured line: {"ts", "level", "event", **fields}; `sampled` lines obey LOG_SAMPLE_RATE
+def log(level: int, event: str, sampled: bool = False, **fields):
+    if not enabled(level, sampled):
+        return
+    line = {"ts": datetime.now(timezone.utc).isoformat(), "level": logging.getLevelName(level), "event": event, **fields}
+    logger.log(level, json.dumps(line, default=str))
+
+def debug(event: str, **fields):
+    log(logging.DEBUG, event, sampled=True, **fields)
+
+def info(event: str, sampled: bool = True, **fields):
+    log(logging.INFO, event, sampled=sampled, **fields)
+
+def warning(event: str, **fields):
+    log(logging.WARNING, event, **fields)
+
+def error(event: str, **fields):
+    log(logging.ERROR, event, **fields)
@@ -1,17 +1,41 @@
+import time
+import asyncio
+
 from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, insert, update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone
-from typing import Optional
+from typing import List, Optional
 
-from app.db import get_db, init_db
-from app.ipinfo import enrich_ip_data
-from app.models import VisitorLog, VisitorEventLog, VisitorDerivedLog
+from app.db import get_async_db, init_db, close_async_db, AsyncSessionLocal
+from app.ipinfo import enrich_ip_data_async, close_async_http
+from app.models import VisitorLog, VisitorEventLog, to_naive_utc
 from app import dashboard
-from app.intel import get_probable_alias
+from app.intel import get_probable_alias, index_entropy_signature
+from app.event_buffer import event_buffer, EVENT_BATCH_MAX_EVENTS
+from app.payloads import decode_body, PayloadError
+from app.codec import CodecJSONResponse, decode_model
+from app.labels import resolve_label
+from app.profiles import resolve_profile
+from app.uniques import add_uniques
+from app.session_state import get_state_async, save_visit_state_async, first_visit, page_visit
+from app.spool import ingest_spool, SpoolFull, SpoolEntryFailed, transient
+from app.checkpoints import set_checkpoint
+from app.visit_jobs import (
+    VISIT_PIPELINE, visit_worker, apply_enrichment, apply_match, derive_visit, enqueue_visit,
+)
+from app import logs
+from app.metrics import (
+    stage, track_round_trips, render as render_metrics, request_errors_total, ingest_requests_total,
+    visit_request_seconds, visit_db_round_trips, event_batch_size,
+)
 
-app = FastAPI()
+app = FastAPI(default_response_class=CodecJSONResponse)
 app.include_router(dashboard.router)
 
 app.add_middleware(
@@ -29,10 +53,30 @@ app.add_middleware(
 def on_startup():
     init_db()
 
+@app.on_event("startup")
+async def start_background_writers():
+    event_buffer.start()
+    if VISIT_PIPELINE == "deferred":
+        visit_worker.start()
+    ingest_spool.start(replay_spooled)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await ingest_spool.stop()
+    await event_buffer.stop()
+    await asyncio.to_thread(visit_worker.stop)
+    await close_async_http()
+    await close_async_db()
+
 @app.get("/")
 def root():
     return {"status": "Visitor Intel API is running"}
 
+# ✅ Prometheus scrape target
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 class VisitLog(BaseModel):
     page: str
     referrer: str
@@ -47,142 +91,175 @@ class VisitLog(BaseModel):
     entropy_data: Optional[dict] = None
     client_timestamp: Optional[str] = None
 
-@app.post("/log-visit")
-async def log_visitor(request: Request, db: Session = Depends(get_db)):
+# Typed request body decoded from the raw bytes by app.codec (FastAPI would go through request.json());
+# invalid bodies still get FastAPI's 422, and the model still shows up in the OpenAPI schema
+async def json_body(request: Request, model):
     try:
-        body = await request.json()
-        print("🧾 Incoming JSON body:", body)
+        return decode_model(await request.body(), model)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
 
-        visit = VisitLog(**body)
-        ip = request.client.host
-        enriched = enrich_ip_data(ip)
-        entropy = visit.entropy_data or {}
+def body_schema(model) -> dict:
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
 
-        try:
-            parsed_client_ts = (
-                datetime.fromisoformat(visit.client_timestamp.replace("Z", "+00:00"))
-                if visit.client_timestamp else None
-            )
-        except Exception as e:
-            print("⚠️ Invalid client timestamp:", e)
-            parsed_client_ts = None
-
-        subquery = (
-            db.query(VisitorLog.visitor_alias)
-            .filter(VisitorLog.fingerprint_id == visit.fingerprint_id)
-            .filter(VisitorLog.visitor_alias.isnot(None))
-            .order_by(VisitorLog.id.asc())
-            .first()
-        )
-        visitor_alias = subquery[0] if subquery else f"Visitor_{str(db.query(VisitorLog.visitor_alias).filter(VisitorLog.visitor_alias.isnot(None)).distinct().count() + 1).zfill(3)}"
-
-        subquery = (
-            db.query(VisitorLog.session_label)
-            .filter(VisitorLog.session_id == visit.session_id)
-            .filter(VisitorLog.session_label.isnot(None))
-            .order_by(VisitorLog.id.asc())
-            .first()
-        )
-        session_label = subquery[0] if subquery else f"Session_{str(db.query(VisitorLog.session_label).filter(VisitorLog.session_label.isnot(None)).distinct().count() + 1).zfill(3)}"
+def parse_client_timestamp(value: Optional[str], route: str):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+    except Exception as e:
+        request_errors_total.inc(route, "InvalidClientTimestamp")
+        logs.warning("invalid_client_timestamp", route=route, error=str(e))
+        return None
+
+# Raw visitor_logs row: everything known at request time (enrichment/scoring columns left empty).
+# `received_at` is the original arrival time of a spooled request.
+def visit_record(visit: VisitLog, ip: str, visitor_alias: str, session_label: str, profile_id: int,
+                 received_at: Optional[datetime] = None) -> VisitorLog:
+    arrival = {"timestamp": received_at} if received_at else {}
+    return VisitorLog(
+        **arrival,
+        page=visit.page,
+        referrer=visit.referrer,
+        device=visit.device,
+        session_id=visit.session_id,
+        fingerprint_id=visit.fingerprint_id,
+        ip_address=ip,
+        utm_source=visit.utm_source,
+        utm_medium=visit.utm_medium,
+        utm_campaign=visit.utm_campaign,
+        utm_term=visit.utm_term,
+        utm_content=visit.utm_content,
+        entropy_profile_id=profile_id,
+        visitor_alias=visitor_alias,
+        session_label=session_label,
+        client_timestamp=to_naive_utc(parse_client_timestamp(visit.client_timestamp, "/log-visit")),
+    )
 
-        print("🧠 Alias assignment:", visitor_alias, session_label)
+# (visitor alias, session label, returning session); a cached session already has its labels
+def visit_labels(db: Session, visit: VisitLog, state: dict):
+    if state is not None and state["fingerprint_id"] == visit.fingerprint_id:
+        return state["visitor_alias"], state["session_label"], True
+    visitor_alias, _ = resolve_label(db, "visitor", visit.fingerprint_id)
+    if state is not None:
+        return visitor_alias, state["session_label"], True
+    session_label, returning_session = resolve_label(db, "session", visit.session_id)
+    return visitor_alias, session_label, returning_session
+
+# Synchronous part of /log-visit; runs through AsyncSession.run_sync so it never blocks the loop.
+# `state` is the session's cached state, read (and later written) by the caller outside run_sync:
+# the Redis backend does network I/O. Returns the row id and the arguments for save_visit_state_async.
+# `in_transaction(db)` runs just before the commit (spool replay moves its checkpoint there).
+def record_visit(db: Session, visit: VisitLog, ip: str, enriched: dict, state: Optional[dict],
+                 received_at: Optional[datetime] = None, in_transaction=None) -> tuple:
+    with stage("probable_alias"):
+        match_result = get_probable_alias(db, visit.entropy_data or {}, visit.fingerprint_id)
+
+    # Label allocation holds the counter row lock until commit, so it runs after scoring
+    with stage("alias_allocation"):
+        visitor_alias, session_label, returning_session = visit_labels(db, visit, state)
+
+    logs.debug("visit_aliases", visitor_alias=visitor_alias, session_label=session_label, **match_result)
+
+    with stage("entropy_profile"):
+        profile_id = resolve_profile(db, visit.entropy_data)
+    record = visit_record(visit, ip, visitor_alias, session_label, profile_id, received_at)
+    apply_enrichment(record, enriched)
+    apply_match(record, match_result)
+
+    with stage("insert"):
+        db.add(record)
+        db.flush()
+        index_entropy_signature(db, record, visit.entropy_data)
+
+    with stage("derived"):
+        known = (first_visit(state), state["hits"] + 1) if state and state["hits"] is not None else None
+        earliest, hits = derive_visit(db, record, returning_session, known)
+    if in_transaction is not None:
+        in_transaction(db)
+    with stage("commit"):
+        db.commit()  # Visit, signature, derived row and rollups land in one transaction
+
+    return record.id, (state, record, earliest, hits, visitor_alias, session_label)
+
+# Deferred pipeline, phase one: raw visit + job row in one transaction (app.visit_jobs does the rest)
+def record_raw_visit(db: Session, visit: VisitLog, ip: str, state: Optional[dict],
+                     received_at: Optional[datetime] = None, in_transaction=None) -> tuple:
+    with stage("alias_allocation"):
+        visitor_alias, session_label, returning_session = visit_labels(db, visit, state)
+    with stage("entropy_profile"):
+        profile_id = resolve_profile(db, visit.entropy_data)
+
+    record = visit_record(visit, ip, visitor_alias, session_label, profile_id, received_at)
+    with stage("insert"):
+        db.add(record)
+        db.flush()
+        enqueue_visit(db, record, returning_session)
+    if in_transaction is not None:
+        in_transaction(db)
+    with stage("commit"):
+        db.commit()
 
-        match_result = get_probable_alias(db, entropy, visit.fingerprint_id)
-        probable_alias = match_result["probable_alias"]
-        probable_score = match_result["probable_score"]
-        best_match_alias = match_result["best_match_alias"]
-        best_match_score = match_result["best_match_score"]
+    return record.id, (state, record, None, None, visitor_alias, session_label)
 
-        if probable_alias:
-            print(f"🤖 Probable match detected: {probable_alias} (Score: {probable_score:.2f})")
-        else:
-            print(f"🔎 No confident match. Best guess: {best_match_alias} (Score: {best_match_score:.2f})")
-
-        record = VisitorLog(
-            page=visit.page,
-            referrer=visit.referrer,
-            device=visit.device,
-            session_id=visit.session_id,
-            fingerprint_id=visit.fingerprint_id,
-            ip_address=ip,
-            city=enriched.get("City"),
-            region=enriched.get("Region"),
-            country=enriched.get("Country"),
-            organization=enriched.get("Organization"),
-            enriched_source="IPinfo",
-            utm_source=visit.utm_source,
-            utm_medium=visit.utm_medium,
-            utm_campaign=visit.utm_campaign,
-            utm_term=visit.utm_term,
-            utm_content=visit.utm_content,
-            entropy_data=visit.entropy_data,
-            user_agent=entropy.get("userAgent"),
-            screen_res=entropy.get("screen"),
-            color_depth=entropy.get("colorDepth"),
-            timezone=entropy.get("timezone"),
-            language=entropy.get("language"),
-            platform=entropy.get("platform"),
-            device_memory=entropy.get("deviceMemory"),
-            cpu_cores=entropy.get("hardwareConcurrency"),
-            gpu_vendor=entropy.get("webglVendor"),
-            gpu_renderer=entropy.get("webglRenderer"),
-            canvas_hash=entropy.get("canvas"),
-            audio_hash=entropy.get("audio"),
-            visitor_alias=visitor_alias,
-            session_label=session_label,
-            probable_alias=probable_alias,
-            probable_score=probable_score,
-            best_match_alias=best_match_alias,
-            best_match_score=best_match_score,
-            client_timestamp=parsed_client_ts,
-        )
+# ✅ Spool first (INGEST_SPOOL=1): the validated body is on local disk before the handler answers;
+# enrichment and Postgres happen on replay (replay_spooled). Returns None when the spool write itself
+# failed, and the caller falls back to the direct path.
+async def spool_request(route: str, kind: str, payload: dict, ip: str) -> Optional[dict]:
+    try:
+        seq = await ingest_spool.append(kind, payload, ip)
+    except SpoolFull as ex:
+        request_errors_total.inc(route, "SpoolFull")
+        logs.warning("spool_full", route=route, error=str(ex))
+        return {"status": "error", "reason": "SpoolFull"}
+    except Exception as ex:
+        request_errors_total.inc(route, "SpoolWriteFailed")
+        logs.error("spool_write_failed", route=route, error_type=type(ex).__name__, error=str(ex))
+        return None
+    return {"status": "spooled", "seq": seq}
 
-        db.add(record)
-        db.commit()
-        db.refresh(record)
-
-        visit_type = "Returning" if subquery else "New"
-        traffic_type = "Direct"
-        if visit.utm_source:
-            traffic_type = "Paid"
-        elif visit.referrer and visit.referrer != "Direct":
-            traffic_type = "Referral"
-
-        entry_page = visit.page
-        if visit.session_id:
-            earliest = db.query(VisitorLog).filter(VisitorLog.session_id == visit.session_id).order_by(VisitorLog.timestamp.asc()).first()
-            if earliest:
-                entry_page = earliest.page
-
-        session_entries = db.query(VisitorLog).filter(VisitorLog.session_id == visit.session_id).count()
-        bounced = "Yes" if session_entries <= 1 else "No"
-
-        geo_region_type = "Domestic" if enriched.get("Country") == "IN" else "International"
-        landing_source = "utm" if visit.utm_source else ("referrer" if visit.referrer and visit.referrer != "Direct" else "direct")
-
-        derived = VisitorDerivedLog(
-            session_id=visit.session_id,
-            fingerprint_id=visit.fingerprint_id,
-            visit_type=visit_type,
-            traffic_type=traffic_type,
-            entry_page=entry_page,
-            bounced=bounced,
-            geo_region_type=geo_region_type,
-            landing_source=landing_source,
-        )
 
-        db.add(derived)
-        db.commit()
+@app.post("/log-visit", openapi_extra=body_schema(VisitLog))
+async def log_visitor(request: Request, db: AsyncSession = Depends(get_async_db)):
+    started = time.perf_counter()
+    round_trips = track_round_trips()
+    status = "error"
+    try:
+        with stage("validation"):
+            visit = decode_model(await request.body(), VisitLog)
+            logs.debug("visit_body", body=visit.__dict__)
+
+        ip = request.client.host
+        if ingest_spool.running:
+            spooled = await spool_request("/log-visit", "visit", visit.model_dump(), ip)
+            if spooled is not None:
+                status = spooled["status"]
+                return spooled
+
+        state = await get_state_async(visit.session_id)
+        if VISIT_PIPELINE == "deferred":
+            record_id, state_update = await db.run_sync(record_raw_visit, visit, ip, state)
+        else:
+            with stage("ip_enrichment"):
+                enriched = await enrich_ip_data_async(ip)
+            record_id, state_update = await db.run_sync(record_visit, visit, ip, enriched, state)
+        await save_visit_state_async(*state_update)
 
-        print("✅ Record inserted into PostgreSQL:", record.id)
-        return {"status": "success", "db_id": record.id}
+        status = "success"
+        logs.info("visit_logged", db_id=record_id, page=visit.page, db_round_trips=round_trips[0],
+                  ms=round((time.perf_counter() - started) * 1000, 2))
+        return {"status": "success", "db_id": record_id}
 
     except ValidationError as e:
-        print("❌ Validation Error:", e)
+        request_errors_total.inc("/log-visit", "ValidationError")
+        logs.warning("visit_rejected", reason="ValidationError", errors=e.errors())
         return {"status": "error", "reason": "ValidationError", "detail": e.errors()}
     except Exception as ex:
-        print("❌ Unexpected error:", ex)
+        request_errors_total.inc("/log-visit", type(ex).__name__)
+        logs.error("visit_failed", reason="InternalServerError", error_type=type(ex).__name__, error=str(ex))
         return {"status": "error", "reason": "InternalServerError"}
+    finally:
+        ingest_requests_total.inc("/log-visit", status)
+        visit_request_seconds.observe(status, value=time.perf_counter() - started)
+        visit_db_round_trips.observe(value=round_trips[0])
 
 
 class EventLog(BaseModel):
@@ -196,97 +273,290 @@ class EventLog(BaseModel):
     entropy_data: Optional[dict] = None
     client_timestamp: Optional[str] = None
 
-@app.post("/log-event")
-def log_event(event: EventLog, request: Request, db: Session = Depends(get_db)):
-    print("📍 Event received:", event.dict())
-
-    ip = request.client.host
-    enriched = enrich_ip_data(ip)
-    entropy = event.entropy_data or {}
-
-    try:
-        parsed_client_ts = (
-            datetime.fromisoformat(event.client_timestamp.replace("Z", "+00:00"))
-            if event.client_timestamp else None
-        )
-    except Exception as e:
-        print("⚠️ Invalid client timestamp on event:", e)
-        parsed_client_ts = None
-
-    record = VisitorEventLog(
-        session_id=event.session_id,
-        fingerprint_id=event.fingerprint_id,
-        event_type=event.event_type,
-        event_data=event.event_data,
-        page=event.page,
-        referrer=event.referrer,
-        device=event.device,
+# Columns shared by every event of one page/session (entropy profile + IP enrichment)
+def event_envelope(source, ip: str, enriched: dict, profile_id: int) -> dict:
+    return dict(
+        session_id=source.session_id,
+        fingerprint_id=source.fingerprint_id,
+        page=source.page,
+        referrer=source.referrer,
+        device=source.device,
         ip_address=ip,
         city=enriched.get("City"),
         region=enriched.get("Region"),
         country=enriched.get("Country"),
         organization=enriched.get("Organization"),
         enriched_source="IPinfo",
-        entropy_data=event.entropy_data,
-        user_agent=entropy.get("userAgent"),
-        screen_res=entropy.get("screen"),
-        color_depth=entropy.get("colorDepth"),
-        timezone=entropy.get("timezone"),
-        language=entropy.get("language"),
-        platform=entropy.get("platform"),
-        device_memory=entropy.get("deviceMemory"),
-        cpu_cores=entropy.get("hardwareConcurrency"),
-        gpu_vendor=entropy.get("webglVendor"),
-        gpu_renderer=entropy.get("webglRenderer"),
-        canvas_hash=entropy.get("canvas"),
-        audio_hash=entropy.get("audio"),
-        timestamp=datetime.utcnow(),
-        client_timestamp=parsed_client_ts,
+        entropy_profile_id=profile_id,
+    )
+
+# Column values for one VisitorEventLog row (shared by the direct and write-behind paths)
+def event_row(event, envelope: dict, route: str = "/log-event", received_at: Optional[datetime] = None) -> dict:
+    return dict(
+        envelope,
+        event_type=event.event_type,
+        event_data=event.event_data,
+        timestamp=received_at or datetime.utcnow(),
+        client_timestamp=to_naive_utc(parse_client_timestamp(event.client_timestamp, route)),
     )
 
+async def single_event_row(db: AsyncSession, event: EventLog, ip: str, received_at: Optional[datetime] = None,
+                           enriched: Optional[dict] = None) -> dict:
+    enriched = enriched if enriched is not None else await enrich_ip_data_async(ip)
+    profile_id = await db.run_sync(resolve_profile, event.entropy_data)
+    return event_row(event, event_envelope(event, ip, enriched, profile_id), "/log-event", received_at)
+
+@app.post("/log-event", openapi_extra=body_schema(EventLog))
+async def log_event(request: Request, db: AsyncSession = Depends(get_async_db)):
+    event = await json_body(request, EventLog)
+    logs.debug("event_body", body=event.__dict__)
+
+    ip = request.client.host
+    if ingest_spool.running:
+        spooled = await spool_request("/log-event", "event", event.model_dump(), ip)
+        if spooled is not None:
+            ingest_requests_total.inc("/log-event", spooled["status"])
+            return spooled
+
+    row = await single_event_row(db, event, ip)
+
+    if event_buffer.enabled:
+        await db.commit()   # A new profile must be visible to the flusher's connection
+        ack = event_buffer.submit(row)
+        if ack is None:
+            request_errors_total.inc("/log-event", "EventQueueFull")
+            ingest_requests_total.inc("/log-event", "error")
+            return {"status": "error", "reason": "EventQueueFull"}
+        ingest_requests_total.inc("/log-event", "queued")
+        return {"status": "event-queued", "ack": ack}
+
+    record = VisitorEventLog(**row)
     db.add(record)
-    db.commit()
-    db.refresh(record)
+    await db.run_sync(add_uniques, [row])
+    await db.commit()
+    await db.refresh(record)
 
-    print("✅ Event inserted into DB:", record.id)
+    ingest_requests_total.inc("/log-event", "success")
+    logs.info("event_logged", event_id=record.id, event_type=event.event_type)
     return {"status": "event-logged", "event_id": record.id}
 
 
+# ✅ Batched events: one envelope (session, fingerprint, page, entropy) + many interactions
+class BatchEvent(BaseModel):
+    event_type: str
+    event_data: Optional[str] = None
+    page: Optional[str] = None       # Defaults to the envelope's page
+    client_timestamp: Optional[str] = None
+
+class EventBatch(BaseModel):
+    session_id: str
+    fingerprint_id: str
+    page: str
+    referrer: str
+    device: str
+    entropy_data: Optional[dict] = None
+    events: List[BatchEvent]
+
+async def event_batch_rows(db: AsyncSession, batch: EventBatch, ip: str, received_at: Optional[datetime] = None,
+                           enriched: Optional[dict] = None) -> list:
+    enriched = enriched if enriched is not None else await enrich_ip_data_async(ip)   # Once per batch
+    profile_id = await db.run_sync(resolve_profile, batch.entropy_data)
+    envelope = event_envelope(batch, ip, enriched, profile_id)
+    return [
+        event_row(event, {**envelope, "page": event.page} if event.page else envelope, "/log-events", received_at)
+        for event in batch.events
+    ]
+
+# Accepts JSON (also as text/plain from navigator.sendBeacon), gzip bodies and msgpack (?format=msgpack)
+@app.post("/log-events")
+async def log_events(request: Request, format: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    try:
+        body = decode_body(await request.body(), request.headers.get("content-type"),
+                           request.headers.get("content-encoding"), format)
+        batch = EventBatch.model_validate(body)
+        if len(batch.events) > EVENT_BATCH_MAX_EVENTS:
+            raise PayloadError("TooManyEvents", f"At most {EVENT_BATCH_MAX_EVENTS} events per batch")
+    except (PayloadError, ValidationError) as ex:
+        reason = ex.reason if isinstance(ex, PayloadError) else "ValidationError"
+        request_errors_total.inc("/log-events", reason)
+        ingest_requests_total.inc("/log-events", "error")
+        logs.warning("event_batch_rejected", reason=reason, error=str(ex))
+        return {"status": "error", "reason": reason, "detail": ex.errors() if isinstance(ex, ValidationError) else ex.detail}
+
+    ip = request.client.host
+    event_batch_size.observe(value=len(batch.events))
+    if ingest_spool.running:
+        spooled = await spool_request("/log-events", "events", batch.model_dump(), ip)
+        if spooled is not None:
+            ingest_requests_total.inc("/log-events", spooled["status"])
+            return {**spooled, "count": len(batch.events)} if spooled["status"] == "spooled" else spooled
+
+    rows = await event_batch_rows(db, batch, ip)
+
+    if event_buffer.enabled:
+        await db.commit()
+        queued = sum(event_buffer.submit(row) is not None for row in rows)
+        if queued < len(rows):
+            request_errors_total.inc("/log-events", "EventQueueFull")
+        ingest_requests_total.inc("/log-events", "queued")
+        return {"status": "events-queued", "queued": queued, "dropped": len(rows) - queued}
+
+    if rows:
+        await db.execute(insert(VisitorEventLog).values(rows))   # One multi-row INSERT
+        await db.run_sync(add_uniques, rows)
+        await db.commit()
+
+    ingest_requests_total.inc("/log-events", "success")
+    logs.info("events_logged", count=len(rows), session_id=batch.session_id)
+    return {"status": "events-logged", "count": len(rows)}
+
+
 # ✅ NEW: Exit timestamp logging
 class ExitLogRequest(BaseModel):
     session_id: str
     page: str
     exit_time: str  # ISO format expected
 
-@app.post("/log-exit")
-def log_exit(data: ExitLogRequest, db: Session = Depends(get_db)):
-    try:
-        parsed_exit_ts = datetime.fromisoformat(data.exit_time.replace("Z", "+00:00"))
-
-        log = (
-            db.query(VisitorLog)
-            .filter(VisitorLog.session_id == data.session_id)
-            .filter(VisitorLog.page == data.page)
-            .order_by(VisitorLog.timestamp.desc())
-            .first()
+# Exit times without an offset are taken as UTC (client timestamps are stored the same way)
+def parse_exit_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def exit_seconds(exit_ts: datetime, client_ts: datetime):
+    if client_ts and client_ts.tzinfo is None:
+        client_ts = client_ts.replace(tzinfo=timezone.utc)
+    return int((exit_ts - client_ts).total_seconds()) if client_ts else None
+
+# Exit bookkeeping shared by /log-exit and spool replay; raises a 404 HTTPException when no visit
+# matches. The caller commits.
+async def record_exit(db: AsyncSession, data: ExitLogRequest) -> Optional[int]:
+    parsed_exit_ts = parse_exit_time(data.exit_time)
+
+    # ✅ Session-state hit: the row id and client timestamp are known, so update it directly
+    cached = page_visit(await get_state_async(data.session_id), data.page)
+    if cached:
+        log_id, client_ts = cached
+        time_on_page = exit_seconds(parsed_exit_ts, client_ts)
+        result = await db.execute(
+            update(VisitorLog).where(VisitorLog.id == log_id)
+            .values(page_exit_time=to_naive_utc(parsed_exit_ts), time_on_page=time_on_page)
         )
+        if result.rowcount:
+            return time_on_page
+
+    log = await db.scalar(
+        select(VisitorLog)
+        .filter(VisitorLog.session_id == data.session_id)
+        .filter(VisitorLog.page == data.page)
+        .order_by(VisitorLog.timestamp.desc())
+        .limit(1)
+    )
 
-        if not log:
-            raise HTTPException(status_code=404, detail="Matching visit not found")
-
-        client_ts = log.client_timestamp
-        if client_ts and client_ts.tzinfo is None:
-            client_ts = client_ts.replace(tzinfo=timezone.utc)
-
-        time_on_page = int((parsed_exit_ts - client_ts).total_seconds()) if client_ts else None
+    if not log:
+        raise HTTPException(status_code=404, detail="Matching visit not found")
 
-        log.page_exit_time = parsed_exit_ts
-        log.time_on_page = time_on_page
-        db.commit()
+    time_on_page = exit_seconds(parsed_exit_ts, log.client_timestamp)
+    log.page_exit_time = to_naive_utc(parsed_exit_ts)
+    log.time_on_page = time_on_page
+    return time_on_page
 
-        print(f"✅ Exit time logged for session {data.session_id} on {data.page}")
+@app.post("/log-exit", openapi_extra=body_schema(ExitLogRequest))
+async def log_exit(request: Request, db: AsyncSession = Depends(get_async_db)):
+    data = await json_body(request, ExitLogRequest)
+    try:
+        parse_exit_time(data.exit_time)   # A bad exit_time is rejected here, never spooled
+        if ingest_spool.running:
+            spooled = await spool_request("/log-exit", "exit", data.model_dump(), request.client.host)
+            if spooled is not None:
+                ingest_requests_total.inc("/log-exit", spooled["status"])
+                return spooled
+
+        time_on_page = await record_exit(db, data)
+        await db.commit()
+
+        ingest_requests_total.inc("/log-exit", "success")
+        logs.info("exit_logged", session_id=data.session_id, page=data.page, time_on_page=time_on_page)
         return {"status": "updated", "time_on_page": time_on_page}
 
     except Exception as ex:
-        print("❌ Error in /log-exit:", ex)
-        return {"status": "error", "reason": str(ex)}
\ No newline at end of file
+        reason = "NotFound" if isinstance(ex, HTTPException) and ex.status_code == 404 else type(ex).__name__
+        request_errors_total.inc("/log-exit", reason)
+        ingest_requests_total.inc("/log-exit", "error")
+        logs.warning("exit_failed", reason=reason, error=str(ex))
+        return {"status": "error", "reason": str(ex)}
+
+
+# ✅ Spool replay (app.spool): entries go through the same code as live requests, in spool order. Visits
+# and exits commit one at a time (labels, session state and exit matching depend on what came before);
+# a run of consecutive events becomes one multi-row INSERT. Every transaction also moves the spool
+# checkpoint, so an entry is applied exactly once even if the process dies mid-batch. Connectivity
+# errors propagate (the spool backs off and retries); any other failure is pinned on one entry and
+# raised as SpoolEntryFailed so the spool dead-letters it instead of retrying it forever.
+EVENT_KINDS = ("event", "events")
+
+async def replay_spooled(entries: list, checkpoint: str):
+    def mark(seq: int):
+        return lambda sync_db: set_checkpoint(sync_db, checkpoint, seq, commit=False)
+
+    # IP lookups don't depend on order: one concurrent lookup per distinct IP in the batch
+    ips = list({entry.ip for entry in entries if entry.kind != "exit"})
+    lookups = dict(zip(ips, await asyncio.gather(*(enrich_ip_data_async(ip) for ip in ips))))
+
+    async def apply_unit(db: AsyncSession, unit: list):
+        entry = unit[0]
+        if entry.kind in EVENT_KINDS:
+            rows = []
+            for item in unit:
+                if item.kind == "event":
+                    rows.append(await single_event_row(db, EventLog.model_validate(item.payload), item.ip,
+                                                       item.received_at, lookups[item.ip]))
+                else:
+                    rows += await event_batch_rows(db, EventBatch.model_validate(item.payload), item.ip,
+                                                   item.received_at, lookups[item.ip])
+            if rows:
+                await db.execute(insert(VisitorEventLog).values(rows))
+                await db.run_sync(add_uniques, rows)
+        elif entry.kind == "visit":
+            visit = VisitLog.model_validate(entry.payload)
+            state = await get_state_async(visit.session_id)
+            if VISIT_PIPELINE == "deferred":
+                _, state_update = await db.run_sync(record_raw_visit, visit, entry.ip, state,
+                                                    entry.received_at, mark(entry.seq))
+            else:
+                _, state_update = await db.run_sync(record_visit, visit, entry.ip, lookups[entry.ip], state,
+                                                    entry.received_at, mark(entry.seq))
+            await save_visit_state_async(*state_update)
+            return   # Committed together with the checkpoint
+        elif entry.kind == "exit":
+            data = ExitLogRequest.model_validate(entry.payload)
+            try:
+                await record_exit(db, data)
+            except HTTPException:
+                request_errors_total.inc("/log-exit", "NotFound")
+                logs.warning("spool_exit_unmatched", session_id=data.session_id, page=data.page, seq=entry.seq)
+        else:
+            logs.error("spool_entry_unknown", kind=entry.kind, seq=entry.seq)
+        await db.run_sync(mark(unit[-1].seq))
+        await db.commit()
+
+    async def apply_or_fail(db: AsyncSession, unit: list):
+        try:
+            await apply_unit(db, unit)
+        except Exception as ex:
+            await db.rollback()
+            if transient(ex):
+                raise
+            if len(unit) == 1:
+                raise SpoolEntryFailed(unit[0], ex) from ex
+            for item in unit:   # Find the bad entry of the run; the ones before it still land, in order
+                await apply_or_fail(db, [item])
+
+    async with AsyncSessionLocal() as db:
+        index = 0
+        while index < len(entries):
+            unit = [entries[index]]
+            if unit[0].kind in EVENT_KINDS:
+                while index + len(unit) < len(entries) and entries[index + len(unit)].kind in EVENT_KINDS:
+                    unit.append(entries[index + len(unit)])
+            await apply_or_fail(db, unit)
+            index += len(unit)
@@ -0,0 +1,228 @@
+# Purpose: In-process Prometheus-style metrics (counters + histograms) served as text on /metrics.
+# No client library: a handful of metric families, each guarded by its own lock, rendered in the
+# text exposition format (https://prometheus.io/docs/instrumenting/exposition_formats/).
+#
+# DB round trips are counted per request through a ContextVar that the engine's
+# before_cursor_execute hook increments; the var follows the request into AsyncSession.run_sync.
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [(self.name, _label_text(self.labels, key), value) for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}    # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, value):
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        out = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                out.append((f"{self.name}_bucket", _label_text(self.labels + ("le",), key + (bound,)), count))
+            out.append((f"{self.name}_bucket", _label_text(self.labels + ("le",), key + ("+Inf",)), series[-1]))
+            out.append((f"{self.name}_sum", _label_text(self.labels, key), round(series[-2], 6)))
+            out.append((f"{self.name}_count", _label_text(self.labels, key), series[-1]))
+        return out
+
+
+# Values read at scrape time from stats the app already keeps (IP cache, event buffer).
+# `read` returns a number, or {label value: number} when `label` is set.
+class Collected:
+    def __init__(self, name, help, read, kind="gauge", label=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+        self.label = label
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        if self.label is None:
+            return [(self.name, "", value)] if value is not None else []
+        return [(self.name, _label_text((self.label,), (key,)), v) for key, v in sorted(value.items()) if v is not None]
+
+
+registry = []
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+# ✅ /log-visit pipeline
+visit_stage_seconds = register(Histogram(
+    "visit_stage_seconds", "Time spent in each stage of /log-visit", labels=("stage",)))
+visit_request_seconds = register(Histogram(
+    "visit_request_seconds", "End-to-end /log-visit handler time", labels=("status",)))
+visit_db_round_trips = register(Histogram(
+    "visit_db_round_trips", "SQL statements executed per /log-visit request", buckets=COUNT_BUCKETS))
+request_errors_total = register(Counter(
+    "request_errors_total", "Ingest requests that failed, by route and reason", labels=("route", "reason")))
+ingest_requests_total = register(Counter(
+    "ingest_requests_total", "Ingest requests handled, by route and outcome", labels=("route", "status")))
+event_batch_size = register(Histogram(
+    "event_batch_size", "Events per /log-events request", buckets=COUNT_BUCKETS + (100, 250, 500)))
+
+# ✅ Connection pools (app.db)
+db_pool_wait_seconds = register(Histogram(
+    "db_pool_wait_seconds", "Time to check a connection out of the pool", labels=("pool",)))
+
+def _pool_values(key):
+    from app.db import pool_snapshot
+    return {name: stats.get(key) for name, stats in pool_snapshot().items()}
+
+for _key, _kind, _help in (
+    ("checkouts", "counter", "Pool checkouts"),
+    ("connects", "counter", "New DBAPI connections opened"),
+    ("invalidated", "counter", "Connections invalidated (failed pre-ping, disconnect errors)"),
+    ("timeouts", "counter", "Checkouts that gave up after DB_POOL_TIMEOUT"),
+    ("checked_out", "gauge", "Connections currently checked out"),
+    ("overflow", "gauge", "Overflow connections currently open"),
+    ("idle", "gauge", "Idle connections in the pool"),
+):
+    register(Collected(f"db_pool_{_key}" + ("_total" if _kind == "counter" else ""), _help,
+                       (lambda key=_key: _pool_values(key)), kind=_kind, label="pool"))
+
+# ✅ IP enrichment cache + event write-behind buffer (counters they already keep)
+IP_CACHE_COUNTERS = ("hits", "misses", "disk_hits", "negative_hits", "expired", "evictions")
+EVENT_BUFFER_COUNTERS = ("queued", "flushed", "flushes", "flush_failures", "dropped_queue_full", "dropped_flush_failed")
+
+def _ip_cache_stats():
+    from app.ipinfo import cache_stats
+    return cache_stats()
+
+def _event_buffer_stats():
+    from app.event_buffer import event_buffer
+    return event_buffer.snapshot()
+
+register(Collected("ip_cache_total", "IP enrichment cache lookups and evictions by outcome",
+                   lambda: {k: v for k, v in _ip_cache_stats().items() if k in IP_CACHE_COUNTERS},
+                   kind="counter", label="outcome"))
+register(Collected("ip_cache_entries", "Entries in the in-process IP cache", lambda: _ip_cache_stats()["size"]))
+register(Collected("event_buffer_total", "Write-behind event rows and flushes by outcome",
+                   lambda: {k: v for k, v in _event_buffer_stats().items() if k in EVENT_BUFFER_COUNTERS},
+                   kind="counter", label="outcome"))
+register(Collected("event_buffer_queue_depth", "Events waiting for the next flush",
+                   lambda: _event_buffer_stats()["queue_depth"]))
+
+# ✅ Local ingest spool (app.spool)
+SPOOL_COUNTERS = ("appended", "group_commits", "append_failures", "rejected_full", "replayed", "replay_failures",
+                  "dead_lettered")
+
+def _spool_stats():
+    from app.spool import ingest_spool
+    return ingest_spool.snapshot()
+
+register(Collected("ingest_spool_total", "Spooled ingest entries, group commits and replays by outcome",
+                   lambda: {k: v for k, v in _spool_stats().items() if k in SPOOL_COUNTERS},
+                   kind="counter", label="outcome"))
+register(Collected("ingest_spool_pending", "Spooled entries not yet replayed into the database",
+                   lambda: _spool_stats()["pending"]))
+register(Collected("ingest_spool_dead_letters", "Spooled entries set aside because they failed to apply",
+                   lambda: _spool_stats()["dead_letters"]))
+register(Collected("ingest_spool_replay_rate", "Entries per second of the last replayed spool batch",
+                   lambda: _spool_stats()["last_replay_rate"]))
+
+
+# ✅ Per-request DB round-trip counting
+_round_trips = contextvars.ContextVar("db_round_trips", default=None)
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    box = _round_trips.get()
+    if box is not None:
+        box[0] += 1
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _count_statement)
+
+# Start counting statements for the current request; returns a box whose [0] is the running count
+def track_round_trips():
+    box = [0]
+    _round_trips.set(box)
+    return box
+
+
+# Time one pipeline stage (observed even when the stage raises)
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        visit_stage_seconds.observe(name, value=time.perf_counter() - started)
+
+
+# Prometheus text exposition of every registered metric
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
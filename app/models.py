@@ -1,15 +1,59 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, Float
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, Float, LargeBinary, ForeignKey, UniqueConstraint, Index, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
-from datetime import datetime
+from sqlalchemy.types import JSON
+from datetime import datetime, timezone
 
 Base = declarative_base()
 
+# JSONB on PostgreSQL, plain JSON on the SQLite stand-in used by local benchmarks
+EntropyJSON = JSONB().with_variant(JSON(), "sqlite")
+
+# Timestamp columns are naive UTC; asyncpg rejects tz-aware datetimes for them
+def to_naive_utc(ts):
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+# Partial-index predicate for both PostgreSQL and SQLite
+def partial(condition: str):
+    return {"postgresql_where": text(condition), "sqlite_where": text(condition)}
+
+# ✅ Content-addressed entropy payloads: one row per distinct (normalized) profile, shared by log rows
+class EntropyProfile(Base):
+    __tablename__ = "entropy_profiles"
+
+    id = Column(Integer, primary_key=True)
+    profile_hash = Column(String(64), nullable=False, unique=True)   # sha256 of the normalized entropy JSON
+    entropy_data = Column(EntropyJSON, nullable=False)
+    user_agent = Column(Text)
+    screen_res = Column(String)
+    color_depth = Column(String)
+    timezone = Column(String)
+    language = Column(String)
+    platform = Column(String)
+    device_memory = Column(String)
+    cpu_cores = Column(String)
+    gpu_vendor = Column(String)
+    gpu_renderer = Column(String)
+    canvas_hash = Column(String)
+    audio_hash = Column(String)
+    first_seen = Column(DateTime, default=datetime.utcnow)
+
+
 class VisitorLog(Base):
     __tablename__ = "visitor_logs"
+    __table_args__ = (
+        Index("ix_visitor_logs_session_ts", "session_id", "timestamp"),               # Entry page / hit count
+        Index("ix_visitor_logs_session_page_ts", "session_id", "page", "timestamp"),  # /log-exit lookup
+        Index("ix_visitor_logs_alias_by_fingerprint", "fingerprint_id", "id",
+              **partial("visitor_alias IS NOT NULL")),
+        Index("ix_visitor_logs_entropy_rows", "id", **partial("entropy_profile_id IS NOT NULL")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)   # Partition key (app.partitions)
     client_timestamp = Column(DateTime, nullable=True)
 
     page = Column(String)
@@ -30,19 +74,12 @@ class VisitorLog(Base):
     utm_term = Column(String)
     utm_content = Column(String)
 
-    entropy_data = Column(JSONB)
-    user_agent = Column(Text)
-    screen_res = Column(String)
-    color_depth = Column(String)
-    timezone = Column(String)
-    language = Column(String)
-    platform = Column(String)
-    device_memory = Column(String)
-    cpu_cores = Column(String)
-    gpu_vendor = Column(String)
-    gpu_renderer = Column(String)
-    canvas_hash = Column(String)
-    audio_hash = Column(String)
+    entropy_profile_id = Column(Integer, ForeignKey("entropy_profiles.id"))   # ✅ Deduplicated entropy (app.profiles)
+    profile = relationship(EntropyProfile)
+
+    @property
+    def entropy_data(self):
+        return self.profile.entropy_data if self.profile is not None else None
 
     visitor_alias = Column(String)
     session_label = Column(String)
@@ -59,9 +96,12 @@ class VisitorLog(Base):
 
 class VisitorEventLog(Base):
     __tablename__ = "visitor_event_logs"
+    __table_args__ = (
+        Index("ix_visitor_event_logs_session_ts", "session_id", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)   # Partition key (app.partitions)
     client_timestamp = Column(DateTime, nullable=True)
 
     session_id = Column(String)
@@ -78,23 +118,19 @@ class VisitorEventLog(Base):
     country = Column(String)
     organization = Column(String)
     enriched_source = Column(String)
-    entropy_data = Column(JSONB)
-    user_agent = Column(Text)
-    screen_res = Column(String)
-    color_depth = Column(String)
-    timezone = Column(String)
-    language = Column(String)
-    platform = Column(String)
-    device_memory = Column(String)
-    cpu_cores = Column(String)
-    gpu_vendor = Column(String)
-    gpu_renderer = Column(String)
-    canvas_hash = Column(String)
-    audio_hash = Column(String)
+    entropy_profile_id = Column(Integer, ForeignKey("entropy_profiles.id"))   # ✅ Deduplicated entropy (app.profiles)
+    profile = relationship(EntropyProfile)
+
+    @property
+    def entropy_data(self):
+        return self.profile.entropy_data if self.profile is not None else None
 
 
 class VisitorDerivedLog(Base):
     __tablename__ = "visitor_derived_logs"
+    __table_args__ = (
+        Index("ix_visitor_derived_logs_session_id", "session_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String)
@@ -106,3 +142,167 @@ class VisitorDerivedLog(Base):
     geo_region_type = Column(String)
     landing_source = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+
+# ✅ Per-alias entropy signatures (one row per distinct profile seen for an alias/fingerprint)
+class EntropySignature(Base):
+    __tablename__ = "entropy_signatures"
+    __table_args__ = (
+        UniqueConstraint("visitor_alias", "fingerprint_id", "signature", name="uq_entropy_signature"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    visitor_alias = Column(String, nullable=False)
+    fingerprint_id = Column(String, nullable=False)
+    signature = Column(String, nullable=False)
+    first_log_id = Column(Integer, nullable=False, index=True)   # Earliest visitor_logs.id carrying this profile
+
+
+# ✅ Inverted index: one hashed term per weighted entropy field of a signature
+class EntropySignatureTerm(Base):
+    __tablename__ = "entropy_signature_terms"
+
+    id = Column(Integer, primary_key=True)
+    signature_id = Column(Integer, ForeignKey("entropy_signatures.id", ondelete="CASCADE"), index=True)
+    field = Column(String, nullable=False)
+    term = Column(String, nullable=False, index=True)
+
+
+# ✅ Fuzzy index: distinct free-text field values (keyed by their exact term) + their MinHash LSH bands
+class EntropyFuzzyValue(Base):
+    __tablename__ = "entropy_fuzzy_values"
+
+    id = Column(Integer, primary_key=True)
+    field = Column(String, nullable=False)
+    term = Column(String, nullable=False, unique=True)   # Same hash as entropy_signature_terms.term
+    value = Column(Text, nullable=False)
+
+
+class EntropyFuzzyBand(Base):
+    __tablename__ = "entropy_fuzzy_bands"
+    __table_args__ = (
+        UniqueConstraint("band", "value_id", name="uq_entropy_fuzzy_band"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    band = Column(String, nullable=False)
+    value_id = Column(Integer, ForeignKey("entropy_fuzzy_values.id", ondelete="CASCADE"), nullable=False, index=True)
+
+
+# ✅ Label allocation: counters + stable fingerprint/session → label mappings
+class LabelCounter(Base):
+    __tablename__ = "label_counters"
+
+    name = Column(String, primary_key=True)            # "visitor" / "session"
+    value = Column(Integer, nullable=False, default=0)  # Last number handed out
+
+
+class VisitorAliasMap(Base):
+    __tablename__ = "visitor_aliases"
+
+    id = Column(Integer, primary_key=True)
+    fingerprint_id = Column(String, nullable=False, unique=True)
+    visitor_alias = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SessionLabelMap(Base):
+    __tablename__ = "session_labels"
+
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String, nullable=False, unique=True)
+    session_label = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ✅ Pre-aggregated visit counters per hour/day bucket and dimension combo (maintained on ingest)
+class VisitRollup(Base):
+    __tablename__ = "visit_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "granularity", "bucket", "page", "country", "traffic_type", "landing_source", "device", "utm_campaign",
+            name="uq_visit_rollup",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String, nullable=False)      # "hour" / "day"
+    bucket = Column(DateTime, nullable=False)         # Bucket start (UTC)
+
+    # Dimensions ("" when missing so the unique constraint holds)
+    page = Column(String, nullable=False, default="")
+    country = Column(String, nullable=False, default="")
+    traffic_type = Column(String, nullable=False, default="")
+    landing_source = Column(String, nullable=False, default="")
+    device = Column(String, nullable=False, default="")
+    utm_campaign = Column(String, nullable=False, default="")
+
+    visits = Column(Integer, nullable=False, default=0)
+    sessions = Column(Integer, nullable=False, default=0)           # Sessions that started in this bucket
+    bounced_sessions = Column(Integer, nullable=False, default=0)   # ...of which still have a single visit
+
+
+# ✅ Hourly HyperLogLog sketches of distinct visitors / sessions (app.uniques), merged on read
+class UniqueSketch(Base):
+    __tablename__ = "unique_sketches"
+    __table_args__ = (
+        UniqueConstraint("bucket", "page", "country", "utm_campaign", name="uq_unique_sketch"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, nullable=False)         # Hour start (UTC)
+    page = Column(String, nullable=False, default="")
+    country = Column(String, nullable=False, default="")
+    utm_campaign = Column(String, nullable=False, default="")
+    visitors = Column(LargeBinary, nullable=False)    # One byte per register, 2^UNIQUES_PRECISION bytes (bytea)
+    sessions = Column(LargeBinary, nullable=False)
+
+
+# ✅ Named progress markers for sync/ingestion jobs (Airtable pushes, GA4 watermarks, ...)
+class SyncCheckpoint(Base):
+    __tablename__ = "sync_checkpoints"
+
+    name = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# ✅ Local copy of GA4 sessions (dateHourMinute × page × device × city × country)
+class GASession(Base):
+    __tablename__ = "ga_sessions"
+    __table_args__ = (
+        UniqueConstraint("date_hour_minute", "page", "device", "city", "country", name="uq_ga_session"),
+        Index("ix_ga_sessions_timestamp", "timestamp"),
+        Index("ix_ga_sessions_fetched", "fetched_at", "id"),                # Airtable push cursor
+    )
+
+    id = Column(Integer, primary_key=True)
+    date_hour_minute = Column(String, nullable=False)   # GA4 format: YYYYMMDDHHMM
+    timestamp = Column(DateTime, nullable=False)        # Same instant, parsed (property timezone)
+    page = Column(String, nullable=False, default="")
+    device = Column(String, nullable=False, default="")
+    city = Column(String, nullable=False, default="")
+    country = Column(String, nullable=False, default="")
+    sessions = Column(Integer, nullable=False, default=0)
+    fetched_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)   # Last stored / revised
+
+
+# ✅ Deferred /log-visit work (enrichment, alias scoring, derived row, rollups), claimed with SKIP LOCKED
+class VisitJob(Base):
+    __tablename__ = "visit_jobs"
+    __table_args__ = (
+        Index("ix_visit_jobs_pending", "run_after", "id", **partial("status = 'pending'")),
+        Index("ix_visit_jobs_running", "locked_at", **partial("status = 'running'")),
+        Index("ix_visit_jobs_done", "finished_at", **partial("status = 'done'")),   # Pruning
+    )
+
+    id = Column(Integer, primary_key=True)
+    visit_id = Column(Integer, nullable=False, unique=True)          # visitor_logs.id
+    returning_session = Column(Boolean, nullable=False, default=False)
+    status = Column(String, nullable=False, default="pending")       # pending / running / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,235 @@
+# Monthly range partitions for visitor_logs / visitor_event_logs (migration 0009) and their retention.
+# maintain_partitions() creates the partitions PARTITION_MONTHS_AHEAD months ahead (moving any rows that
+# already landed in the DEFAULT partition) and, when a retention period is set, archives old months to
+# compressed columnar files (app.export) before detaching or dropping them. Tables that aren't
+# partitioned (the SQLite stand-in, or a schema built with create_all) fall back to batched DELETEs.
+# Retiring visits also prunes what hangs off them: derived rows, visit jobs and entropy signatures.
+# Worker startup only creates partitions; retention runs from the CLI (cron / scheduled job).
+#
+# CLI: python -m app.partitions [--ahead N] [--skip-retention] [--dry-run]
+
+import os
+import re
+import json
+import argparse
+from datetime import datetime
+
+from sqlalchemy import text, exists
+from sqlalchemy.orm import Session
+
+from app.models import (
+    VisitorLog, VisitorEventLog, VisitorDerivedLog, VisitJob, EntropySignature, EntropySignatureTerm,
+)
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_RETENTION_ACTION = os.getenv("PARTITION_RETENTION_ACTION", "detach")   # detach / drop
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", "")                   # Empty: no archive
+PARTITION_ARCHIVE_FORMAT = os.getenv("PARTITION_ARCHIVE_FORMAT", "parquet")      # parquet / arrow
+RETENTION_DELETE_CHUNK = int(os.getenv("RETENTION_DELETE_CHUNK", "5000"))
+
+# table -> (model, export name, months kept; 0 keeps everything)
+PARTITIONED_TABLES = {
+    "visitor_logs": (VisitorLog, "visits", int(os.getenv("VISIT_RETENTION_MONTHS", "0"))),
+    "visitor_event_logs": (VisitorEventLog, "events", int(os.getenv("EVENT_RETENTION_MONTHS", "0"))),
+}
+
+# One maintenance pass at a time across workers and cron runs (app.db.try_advisory_lock: session-level,
+# so the per-chunk commits of a long retention pass don't release it; a second pass skips rather than waits)
+PARTITION_LOCK_ID = 73_451_002
+BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, 1)
+
+def add_months(ts: datetime, months: int) -> datetime:
+    index = ts.year * 12 + ts.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(db: Session, table: str) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND c.relnamespace = CAST(current_schema() AS regnamespace)"
+    ), {"table": table}).scalar() is not None
+
+# [(partition, lower, upper)] in time order; the DEFAULT partition has no bounds
+def list_partitions(db: Session, table: str) -> list:
+    rows = db.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND.search(bound or "")
+        lower, upper = (datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2))) if match else (None, None)
+        partitions.append((name, lower, upper))
+    return sorted(partitions, key=lambda p: p[1] or datetime.max)
+
+
+# Create monthly partitions from the current month to `ahead` months out. Rows already sitting in the
+# DEFAULT partition for a new month are moved into it (PostgreSQL refuses the CREATE otherwise).
+def ensure_partitions(db: Session, table: str, ahead: int = PARTITION_MONTHS_AHEAD, now: datetime = None) -> list:
+    existing = {name for name, _, _ in list_partitions(db, table)}
+    default = f"{table}_default"
+    created = []
+    month = month_start(now or datetime.utcnow())
+    for _ in range(ahead + 1):
+        name, upper = partition_name(table, month), add_months(month, 1)
+        if name not in existing:
+            bounds = {"lower": month, "upper": upper}
+            stray = default in existing and db.execute(text(
+                f'SELECT 1 FROM {default} WHERE "timestamp" >= :lower AND "timestamp" < :upper LIMIT 1'
+            ), bounds).scalar() is not None
+            if stray:
+                db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+            db.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+            ))
+            if stray:
+                db.execute(text(
+                    f'WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= :lower AND "timestamp" < :upper '
+                    f"RETURNING *) INSERT INTO {table} SELECT * FROM moved"
+                ), bounds)
+                db.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+            created.append(name)
+        month = upper
+    return created
+
+
+# Write every row with lower <= timestamp < upper to <archive_dir>/<table>/<label>.<ext> (compressed)
+def archive_range(db: Session, table: str, lower, upper, label: str, archive_dir: str,
+                  fmt: str = PARTITION_ARCHIVE_FORMAT) -> dict:
+    from app.export import EXPORT_FORMATS, export_to_file
+
+    model, export_name, _ = PARTITIONED_TABLES[table]
+    where = [model.timestamp < upper] + ([model.timestamp >= lower] if lower is not None else [])
+    os.makedirs(os.path.join(archive_dir, table), exist_ok=True)
+    path = os.path.join(archive_dir, table, f"{label}.{EXPORT_FORMATS[fmt]}")
+    rows = export_to_file(db, export_name, path, fmt, where=where)
+    return {"path": path, "rows": rows, "bytes": os.path.getsize(path)}
+
+
+# Retire everything older than `months` full months: partitions on PostgreSQL, batched DELETEs elsewhere
+def apply_retention(db: Session, table: str, months: int, now: datetime = None, action: str = PARTITION_RETENTION_ACTION,
+                    archive_dir: str = PARTITION_ARCHIVE_DIR, dry_run: bool = False) -> list:
+    model = PARTITIONED_TABLES[table][0]
+    cutoff = add_months(month_start(now or datetime.utcnow()), -months)
+    retired = []
+
+    if is_partitioned(db, table):
+        for name, lower, upper in list_partitions(db, table):
+            if upper is None or upper > cutoff:
+                continue
+            entry = {"table": table, "partition": name, "action": action}
+            if not dry_run:
+                if archive_dir:
+                    entry["archive"] = archive_range(db, table, lower, upper, name, archive_dir)
+                db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                if action == "drop":
+                    db.execute(text(f"DROP TABLE {name}"))
+            retired.append(entry)
+        return retired
+
+    old = db.query(model.id).filter(model.timestamp < cutoff)
+    entry = {"table": table, "before": cutoff.isoformat(), "action": "delete", "rows": old.count()}
+    if not entry["rows"]:
+        return retired
+    if not dry_run:
+        if archive_dir:
+            entry["archive"] = archive_range(db, table, None, cutoff, f"{table}_before_{cutoff:%Y_%m}", archive_dir)
+        delete_in_chunks(db, model, old)
+    retired.append(entry)
+    return retired
+
+
+# Delete the rows `ids` (a query of model.id) selects, RETENTION_DELETE_CHUNK per committed batch
+def delete_in_chunks(db: Session, model, ids) -> int:
+    deleted = 0
+    while True:
+        chunk = [row.id for row in ids.order_by(model.id).limit(RETENTION_DELETE_CHUNK)]
+        if not chunk:
+            return deleted
+        db.query(model).filter(model.id.in_(chunk)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(chunk)
+
+
+# Rows that outlive retired visits: derived rows older than the cutoff, jobs of missing visits, and
+# entropy signatures first seen on a missing visit. Those signatures are rebuilt from the alias /
+# fingerprint's surviving visits, so a profile still in use keeps matching (from its new first visit).
+def prune_visit_dependents(db: Session, cutoff: datetime) -> dict:
+    from app.intel import index_entropy_signature
+
+    pruned = {
+        "visitor_derived_logs": delete_in_chunks(
+            db, VisitorDerivedLog, db.query(VisitorDerivedLog.id).filter(VisitorDerivedLog.timestamp < cutoff)),
+        "visit_jobs": delete_in_chunks(
+            db, VisitJob, db.query(VisitJob.id).filter(~exists().where(VisitorLog.id == VisitJob.visit_id))),
+    }
+
+    stale = db.query(EntropySignature.id, EntropySignature.visitor_alias, EntropySignature.fingerprint_id) \
+        .filter(~exists().where(VisitorLog.id == EntropySignature.first_log_id)).all()
+    for i in range(0, len(stale), RETENTION_DELETE_CHUNK):
+        ids = [row.id for row in stale[i:i + RETENTION_DELETE_CHUNK]]
+        db.query(EntropySignatureTerm).filter(EntropySignatureTerm.signature_id.in_(ids)).delete(synchronize_session=False)
+        db.query(EntropySignature).filter(EntropySignature.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+    for alias, fingerprint_id in {(row.visitor_alias, row.fingerprint_id) for row in stale}:
+        visits = db.query(VisitorLog).filter(VisitorLog.visitor_alias == alias, VisitorLog.fingerprint_id == fingerprint_id)
+        for record in visits.order_by(VisitorLog.id.asc()):
+            index_entropy_signature(db, record)
+        db.commit()
+    pruned["entropy_signatures"] = len(stale)
+    return pruned
+
+
+# Startup (retention=False) / cron entry point: partitions ahead for every table, retention where
+# configured. Skipped, with report["skipped"] set, while another process is running a pass.
+def maintain_partitions(db: Session, ahead: int = PARTITION_MONTHS_AHEAD, retention: bool = True,
+                        dry_run: bool = False, now: datetime = None) -> dict:
+    from app.db import try_advisory_lock
+
+    report = {"created": [], "retired": [], "pruned": {}, "skipped": False}
+    with try_advisory_lock(PARTITION_LOCK_ID) as acquired:
+        if not acquired:
+            report["skipped"] = True
+            return report
+        for table, (_, _, months) in PARTITIONED_TABLES.items():
+            if is_partitioned(db, table) and not dry_run:
+                report["created"] += ensure_partitions(db, table, ahead, now)
+            if retention and months > 0:
+                retired = apply_retention(db, table, months, now, dry_run=dry_run)
+                if table == "visitor_logs" and retired and not dry_run:
+                    db.commit()
+                    report["pruned"] = prune_visit_dependents(db, add_months(month_start(now or datetime.utcnow()), -months))
+                report["retired"] += retired
+        db.commit()
+    return report
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Create monthly partitions ahead and apply the retention policy")
+    parser.add_argument("--ahead", type=int, default=PARTITION_MONTHS_AHEAD, help="months of partitions to keep ready")
+    parser.add_argument("--skip-retention", action="store_true", help="only create partitions")
+    parser.add_argument("--dry-run", action="store_true", help="report what retention would retire, change nothing")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        report = maintain_partitions(db, args.ahead, not args.skip_retention, args.dry_run)
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
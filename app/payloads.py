@@ -0,0 +1,56 @@
+# Purpose: Decode ingest request bodies: JSON (any content type, so navigator.sendBeacon's text/plain
+# works), gzip-compressed bodies (detected by magic bytes, since sendBeacon can't set
+# Content-Encoding), and msgpack (Content-Type application/msgpack or ?format=msgpack; optional dependency).
+
+import os
+import zlib
+
+from app.codec import loads
+
+PAYLOAD_MAX_BYTES = int(os.getenv("PAYLOAD_MAX_BYTES", str(1024 * 1024)))   # After decompression
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class PayloadError(Exception):
+    def __init__(self, reason: str, detail: str = None):
+        super().__init__(detail or reason)
+        self.reason = reason
+        self.detail = detail
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as ex:
+        raise PayloadError("UnsupportedMediaType", "msgpack bodies need msgpack (pip install msgpack)") from ex
+    return msgpack
+
+
+# Inflate with a hard output cap, so a small compressed body can't expand without bound
+def gunzip(raw: bytes, limit: int = PAYLOAD_MAX_BYTES) -> bytes:
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = inflater.decompress(raw, limit + 1)
+    except zlib.error as ex:
+        raise PayloadError("InvalidPayload", f"Bad gzip body: {ex}") from ex
+    if len(body) > limit or inflater.unconsumed_tail:
+        raise PayloadError("PayloadTooLarge", f"Body exceeds {limit} bytes")
+    return body
+
+
+def decode_body(raw: bytes, content_type: str = "", content_encoding: str = "", fmt: str = None):
+    if len(raw) > PAYLOAD_MAX_BYTES:
+        raise PayloadError("PayloadTooLarge", f"Body exceeds {PAYLOAD_MAX_BYTES} bytes")
+    if "gzip" in (content_encoding or "").lower() or raw[:2] == GZIP_MAGIC:
+        raw = gunzip(raw)
+
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if fmt == "msgpack" or media_type in MSGPACK_TYPES:
+            return _msgpack().unpackb(raw, raw=False)
+        return loads(raw)
+    except PayloadError:
+        raise
+    except Exception as ex:
+        raise PayloadError("InvalidPayload", f"Could not decode body: {ex}") from ex
@@ -0,0 +1,97 @@
+# Content-addressed entropy profiles: every distinct entropy payload is stored once in entropy_profiles
+# (keyed by a hash of its normalized JSON) and log rows point at it by id. Hash → id lookups for
+# recently seen profiles are cached in-process, so a returning device costs no extra round trip.
+
+import os
+import json
+import hashlib
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import EntropyProfile
+from app.labels import LabelCache
+
+ENTROPY_PROFILE_CACHE_SIZE = int(os.getenv("ENTROPY_PROFILE_CACHE_SIZE", "50000"))
+
+# Denormalized profile column -> entropy payload key (as the log tables used to store them)
+PROFILE_COLUMNS = {
+    "user_agent": "userAgent",
+    "screen_res": "screen",
+    "color_depth": "colorDepth",
+    "timezone": "timezone",
+    "language": "language",
+    "platform": "platform",
+    "device_memory": "deviceMemory",
+    "cpu_cores": "hardwareConcurrency",
+    "gpu_vendor": "webglVendor",
+    "gpu_renderer": "webglRenderer",
+    "canvas_hash": "canvas",
+    "audio_hash": "audio",
+}
+PROFILE_FIELDS = ["entropy_data", *PROFILE_COLUMNS]
+
+# Profiles are immutable once committed, so hash → id mappings can be cached like labels
+profile_cache = LabelCache(ENTROPY_PROFILE_CACHE_SIZE)
+
+
+# Key order and whitespace don't make a new profile (migration 0008 hashes the same way)
+def normalize_entropy(entropy: dict) -> str:
+    return json.dumps(entropy, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def profile_hash(entropy: dict) -> str:
+    return hashlib.sha256(normalize_entropy(entropy).encode("utf-8")).hexdigest()
+
+
+# Profile columns are VARCHAR, but browsers send colorDepth / deviceMemory / hardwareConcurrency as JSON
+# numbers; asyncpg refuses to bind an int to a VARCHAR parameter, so every value goes in as text
+def profile_values(entropy: dict) -> dict:
+    values = {column: entropy.get(key) for column, key in PROFILE_COLUMNS.items()}
+    return {column: value if value is None or isinstance(value, str) else str(value) for column, value in values.items()}
+
+
+def _lookup(db: Session, digest: str):
+    return db.execute(select(EntropyProfile.id).where(EntropyProfile.profile_hash == digest)).scalar()
+
+
+# Profile id for an entropy payload (None for no entropy). Runs inside the caller's transaction;
+# like labels, only ids read back from committed rows are cached.
+def resolve_profile(db: Session, entropy: dict):
+    from app.db import dialect_insert
+
+    if entropy is None:
+        return None
+    digest = profile_hash(entropy)
+    cached = profile_cache.get(digest)
+    if cached is not None:
+        return cached
+
+    profile_id = _lookup(db, digest)
+    if profile_id is not None:
+        profile_cache.set(digest, profile_id)
+        return profile_id
+
+    profile_id = db.execute(
+        dialect_insert(db, EntropyProfile.__table__)
+        .values(profile_hash=digest, entropy_data=entropy,
+                **profile_values(entropy))
+        .on_conflict_do_nothing(index_elements=["profile_hash"])
+        .returning(EntropyProfile.id)
+    ).scalar()
+    return profile_id if profile_id is not None else _lookup(db, digest)   # Lost the race: read the winner's row
+
+
+# Columns of a log table with the profile fields spliced back in where entropy_profile_id sits
+def log_columns(model) -> dict:
+    columns = {}
+    for column in model.__table__.columns:
+        columns[column.name] = column
+        if column.name == "entropy_profile_id":
+            columns.update({name: EntropyProfile.__table__.columns[name] for name in PROFILE_FIELDS})
+    return columns
+
+# Outer-join entropy_profiles when any of the selected columns come from it
+def with_profile(query, model, columns):
+    if any(column.table is EntropyProfile.__table__ for column in columns):
+        return query.outerjoin(EntropyProfile, EntropyProfile.id == model.entropy_profile_id)
+    return query
@@ -0,0 +1,299 @@
+# Purpose: Batch re-scoring of probable_alias / best_match_* over visitor_logs after WEIGHTS or
+# THRESHOLD change. Entropy fields are dictionary-encoded into integer codes and every distinct
+# visitor profile is scored against all alias signatures with NumPy, a block of profiles at a time.
+# Each visit is matched only against signatures first seen before it, as /log-visit did.
+#
+# CLI: python -m app.rescore [--dry-run]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import VisitorLog, EntropyProfile
+from app.intel import WEIGHTS, THRESHOLD, TOTAL_WEIGHT, ENTROPY_FIELD_MAP
+from app.fuzzy import ENTROPY_FUZZY, FUZZY_FIELDS, near_pairs
+
+RESCORE_BLOCK_CELLS = int(os.getenv("RESCORE_BLOCK_CELLS", "4000000"))   # profiles × signatures per block
+RESCORE_CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "5000"))         # Rows per read / bulk update
+
+FIELDS = list(WEIGHTS)
+MISSING = -1
+
+
+# Per-field value → int code (same equality as the signature index terms); -1 = field absent
+class EntropyEncoder:
+    def __init__(self):
+        self.vocab = [{} for _ in FIELDS]       # JSON text → code
+        self.seen = [{} for _ in FIELDS]        # (type, scalar) → code, skips json.dumps for repeats
+        self.keys = [ENTROPY_FIELD_MAP[key] for key in FIELDS]
+        self.labels = {}
+
+    def code(self, f: int, value) -> int:
+        scalar = (value.__class__, value) if isinstance(value, (str, int, float)) else None
+        if scalar is not None and scalar in self.seen[f]:
+            return self.seen[f][scalar]
+        vocab = self.vocab[f]
+        code = vocab.setdefault(json.dumps(value, sort_keys=True, default=str), len(vocab))
+        if scalar is not None:
+            self.seen[f][scalar] = code
+        return code
+
+    def encode(self, entropy: dict) -> list:
+        entropy = entropy or {}
+        codes = []
+        for f, aliases in enumerate(self.keys):
+            value = next((entropy[a] for a in aliases if a in entropy), None)
+            codes.append(MISSING if value is None else self.code(f, value))
+        return codes
+
+    def label(self, value) -> int:
+        return MISSING if value is None else self.labels.setdefault(value, len(self.labels))
+
+
+# Rows (id, fingerprint_id, visitor_alias, entropy_data) in id order → code arrays
+def encode_rows(rows, encoder: EntropyEncoder = None) -> dict:
+    encoder = encoder or EntropyEncoder()
+    alias_labels = {}
+    ids, fingerprints, aliases, alias_codes, has_entropy, codes = [], [], [], [], [], []
+    for log_id, fingerprint_id, alias, entropy in rows:
+        ids.append(log_id)
+        fingerprints.append(encoder.label(fingerprint_id))
+        aliases.append(alias)
+        alias_codes.append(alias_labels.setdefault(alias, len(alias_labels)) if alias else MISSING)
+        has_entropy.append(entropy is not None)
+        codes.append(encoder.encode(entropy))
+    return {
+        "ids": np.asarray(ids, dtype=np.int64),
+        "fingerprints": np.asarray(fingerprints, dtype=np.int64),
+        "aliases": aliases,
+        "alias_codes": np.asarray(alias_codes, dtype=np.int64),
+        "has_entropy": np.asarray(has_entropy, dtype=bool),
+        "codes": np.asarray(codes, dtype=np.int32).reshape(len(ids), len(FIELDS)),
+        "vocab": [list(vocab) for vocab in encoder.vocab],
+    }
+
+
+# One signature per (alias, fingerprint, profile), keyed by its first row — mirrors entropy_signatures
+def candidate_rows(encoded: dict) -> np.ndarray:
+    alias_codes = encoded["alias_codes"]
+    eligible = np.flatnonzero(encoded["has_entropy"] & (alias_codes != MISSING) & (encoded["fingerprints"] != MISSING))
+    if not len(eligible):
+        return eligible
+    keys = np.column_stack([alias_codes[eligible], encoded["fingerprints"][eligible], encoded["codes"][eligible]])
+    _, first = np.unique(keys, axis=0, return_index=True)
+    return np.sort(eligible[first])
+
+
+# (query, candidate) index pairs sharing a code, via a sorted candidate column; skipped queries pair with nothing
+def _pairs(sorted_codes: np.ndarray, order: np.ndarray, query: np.ndarray, skip: np.ndarray):
+    lo = np.searchsorted(sorted_codes, query, side="left")
+    counts = np.searchsorted(sorted_codes, query, side="right") - lo
+    counts[skip] = 0
+    starts = np.cumsum(counts) - counts
+    qi = np.repeat(np.arange(len(query)), counts)
+    cj = order[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+    return qi, cj
+
+
+# Weighted match scores of query profiles against every signature (unnormalised).
+# Values shared by a large slice of profiles × signatures (timezone, language, ...) are one-hot
+# encoded and scored with one matrix product; the rest (canvas, audio, user agent, ...) only
+# match a handful of signatures each and are scattered in from a sorted-code join. With
+# ENTROPY_FUZZY, near free-text values (app.fuzzy) add weight × ratio the same way.
+class Scorer:
+    DENSE_SHARE = 0.002   # A value goes one-hot once it covers this share of all profile × signature pairs
+
+    def __init__(self, query_codes: np.ndarray, cand_codes: np.ndarray, cand_fp: np.ndarray, vocab: list = None):
+        # Exact scores are sums of half-integers (exact in float32); fuzzy ratios need float64
+        self.dtype = np.float64 if ENTROPY_FUZZY else np.float32
+        self.weights = np.asarray([WEIGHTS[key] for key in FIELDS], dtype=self.dtype)
+        self.cand_fp = cand_fp
+        self.fp_order = np.argsort(cand_fp, kind="stable")
+        self.fp_sorted = cand_fp[self.fp_order]
+
+        self.dense_index = []   # per field: code → one-hot column, or -1
+        self.sparse = []        # per field: (sorted candidate codes, candidate order)
+        columns = 0
+        pairs = len(query_codes) * len(cand_codes)
+        for f in range(len(FIELDS)):
+            size = int(max(query_codes[:, f].max(initial=-1), cand_codes[:, f].max(initial=-1))) + 1
+            q_counts = np.bincount(query_codes[:, f][query_codes[:, f] >= 0], minlength=size)
+            c_counts = np.bincount(cand_codes[:, f][cand_codes[:, f] >= 0], minlength=size)
+            dense = q_counts.astype(np.float64) * c_counts >= self.DENSE_SHARE * pairs
+            index = np.full(size + 1, -1, dtype=np.int64)   # Extra slot so MISSING (-1) maps to -1
+            index[np.flatnonzero(dense)] = np.arange(columns, columns + dense.sum())
+            columns += int(dense.sum())
+            self.dense_index.append(index)
+            order = np.argsort(cand_codes[:, f], kind="stable")
+            self.sparse.append((cand_codes[order, f], order))
+
+        self.cand_dense = self._one_hot(cand_codes, columns, np.ones(len(FIELDS), dtype=self.dtype))
+        self.columns = columns
+
+        # Per fuzzy field: (query code, candidate code, weight × ratio) sorted by query code
+        self.fuzzy = []
+        if ENTROPY_FUZZY and vocab is not None:
+            for key in FUZZY_FIELDS:
+                f = FIELDS.index(key)
+                qa, cb, ratio = near_pairs(key, vocab[f], query_codes[:, f], cand_codes[:, f])
+                order = np.argsort(qa, kind="stable")
+                self.fuzzy.append((f, qa[order], cb[order], WEIGHTS[key] * ratio[order]))
+
+    def _one_hot(self, codes: np.ndarray, columns: int, weights: np.ndarray) -> np.ndarray:
+        matrix = np.zeros((len(codes), columns), dtype=self.dtype)
+        for f, weight in enumerate(weights):
+            cols = self.dense_index[f][codes[:, f]]
+            rows = np.flatnonzero(cols >= 0)
+            matrix[rows, cols[rows]] = weight
+        return matrix
+
+    def scores(self, query_codes: np.ndarray, query_fp: np.ndarray) -> np.ndarray:
+        scores = self._one_hot(query_codes, self.columns, self.weights) @ self.cand_dense.T
+        for f, (sorted_codes, order) in enumerate(self.sparse):
+            q = query_codes[:, f]
+            qi, cj = _pairs(sorted_codes, order, q, (q == MISSING) | (self.dense_index[f][q] >= 0))
+            scores[qi, cj] += self.weights[f]
+        for f, near_query, near_cand, contribution in self.fuzzy:
+            qi, pj = _pairs(near_query, np.arange(len(near_query)), query_codes[:, f], query_codes[:, f] == MISSING)
+            pi, cj = _pairs(self.sparse[f][0], self.sparse[f][1], near_cand[pj], np.zeros(len(pj), dtype=bool))
+            scores[qi[pi], cj] += contribution[pj[pi]]
+        # Never match the visitor's own fingerprint
+        qi, cj = _pairs(self.fp_sorted, self.fp_order, query_fp, query_fp == MISSING)
+        scores[qi, cj] = -1
+        return scores
+
+
+# Best signature (row index into `encoded`, or -1) and normalised score for every row
+def best_matches(encoded: dict, block_cells: int = RESCORE_BLOCK_CELLS):
+    n = len(encoded["ids"])
+    best_row = np.full(n, -1, dtype=np.int64)
+    best_score = np.zeros(n, dtype=np.float64)
+
+    cands = candidate_rows(encoded)
+    if not n or not len(cands):
+        return best_row, best_score, {"signatures": len(cands), "profiles": 0}
+
+    cand_ids = encoded["ids"][cands]
+
+    # Rows with the same fingerprint + profile share a score vector; only their cutoff differs
+    profiles, inverse = np.unique(
+        np.column_stack([encoded["fingerprints"], encoded["codes"]]), axis=0, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    cutoff = np.searchsorted(cand_ids, encoded["ids"], side="left")   # signatures strictly older than the row
+    order = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(profiles)))])
+    positions = np.arange(len(cands), dtype=np.int32)
+
+    query_codes = np.ascontiguousarray(profiles[:, 1:]).astype(np.int32)
+    scorer = Scorer(query_codes, encoded["codes"][cands], encoded["fingerprints"][cands], encoded.get("vocab"))
+
+    block = max(1, block_cells // len(cands))
+    for u0 in range(0, len(profiles), block):
+        u1 = min(u0 + block, len(profiles))
+        scores = scorer.scores(query_codes[u0:u1], profiles[u0:u1, 0])
+
+        # Running best over signatures in first-seen order; ties keep the oldest (as the index query does)
+        running = np.maximum.accumulate(scores, axis=1)
+        improved = np.empty(scores.shape, dtype=bool)
+        improved[:, 0] = True
+        np.greater(scores[:, 1:], running[:, :-1], out=improved[:, 1:])
+        argbest = np.maximum.accumulate(np.where(improved, positions, 0), axis=1)
+
+        rows = order[starts[u0]:starts[u1]]
+        local = inverse[rows] - u0
+        k = cutoff[rows]
+        has = k > 0
+        rows, local, k = rows[has], local[has], k[has] - 1
+        score = running[local, k]
+        found = score >= 0
+        best_row[rows[found]] = cands[argbest[local, k][found]]
+        best_score[rows[found]] = score[found].astype(np.float64) / TOTAL_WEIGHT
+
+    return best_row, best_score, {"signatures": len(cands), "profiles": len(profiles), "one_hot_columns": scorer.columns}
+
+
+# Column values /log-visit would have stored (see intel._match_result)
+def match_columns(best_alias, score) -> dict:
+    if best_alias is None:
+        return {"probable_alias": None, "probable_score": 0.0, "best_match_alias": None, "best_match_score": 0.0}
+    matched = score >= THRESHOLD
+    return {
+        "probable_alias": best_alias if matched else None,
+        "probable_score": score if matched else None,
+        "best_match_alias": best_alias,
+        "best_match_score": score,
+    }
+
+
+# Re-score every visit and bulk-write the rows whose columns changed
+def rescore_aliases(db: Session, dry_run: bool = False, block_cells: int = RESCORE_BLOCK_CELLS,
+                    chunk_size: int = RESCORE_CHUNK_SIZE) -> dict:
+    started = time.perf_counter()
+    columns = ["probable_alias", "probable_score", "best_match_alias", "best_match_score"]
+    stored = {}
+
+    def rows():
+        query = (
+            db.query(VisitorLog.id, VisitorLog.fingerprint_id, VisitorLog.visitor_alias, EntropyProfile.entropy_data,
+                     *[getattr(VisitorLog, c) for c in columns])
+            .outerjoin(EntropyProfile, EntropyProfile.id == VisitorLog.entropy_profile_id)
+            .order_by(VisitorLog.id.asc())
+            .yield_per(chunk_size)
+        )
+        for row in query:
+            stored[row[0]] = tuple(row[4:])
+            yield row[:4]
+
+    encoded = encode_rows(rows())
+    loaded = time.perf_counter()
+    best_row, best_score, stats = best_matches(encoded, block_cells)
+    scored = time.perf_counter()
+
+    updates = []
+    for i, log_id in enumerate(encoded["ids"].tolist()):
+        alias = encoded["aliases"][best_row[i]] if best_row[i] >= 0 else None
+        values = match_columns(alias, float(best_score[i]))
+        if tuple(values[c] for c in columns) != stored[log_id]:
+            updates.append({"id": log_id, **values})
+
+    if not dry_run:
+        for i in range(0, len(updates), chunk_size):
+            db.bulk_update_mappings(VisitorLog, updates[i:i + chunk_size])
+            db.commit()
+
+    stats.update({
+        "rows": len(encoded["ids"]),
+        "changed": len(updates),
+        "written": 0 if dry_run else len(updates),
+        "load_seconds": round(loaded - started, 3),
+        "score_seconds": round(scored - loaded, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+    })
+    print("🧠 Alias re-score:", stats)
+    return stats
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Re-score probable aliases over visitor_logs with current WEIGHTS/THRESHOLD")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many rows would change")
+    parser.add_argument("--block-cells", type=int, default=RESCORE_BLOCK_CELLS)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        rescore_aliases(db, args.dry_run, args.block_cells)
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+# Purpose: Incrementally maintained hourly/daily visit rollups behind /dashboard/stats/*.
+# Counters are bumped inside the /log-visit transaction; `python -m app.rollups --rebuild`
+# recomputes them from visitor_logs (use --verify to only compare).
+
+import sys
+import argparse
+from datetime import datetime
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app import logs
+from app.models import VisitorLog, VisitRollup
+
+GRANULARITIES = ["hour", "day"]
+DIMENSIONS = ["page", "country", "traffic_type", "landing_source", "device", "utm_campaign"]
+METRICS = ["visits", "sessions", "bounced_sessions"]
+
+
+def traffic_type_for(utm_source, referrer):
+    if utm_source:
+        return "Paid"
+    if referrer and referrer != "Direct":
+        return "Referral"
+    return "Direct"
+
+def landing_source_for(utm_source, referrer):
+    return "utm" if utm_source else ("referrer" if referrer and referrer != "Direct" else "direct")
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if granularity == "day" else ts
+
+
+# Dimension values for a visitor_logs row (or any object with the same attributes)
+def rollup_dimensions(row) -> dict:
+    return {
+        "page": row.page or "",
+        "country": row.country or "",
+        "traffic_type": traffic_type_for(row.utm_source, row.referrer),
+        "landing_source": landing_source_for(row.utm_source, row.referrer),
+        "device": row.device or "",
+        "utm_campaign": row.utm_campaign or "",
+    }
+
+
+# `changes` is [(ts, dims, {metric: delta})]. One statement with the rows merged and in key order, so
+# concurrent visits lock the rollup rows they share in the same order (no deadlocks).
+def _upsert(db: Session, changes: list):
+    from app.db import dialect_insert
+
+    table = VisitRollup.__table__
+    merged = {}
+    for ts, dims, deltas in changes:
+        for g in GRANULARITIES:
+            counters = merged.setdefault((g, bucket_start(ts, g), *(dims[d] for d in DIMENSIONS)),
+                                         dict.fromkeys(METRICS, 0))
+            for metric, delta in deltas.items():
+                counters[metric] += delta
+    rows = [
+        {"granularity": key[0], "bucket": key[1], **dict(zip(DIMENSIONS, key[2:])), **counters}
+        for key, counters in sorted(merged.items())
+    ]
+    stmt = dialect_insert(db, table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["granularity", "bucket", *DIMENSIONS],
+        set_={m: table.c[m] + stmt.excluded[m] for m in METRICS},
+    )
+    db.execute(stmt)
+
+
+# Called from record_visit after the visit is flushed.
+# `first_visit` is the session's earliest row; it owns the session/bounce counters.
+def update_rollups(db: Session, record: VisitorLog, new_session: bool, session_entries: int, first_visit=None):
+    ts = record.timestamp or datetime.utcnow()
+    dims = rollup_dimensions(record)
+
+    if new_session:
+        _upsert(db, [(ts, dims, {"visits": 1, "sessions": 1, "bounced_sessions": 1})])
+        return
+
+    changes = [(ts, dims, {"visits": 1})]
+    if session_entries == 2 and first_visit is not None and first_visit.id != record.id:
+        # Second hit: the session that started at `first_visit` no longer bounces
+        changes.append((first_visit.timestamp or ts, rollup_dimensions(first_visit), {"bounced_sessions": -1}))
+    _upsert(db, changes)
+
+
+# Recompute every rollup row from visitor_logs in id order (mirrors the ingest logic)
+def compute_rollups(db: Session, chunk_size: int = 10000) -> dict:
+    totals = {}
+    session_start = {}   # session key -> (bucket time, dims key)
+    session_hits = {}
+
+    def bump(ts, dims_key, **deltas):
+        for g in GRANULARITIES:
+            counters = totals.setdefault((g, bucket_start(ts, g), *dims_key), dict.fromkeys(METRICS, 0))
+            for metric, delta in deltas.items():
+                counters[metric] += delta
+
+    columns = [VisitorLog.id, VisitorLog.timestamp, VisitorLog.session_id, VisitorLog.page, VisitorLog.country,
+               VisitorLog.device, VisitorLog.utm_source, VisitorLog.utm_campaign, VisitorLog.referrer]
+    rows = db.execute(
+        select(*columns).order_by(VisitorLog.id.asc()).execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    for row in rows:
+        if row.timestamp is None:
+            continue
+        dims = rollup_dimensions(row)
+        dims_key = tuple(dims[d] for d in DIMENSIONS)
+        key = row.session_id or ""
+        hits = session_hits.get(key, 0) + 1
+        session_hits[key] = hits
+
+        if hits == 1:
+            session_start[key] = (row.timestamp, dims_key)
+            bump(row.timestamp, dims_key, visits=1, sessions=1, bounced_sessions=1)
+        else:
+            bump(row.timestamp, dims_key, visits=1)
+            if hits == 2:
+                start_ts, start_dims = session_start[key]
+                bump(start_ts, start_dims, bounced_sessions=-1)
+    return totals
+
+
+def stored_rollups(db: Session) -> dict:
+    rows = db.execute(select(VisitRollup)).scalars()
+    return {
+        (r.granularity, r.bucket, *(getattr(r, d) for d in DIMENSIONS)): {m: getattr(r, m) for m in METRICS}
+        for r in rows
+    }
+
+
+# Ingest waits on visit_rollups until this commits, so no visit lands between the recount and the rewrite
+def rebuild_rollups(db: Session) -> int:
+    from app.db import lock_for_rebuild
+
+    lock_for_rebuild(db, VisitRollup.__table__)
+    db.execute(delete(VisitRollup))
+    totals = compute_rollups(db)
+    db.bulk_insert_mappings(VisitRollup, [
+        {"granularity": key[0], "bucket": key[1], **dict(zip(DIMENSIONS, key[2:])), **counters}
+        for key, counters in totals.items()
+    ])
+    db.commit()
+    logs.info("rollups_rebuilt", sampled=False, rows=len(totals))
+    return len(totals)
+
+
+def verify_rollups(db: Session) -> list:
+    expected = compute_rollups(db)
+    actual = stored_rollups(db)
+    zero = dict.fromkeys(METRICS, 0)
+    mismatches = [
+        (key, expected.get(key, zero), actual.get(key, zero))
+        for key in expected.keys() | actual.keys()
+        if expected.get(key, zero) != actual.get(key, zero)
+    ]
+    for key, want, got in mismatches[:20]:
+        print("❌ Rollup mismatch:", key, "expected", want, "stored", got)
+    print(f"📊 Verified {len(expected)} rollup rows, {len(mismatches)} mismatches")
+    return mismatches
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify visit rollups from visitor_logs")
+    parser.add_argument("--rebuild", action="store_true", help="replace stored rollups with recomputed ones")
+    parser.add_argument("--verify", action="store_true", help="compare stored rollups with recomputed ones")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            rebuild_rollups(db)
+        if args.verify or not args.rebuild:
+            return 1 if verify_rollups(db) else 0
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# Per-session state for the ingest hot path: entry (first) visit, hit count, visitor alias / session
+# label and the last visit row per page. /log-visit derives entry page / bounce / rollup deltas from it
+# and /log-exit finds the row to update without any read query; a miss falls back to the DB.
+#
+# Backends (SESSION_STATE_BACKEND):
+#   off   — every request reads the DB (default)
+#   local — bounded in-process LRU with TTL; only correct with a single API process (tests, dev)
+#   redis — shared across uvicorn workers (SESSION_STATE_URL, optional dependency: pip install redis)
+#
+# Writes happen after the visit's transaction commits and are compare-and-set on a per-session
+# version: if another request/worker moved the session on in between, the entry is dropped and the
+# next request rebuilds it from the DB, so a stale snapshot is never built upon.
+
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from types import SimpleNamespace
+
+from app import logs
+from app.metrics import Counter, Collected, register
+
+SESSION_STATE_BACKEND = os.getenv("SESSION_STATE_BACKEND", "off")     # off / local / redis
+SESSION_STATE_URL = os.getenv("SESSION_STATE_URL", "redis://localhost:6379/0")
+SESSION_STATE_TTL = int(os.getenv("SESSION_STATE_TTL", "1800"))       # Seconds since the session's last write
+SESSION_STATE_SIZE = int(os.getenv("SESSION_STATE_SIZE", "20000"))    # Sessions held by the local backend
+SESSION_STATE_MAX_PAGES = int(os.getenv("SESSION_STATE_MAX_PAGES", "50"))
+SESSION_STATE_PREFIX = "visitor-intel:session:"
+
+# Columns of the session's first visit that derive_visit / update_rollups read
+FIRST_VISIT_FIELDS = ["id", "page", "country", "device", "utm_source", "utm_campaign", "referrer"]
+
+session_state_total = register(Counter(
+    "session_state_total", "Session-state cache lookups and writes by outcome", labels=("outcome",)))
+
+
+class LocalSessionStore:
+    blocking = False
+
+    def __init__(self, max_size=SESSION_STATE_SIZE, ttl=SESSION_STATE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()   # session_id -> (state, expires_at)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    # Compare-and-set: only replaces the entry whose version is `expected` (None = no entry)
+    def put(self, key, state, expected):
+        with self.lock:
+            entry = self.entries.get(key)
+            current = entry[0]["version"] if entry is not None and entry[1] >= time.time() else None
+            if current != expected:
+                self.entries.pop(key, None)
+                return False
+            self.entries[key] = (state, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        return len(self.entries)
+
+
+def _redis():
+    try:
+        import redis
+    except ImportError as ex:
+        raise RuntimeError("SESSION_STATE_BACKEND=redis needs redis (pip install redis)") from ex
+    return redis
+
+
+class RedisSessionStore:
+    blocking = True
+
+    def __init__(self, url=SESSION_STATE_URL, ttl=SESSION_STATE_TTL):
+        self.redis = _redis()
+        self.client = self.redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(SESSION_STATE_PREFIX + key)
+        return json.loads(raw) if raw else None
+
+    # WATCH/MULTI makes the version check and the write atomic across workers
+    def put(self, key, state, expected):
+        name = SESSION_STATE_PREFIX + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                raw = pipe.get(name)
+                current = json.loads(raw)["version"] if raw else None
+                pipe.multi()
+                if current != expected:
+                    pipe.delete(name)
+                else:
+                    pipe.set(name, json.dumps(state), ex=self.ttl)
+                pipe.execute()
+                return current == expected
+            except self.redis.WatchError:
+                self.client.delete(name)
+                return False
+
+    def delete(self, key):
+        self.client.delete(SESSION_STATE_PREFIX + key)
+
+    def clear(self):
+        for name in self.client.scan_iter(SESSION_STATE_PREFIX + "*"):
+            self.client.delete(name)
+
+    def size(self):
+        return None
+
+
+def make_store(backend: str = SESSION_STATE_BACKEND):
+    if backend == "local":
+        return LocalSessionStore()
+    if backend == "redis":
+        return RedisSessionStore()
+    return None
+
+
+session_store = make_store()
+
+if isinstance(session_store, LocalSessionStore) and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    logs.warning("session_state_local_multiworker",
+                 detail="sessions split across processes read stale state; use SESSION_STATE_BACKEND=redis")
+
+register(Collected("session_state_entries", "Sessions held by the local session-state backend",
+                   lambda: (session_store.size() or 0) if session_store is not None else 0))
+
+
+def get_state(session_id):
+    if session_store is None or not session_id:
+        return None
+    try:
+        state = session_store.get(session_id)
+    except Exception:
+        session_state_total.inc("error")
+        return None
+    session_state_total.inc("hit" if state is not None else "miss")
+    return state
+
+async def get_state_async(session_id):
+    if session_store is not None and session_store.blocking:
+        return await asyncio.to_thread(get_state, session_id)
+    return get_state(session_id)
+
+# Store the state a committed visit produced; `previous` is the snapshot it was derived from.
+# `first` / `hits` are None on the deferred pipeline, where the worker derives them later.
+def save_visit_state(previous: dict, record, first, hits: int, visitor_alias: str, session_label: str):
+    if session_store is None or not record.session_id:
+        return
+    state = next_state(previous, record, first, hits, visitor_alias, session_label)
+    try:
+        stored = session_store.put(record.session_id, state, previous["version"] if previous else None)
+    except Exception:
+        session_state_total.inc("error")
+        return
+    session_state_total.inc("stored" if stored else "conflict")
+
+async def save_visit_state_async(previous: dict, record, first, hits: int, visitor_alias: str, session_label: str):
+    if session_store is not None and session_store.blocking:
+        return await asyncio.to_thread(save_visit_state, previous, record, first, hits, visitor_alias, session_label)
+    return save_visit_state(previous, record, first, hits, visitor_alias, session_label)
+
+
+# Snapshot helpers
+def _iso(ts):
+    return ts.isoformat() if ts is not None else None
+
+def first_visit_snapshot(row) -> dict:
+    snapshot = {field: getattr(row, field) for field in FIRST_VISIT_FIELDS}
+    snapshot["timestamp"] = _iso(row.timestamp)
+    return snapshot
+
+# The first visit as an object derive_visit / update_rollups can read like a VisitorLog row
+def first_visit(state: dict):
+    first = dict(state["first"])
+    first["timestamp"] = datetime.fromisoformat(first["timestamp"]) if first["timestamp"] else None
+    return SimpleNamespace(**first)
+
+# Last visit row (id, client_timestamp) logged for a page of the session
+def page_visit(state: dict, page: str):
+    entry = (state or {}).get("pages", {}).get(page)
+    if entry is None:
+        return None
+    return entry[0], datetime.fromisoformat(entry[1]) if entry[1] else None
+
+def next_state(previous: dict, record, first, hits: int, visitor_alias: str, session_label: str) -> dict:
+    pages = dict(previous["pages"]) if previous else {}
+    pages.pop(record.page, None)
+    pages[record.page] = [record.id, _iso(record.client_timestamp)]
+    while len(pages) > SESSION_STATE_MAX_PAGES:
+        pages.pop(next(iter(pages)))
+    return {
+        "version": (previous["version"] + 1) if previous else 1,
+        "first": first_visit_snapshot(first) if first is not None else None,
+        "hits": hits,
+        "fingerprint_id": record.fingerprint_id,
+        "visitor_alias": visitor_alias,
+        "session_label": session_label,
+        "pages": pages,
+    }
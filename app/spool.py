@@ -0,0 +1,419 @@
+# Local durable spool for ingest (INGEST_SPOOL=1): /log-visit, /log-event(s) and /log-exit append the
+# validated request to an on-disk SQLite file (WAL, synchronous=FULL) and answer as soon as it is
+# durable; nothing on the request path waits for Postgres or the IP lookup. A writer thread group-commits
+# appends (one fsync per group of up to SPOOL_GROUP_MAX entries, waiting at most SPOOL_GROUP_WAIT_MS).
+#
+# A replayer task feeds entries to the normal ingest code in spool order, one batch at a time, backing
+# off while Postgres is unreachable. An entry that fails for any other reason (bad payload, constraint
+# violation) would fail on every retry, so it moves to the dead_letters table and replay carries on;
+# `python -m app.spool --requeue-dead` puts dead letters back once the cause is fixed. Each replayed unit commits together with the spool checkpoint row in
+# sync_checkpoints ("spool:<spool id>"), so a crash between the Postgres commit and the spool cleanup
+# never replays an entry twice. With several uvicorn workers sharing SPOOL_PATH, one of them (flock on
+# SPOOL_PATH + ".lock") replays; the others only append. SPOOL_MAX_PENDING bounds the backlog: beyond
+# it appends are refused (SpoolFull) rather than filling the disk.
+#
+# CLI: python -m app.spool [--status] [--replay] [--dead-letters] [--requeue-dead]
+
+import os
+import json
+import time
+import uuid
+import queue
+import fcntl
+import sqlite3
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+from app import logs
+from app.codec import dumps, loads
+
+INGEST_SPOOL = os.getenv("INGEST_SPOOL", "0") == "1"
+SPOOL_PATH = os.getenv("SPOOL_PATH", "spool/ingest.db")                  # Must be on a persistent disk
+SPOOL_GROUP_MAX = int(os.getenv("SPOOL_GROUP_MAX", "256"))               # Entries per group commit
+SPOOL_GROUP_WAIT_MS = float(os.getenv("SPOOL_GROUP_WAIT_MS", "2"))       # Wait for more entries after the first
+SPOOL_MAX_PENDING = int(os.getenv("SPOOL_MAX_PENDING", "1000000"))       # Backlog at which appends are refused
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "0.5"))  # Seconds between polls when idle
+SPOOL_REPLAY_RATE = float(os.getenv("SPOOL_REPLAY_RATE", "0"))           # Max entries/sec replayed (0: unlimited)
+SPOOL_RETRY_MAX = float(os.getenv("SPOOL_RETRY_MAX", "30"))              # Backoff cap while Postgres is failing
+
+
+class SpoolFull(Exception):
+    pass
+
+
+# Raised by the apply callback for an entry that can't be applied; entries before it are committed
+class SpoolEntryFailed(Exception):
+    def __init__(self, entry, error: Exception):
+        super().__init__(f"{type(error).__name__}: {error}")
+        self.entry = entry
+        self.error = error
+
+
+# Errors worth retrying: the database (or the network to it) is down or overloaded. Anything else
+# is a property of the entry itself and would fail again on every retry.
+def transient(ex: Exception) -> bool:
+    from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError, DisconnectionError
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+    if isinstance(ex, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError,
+                       ConnectionError, TimeoutError, OSError)):
+        return True
+    return isinstance(ex, DBAPIError) and ex.connection_invalidated
+
+
+class IngestSpool:
+    def __init__(self, path=SPOOL_PATH, enabled=INGEST_SPOOL, group_max=SPOOL_GROUP_MAX,
+                 group_wait_ms=SPOOL_GROUP_WAIT_MS, max_pending=SPOOL_MAX_PENDING):
+        self.path = path
+        self.enabled = enabled
+        self.group_max = group_max
+        self.group_wait = group_wait_ms / 1000
+        self.max_pending = max_pending
+        self.spool_id = None
+        self.writes = queue.Queue()
+        self.writer = None
+        self.task = None
+        self.wakeup = None   # Set by group commits and stop()
+        self.halt = None     # Set by stop() only; backoff sleeps ignore new appends
+        self.stopping = False
+        self.lock_file = None
+        self.apply = None
+        self.pending = 0
+        self.dead_letters = 0
+        self.stats = {
+            "appended": 0,
+            "group_commits": 0,
+            "append_failures": 0,
+            "rejected_full": 0,
+            "replayed": 0,
+            "replay_batches": 0,
+            "replay_failures": 0,
+            "dead_lettered": 0,
+            "replay_seconds": 0.0,      # Time spent applying batches (excludes idle / backoff)
+            "last_replay_rate": None,   # Entries/sec of the last replayed batch
+            "max_group": 0,
+        }
+
+    # ✅ Storage
+    def connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")   # fsync the WAL on every (group) commit
+        return conn
+
+    def open(self):
+        conn = self.connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+                         "ip TEXT, received_at TEXT NOT NULL, payload BLOB NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS dead_letters (seq INTEGER PRIMARY KEY, kind TEXT NOT NULL, ip TEXT, "
+                         "received_at TEXT NOT NULL, payload BLOB NOT NULL, error TEXT, failed_at TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('spool_id', ?)", (uuid.uuid4().hex,))
+            self.spool_id = conn.execute("SELECT value FROM meta WHERE key = 'spool_id'").fetchone()[0]
+            self.pending = self._count(conn)
+            self.dead_letters = conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _count(conn) -> int:
+        low, high = conn.execute("SELECT min(seq), max(seq) FROM entries").fetchone()
+        return high - low + 1 if high is not None else 0   # Rowid span: O(1), exact unless replay left holes
+
+    @property
+    def checkpoint_name(self) -> str:
+        return f"spool:{self.spool_id}"
+
+    def read_batch(self, after_seq: int, limit: int) -> list:
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT seq, kind, ip, received_at, payload FROM entries WHERE seq > ? "
+                                "ORDER BY seq LIMIT ?", (after_seq, limit)).fetchall()
+        finally:
+            conn.close()
+        return [SimpleNamespace(seq=seq, kind=kind, ip=ip, received_at=datetime.fromisoformat(received_at),
+                                payload=loads(payload)) for seq, kind, ip, received_at, payload in rows]
+
+    def delete_through(self, seq: int):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM entries WHERE seq <= ?", (seq,))
+            self.pending = self._count(conn)
+        finally:
+            conn.close()
+
+    # Move one entry out of the replay order, keeping it (and why it failed) for inspection / requeue
+    def dead_letter(self, seq: int, error: str):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO dead_letters SELECT seq, kind, ip, received_at, payload, ?, ? "
+                         "FROM entries WHERE seq = ?", (error, datetime.utcnow().isoformat(), seq))
+            conn.execute("DELETE FROM entries WHERE seq = ?", (seq,))
+            conn.execute("COMMIT")
+            self.dead_letters = conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+
+    def list_dead_letters(self, limit: int = 100) -> list:
+        conn = self.connect()
+        try:
+            rows = conn.execute("SELECT seq, kind, ip, received_at, error, failed_at FROM dead_letters "
+                                "ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(("seq", "kind", "ip", "received_at", "error", "failed_at"), row)) for row in rows]
+
+    # Dead letters go back to the end of the spool (new seqs, original received_at)
+    def requeue_dead_letters(self) -> int:
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            moved = conn.execute("INSERT INTO entries (kind, ip, received_at, payload) SELECT kind, ip, received_at, "
+                                 "payload FROM dead_letters ORDER BY seq").rowcount
+            conn.execute("DELETE FROM dead_letters")
+            conn.execute("COMMIT")
+            self.dead_letters = 0
+            self.pending = self._count(conn)
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            conn.close()
+        return moved
+
+    # ✅ Append path: requests wait on a future the writer thread resolves after the group's commit
+    async def append(self, kind: str, payload: dict, ip: str) -> int:
+        if self.pending >= self.max_pending:
+            self.stats["rejected_full"] += 1
+            raise SpoolFull(f"Spool backlog at {self.pending} entries")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.writes.put((kind, ip, datetime.utcnow().isoformat(), dumps(payload), loop, future))
+        return await future
+
+    def write_loop(self):
+        conn = self.connect()
+        while True:
+            item = self.writes.get()
+            if item is None:
+                break
+            group = [item]
+            deadline = time.monotonic() + self.group_wait
+            while len(group) < self.group_max:
+                try:
+                    item = self.writes.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.writes.put(None)   # Finish this group, then stop
+                    break
+                group.append(item)
+            self._commit_group(conn, group)
+        conn.close()
+
+    def _commit_group(self, conn, group):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            seqs = [conn.execute("INSERT INTO entries (kind, ip, received_at, payload) VALUES (?, ?, ?, ?)",
+                                 item[:4]).lastrowid for item in group]
+            conn.execute("COMMIT")
+        except Exception as ex:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.stats["append_failures"] += len(group)
+            logs.error("spool_append_failed", entries=len(group), error=str(ex))
+            for *_, loop, future in group:
+                loop.call_soon_threadsafe(_resolve, future, None, ex)
+            return
+        self.pending += len(group)
+        self.stats["appended"] += len(group)
+        self.stats["group_commits"] += 1
+        self.stats["max_group"] = max(self.stats["max_group"], len(group))
+        for seq, (*_, loop, future) in zip(seqs, group):
+            loop.call_soon_threadsafe(_resolve, future, seq, None)
+        if self.wakeup is not None and self.task is not None:
+            self.task.get_loop().call_soon_threadsafe(self.wakeup.set)
+
+    # ✅ Lifecycle
+    @property
+    def running(self) -> bool:
+        return self.writer is not None
+
+    def start(self, apply):
+        if not self.enabled or self.writer is not None:
+            return
+        self.open()
+        self.apply = apply
+        self.stopping = False
+        self.writer = threading.Thread(target=self.write_loop, name="spool-writer", daemon=True)
+        self.writer.start()
+        self.wakeup = asyncio.Event()
+        self.halt = asyncio.Event()
+        self.task = asyncio.create_task(self.replay_loop())
+        logs.info("spool_started", sampled=False, path=self.path, pending=self.pending)
+
+    async def stop(self):
+        if self.writer is None:
+            return
+        self.writes.put(None)
+        await asyncio.to_thread(self.writer.join)
+        self.writer = None
+        self.stopping = True
+        self.halt.set()
+        self.wakeup.set()
+        await self.task
+        self.task = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+        logs.info("spool_stopped", sampled=False, **self.snapshot())
+
+    # ✅ Replay
+    def _try_lead(self) -> bool:
+        if self.lock_file is None:
+            self.lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _checkpoint(self) -> int:
+        from app.db import SessionLocal
+        from app.checkpoints import get_checkpoint
+
+        db = SessionLocal()
+        try:
+            return int(get_checkpoint(db, self.checkpoint_name, 0))
+        finally:
+            db.close()
+
+    async def replay_loop(self):
+        leader, replayed_seq, backoff = False, None, SPOOL_REPLAY_INTERVAL
+        while not self.stopping:
+            try:
+                leader = leader or await asyncio.to_thread(self._try_lead)
+                if not leader:
+                    await asyncio.to_thread(self._refresh_pending)
+                    await self._idle(SPOOL_REPLAY_INTERVAL * 4)
+                    continue
+                if replayed_seq is None:
+                    # Where Postgres says we are; entries up to there were applied before a crash/restart
+                    replayed_seq = await asyncio.to_thread(self._checkpoint)
+                    await asyncio.to_thread(self.delete_through, replayed_seq)
+                replayed = await self.replay_batch(replayed_seq)
+                if replayed is None:
+                    await self._idle(SPOOL_REPLAY_INTERVAL)
+                    continue
+                replayed_seq, backoff = replayed, SPOOL_REPLAY_INTERVAL
+            except Exception as ex:
+                self.stats["replay_failures"] += 1
+                logs.warning("spool_replay_failed", error_type=type(ex).__name__, error=str(ex), retry_in=backoff)
+                replayed_seq = None   # Some units may have committed: re-read the checkpoint
+                await self._idle(backoff, self.halt)
+                backoff = min(backoff * 2, SPOOL_RETRY_MAX)
+
+    # Replay one batch after `after_seq`; returns the new checkpoint, or None when the spool is empty
+    async def replay_batch(self, after_seq: int):
+        entries = await asyncio.to_thread(self.read_batch, after_seq, SPOOL_REPLAY_BATCH)
+        if not entries:
+            return None
+        started = time.perf_counter()
+        try:
+            await self.apply(entries, self.checkpoint_name)
+        except SpoolEntryFailed as failed:
+            # Everything before the failed entry is committed; set it aside and resume after it
+            seq = failed.entry.seq
+            await asyncio.to_thread(self.dead_letter, seq, str(failed))
+            await asyncio.to_thread(self.delete_through, seq)
+            self.stats["dead_lettered"] += 1
+            self.stats["replayed"] += sum(1 for entry in entries if entry.seq < seq)
+            logs.error("spool_entry_dead_lettered", seq=seq, kind=failed.entry.kind,
+                       error_type=type(failed.error).__name__, error=str(failed.error))
+            return seq
+        elapsed = time.perf_counter() - started
+        await asyncio.to_thread(self.delete_through, entries[-1].seq)
+        self.stats["replayed"] += len(entries)
+        self.stats["replay_batches"] += 1
+        self.stats["replay_seconds"] += elapsed
+        self.stats["last_replay_rate"] = round(len(entries) / elapsed, 1) if elapsed else None
+        if SPOOL_REPLAY_RATE > 0:
+            await asyncio.sleep(max(0.0, len(entries) / SPOOL_REPLAY_RATE - elapsed))
+        return entries[-1].seq
+
+    def _refresh_pending(self):
+        conn = self.connect()
+        try:
+            self.pending = self._count(conn)
+        finally:
+            conn.close()
+
+    async def _idle(self, seconds: float, event=None):
+        event = event or self.wakeup
+        try:
+            await asyncio.wait_for(event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    def snapshot(self):
+        seconds = self.stats["replay_seconds"]
+        return {**self.stats, "replay_seconds": round(seconds, 3), "enabled": self.enabled, "pending": self.pending,
+                "dead_letters": self.dead_letters,
+                "queued_appends": self.writes.qsize(),
+                "avg_replay_rate": round(self.stats["replayed"] / seconds, 1) if seconds else None,
+                "avg_group": round(self.stats["appended"] / self.stats["group_commits"], 1) if self.stats["group_commits"] else None}
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+ingest_spool = IngestSpool()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or drain the local ingest spool")
+    parser.add_argument("--path", default=SPOOL_PATH)
+    parser.add_argument("--replay", action="store_true", help="replay every pending entry into the database, then exit")
+    parser.add_argument("--dead-letters", action="store_true", help="list entries set aside because they failed to apply")
+    parser.add_argument("--requeue-dead", action="store_true", help="move dead letters back into the spool")
+    args = parser.parse_args(argv)
+
+    spool = IngestSpool(path=args.path, enabled=True)
+    spool.open()
+    if args.dead_letters:
+        print(json.dumps(spool.list_dead_letters(), indent=2))
+    if args.requeue_dead:
+        print(f"💾 Requeued {spool.requeue_dead_letters()} dead letters")
+    if args.replay:
+        from app.main import replay_spooled
+
+        async def drain():
+            spool.apply = replay_spooled
+            if not spool._try_lead():
+                raise SystemExit("Another process is replaying this spool")
+            seq = await asyncio.to_thread(spool._checkpoint)
+            await asyncio.to_thread(spool.delete_through, seq)
+            while (seq := await spool.replay_batch(seq)) is not None:
+                print(f"💾 Replayed through seq {seq} ({spool.stats['last_replay_rate']} entries/s)")
+
+        asyncio.run(drain())
+    print(json.dumps({"path": args.path, "spool_id": spool.spool_id, **spool.snapshot()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# Purpose: Distinct visitor / session counts over arbitrary time ranges without COUNT(DISTINCT) scans.
+# Each (hour, page, country, utm_campaign) keeps two HyperLogLog sketches (fingerprint_id, session_id),
+# updated inside the /log-visit (derive_visit) and /log-event(s) transactions. Sketches merge by
+# register-wise max, so any range / grouping is answered by merging its hourly rows on read.
+#
+# Error bound: with 2^p registers the relative standard error is 1.04 / sqrt(2^p) — at the default
+# p = 12 that is ±1.6% (68% of estimates), ±3.3% (95%), ±4.9% (99.7%), independent of how many
+# rows are merged. Sketches are 4 KiB of bytea each and mostly zeros early on (TOAST compresses them).
+# Changing UNIQUES_PRECISION needs `python -m app.uniques --rebuild`.
+#
+# CLI: python -m app.uniques --rebuild | --verify [--since ISO] [--until ISO] [--group-by country,...]
+
+import os
+import math
+import hashlib
+import argparse
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, delete, func, literal, union_all
+from sqlalchemy.orm import Session
+
+from app import logs
+from app.models import UniqueSketch, VisitorLog, VisitorEventLog, to_naive_utc
+
+UNIQUES_PRECISION = int(os.getenv("UNIQUES_PRECISION", "12"))   # 2^p one-byte registers per sketch
+REGISTERS = 1 << UNIQUES_PRECISION
+RELATIVE_STANDARD_ERROR = 1.04 / math.sqrt(REGISTERS)
+
+DIMENSIONS = ["page", "country", "utm_campaign"]
+SKETCHES = {"visitors": "fingerprint_id", "sessions": "session_id"}   # Sketch column -> counted attribute
+
+
+# ✅ HyperLogLog
+def register_of(value: str, precision: int = UNIQUES_PRECISION):
+    # Stable 64-bit hash (Python's hash() is salted per process); top p bits pick the register,
+    # the rank is the position of the first 1-bit in the rest
+    x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+    rest_bits = 64 - precision
+    rest = x & ((1 << rest_bits) - 1)
+    return x >> rest_bits, rest_bits - rest.bit_length() + 1
+
+def empty_registers() -> np.ndarray:
+    return np.zeros(REGISTERS, dtype=np.uint8)
+
+def registers(raw) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.uint8) if raw is not None else empty_registers()
+
+def estimate(regs: np.ndarray) -> int:
+    m = len(regs)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -regs.astype(np.int32))))
+    zeros = int(np.count_nonzero(regs == 0))
+    if raw <= 2.5 * m and zeros:
+        return round(m * math.log(m / zeros))   # Linear counting for small cardinalities
+    return round(raw)
+
+
+# Dimension values for a visit / event row (objects or dicts)
+def _value(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+
+def sketch_key(row) -> tuple:
+    ts = _value(row, "timestamp") or datetime.utcnow()
+    return (ts.replace(minute=0, second=0, microsecond=0), *(_value(row, d) or "" for d in DIMENSIONS))
+
+
+# ✅ Ingest: register updates grouped per sketch row, applied in the caller's transaction
+def add_uniques(db: Session, rows):
+    updates = {}   # key -> {sketch column -> {register -> rank}}
+    for row in rows:
+        per_row = updates.setdefault(sketch_key(row), {column: {} for column in SKETCHES})
+        for column, attribute in SKETCHES.items():
+            value = _value(row, attribute)
+            if value:
+                idx, rank = register_of(str(value))
+                if rank > per_row[column].get(idx, 0):
+                    per_row[column][idx] = rank
+
+    postgres = db.bind.dialect.name == "postgresql"
+    for key in sorted(updates):   # Fixed order: concurrent transactions lock rows the same way
+        if postgres:
+            _apply_postgres(db, key, updates[key])
+        else:
+            _apply_generic(db, key, updates[key])
+
+
+def _key_values(key) -> dict:
+    return {"bucket": key[0], **dict(zip(DIMENSIONS, key[1:]))}
+
+# Atomic in-place register max: set_byte(get_byte) under the upsert's row lock, no read round trip
+def _apply_postgres(db: Session, key, changes: dict):
+    from sqlalchemy.dialects.postgresql import insert
+
+    table = UniqueSketch.__table__
+
+    def fresh(column):
+        expr = func.decode(func.repeat("00", REGISTERS), "hex")
+        for idx, rank in changes[column].items():
+            expr = func.set_byte(expr, idx, rank)
+        return expr
+
+    def merged(column):
+        expr = table.c[column]
+        for idx, rank in changes[column].items():
+            expr = func.set_byte(expr, idx, func.greatest(func.get_byte(table.c[column], idx), rank))
+        return expr
+
+    stmt = insert(table).values(**_key_values(key), **{column: fresh(column) for column in SKETCHES})
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["bucket", *DIMENSIONS],
+        set_={column: merged(column) for column in SKETCHES if changes[column]},
+    ) if any(changes.values()) else stmt.on_conflict_do_nothing())
+
+# Read-merge-write (the SQLite stand-in serializes writers, and callers have already written in this transaction)
+def _apply_generic(db: Session, key, changes: dict):
+    from app.db import dialect_insert
+
+    table = UniqueSketch.__table__
+    values = _key_values(key)
+    existing = db.execute(
+        select(*[table.c[column] for column in SKETCHES]).where(*[table.c[k] == v for k, v in values.items()])
+    ).first()
+    sketches = {}
+    for i, column in enumerate(SKETCHES):
+        regs = registers(existing[i] if existing else None).copy()
+        for idx, rank in changes[column].items():
+            regs[idx] = max(regs[idx], rank)
+        sketches[column] = regs.tobytes()
+
+    stmt = dialect_insert(db, table).values(**values, **sketches)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["bucket", *DIMENSIONS],
+        set_={column: stmt.excluded[column] for column in SKETCHES},
+    ))
+
+
+# ✅ Read: merge the hourly sketches of a range, optionally per hour/day bucket and per dimension
+def unique_counts(db: Session, since: datetime = None, until: datetime = None, group_by: list = (),
+                  filters: dict = None, interval: str = "total") -> list:
+    query = select(UniqueSketch.bucket, *[getattr(UniqueSketch, d) for d in DIMENSIONS],
+                   UniqueSketch.visitors, UniqueSketch.sessions)
+    if since is not None:
+        query = query.where(UniqueSketch.bucket >= to_naive_utc(since))
+    if until is not None:
+        query = query.where(UniqueSketch.bucket < to_naive_utc(until))
+    for name, value in (filters or {}).items():
+        query = query.where(getattr(UniqueSketch, name) == value)
+
+    merged = {}
+    for row in db.execute(query.execution_options(yield_per=1000)):
+        bucket = None if interval == "total" else (row.bucket.replace(hour=0) if interval == "day" else row.bucket)
+        group = (bucket, *(getattr(row, d) for d in group_by))
+        acc = merged.get(group)
+        if acc is None:
+            acc = merged[group] = (empty_registers(), empty_registers())
+        for regs, raw in zip(acc, (row.visitors, row.sessions)):
+            if len(raw) == REGISTERS:   # Sketches from another UNIQUES_PRECISION are skipped until --rebuild
+                np.maximum(regs, registers(raw), out=regs)
+
+    results = []
+    for group in sorted(merged, key=lambda g: tuple("" if v is None else v for v in g)):
+        item = {"bucket": group[0].isoformat()} if interval != "total" else {}
+        item.update({d: (v or None) for d, v in zip(group_by, group[1:])})
+        item["visitors"] = estimate(merged[group][0])
+        item["sessions"] = estimate(merged[group][1])
+        results.append(item)
+    return results
+
+def error_bound() -> dict:
+    return {
+        "precision": UNIQUES_PRECISION,
+        "relative_standard_error": round(RELATIVE_STANDARD_ERROR, 4),
+        "within_95pct": round(2 * RELATIVE_STANDARD_ERROR, 4),
+        "within_99_7pct": round(3 * RELATIVE_STANDARD_ERROR, 4),
+    }
+
+
+# ✅ Rebuild from visitor_logs + visitor_event_logs (backfill, or after changing UNIQUES_PRECISION)
+def _sources(since: datetime = None, until: datetime = None):
+    selects = []
+    for model in (VisitorLog, VisitorEventLog):
+        campaign = model.utm_campaign if hasattr(model, "utm_campaign") else literal(None)
+        query = select(model.timestamp.label("timestamp"), model.page.label("page"), model.country.label("country"),
+                       campaign.label("utm_campaign"), model.fingerprint_id.label("fingerprint_id"),
+                       model.session_id.label("session_id"))
+        if since is not None:
+            query = query.where(model.timestamp >= to_naive_utc(since))
+        if until is not None:
+            query = query.where(model.timestamp < to_naive_utc(until))
+        selects.append(query)
+    return union_all(*selects).subquery()
+
+# Ingest waits on unique_sketches until this commits, so no visit / event lands between the scan and the rewrite
+def rebuild_uniques(db: Session, chunk_size: int = 10000) -> int:
+    from app.db import lock_for_rebuild
+
+    lock_for_rebuild(db, UniqueSketch.__table__)
+    db.execute(delete(UniqueSketch))
+    sketches = {}
+    source = _sources()
+    for row in db.execute(select(source).execution_options(stream_results=True, yield_per=chunk_size)):
+        if row.timestamp is None:
+            continue
+        regs = sketches.setdefault(sketch_key(row), (empty_registers(), empty_registers()))
+        for target, attribute in zip(regs, SKETCHES.values()):
+            value = getattr(row, attribute)
+            if value:
+                idx, rank = register_of(str(value))
+                target[idx] = max(target[idx], rank)
+
+    db.bulk_insert_mappings(UniqueSketch, [
+        {**_key_values(key), "visitors": regs[0].tobytes(), "sessions": regs[1].tobytes()}
+        for key, regs in sketches.items()
+    ])
+    db.commit()
+    logs.info("uniques_rebuilt", sampled=False, rows=len(sketches))
+    return len(sketches)
+
+
+# Compare sketch estimates with exact COUNT(DISTINCT) over the same rows
+def verify_uniques(db: Session, since: datetime = None, until: datetime = None, group_by: list = ()) -> list:
+    source = _sources(since, until)
+    keys = [func.coalesce(source.c[d], "").label(d) for d in group_by]
+    exact_query = select(*keys, func.count(source.c.fingerprint_id.distinct()).label("visitors"),
+                         func.count(source.c.session_id.distinct()).label("sessions"))
+    if keys:
+        exact_query = exact_query.group_by(*keys)
+    exact = {tuple(getattr(r, d) or None for d in group_by): r for r in db.execute(exact_query)}
+    estimated = {tuple(item[d] for d in group_by): item for item in unique_counts(db, since, until, group_by)}
+
+    report = []
+    for group in sorted(exact, key=lambda g: tuple(v or "" for v in g)):
+        for metric in SKETCHES:
+            want = getattr(exact[group], metric)
+            got = estimated.get(group, {}).get(metric, 0)
+            error = (got - want) / want if want else 0.0
+            report.append({"group": dict(zip(group_by, group)), "metric": metric, "exact": want,
+                           "estimate": got, "error": round(error, 4)})
+    outliers = [r for r in report if abs(r["error"]) > 3 * RELATIVE_STANDARD_ERROR]
+    for r in report[:40]:
+        print(f"{'❌' if r in outliers else '✅'} {r['group'] or 'all'} {r['metric']}: exact {r['exact']}, "
+              f"estimate {r['estimate']} ({r['error'] * 100:+.2f}%)")
+    errors = [abs(r["error"]) for r in report]
+    print(f"🔢 Verified {len(report)} counts: mean |error| {np.mean(errors) * 100 if errors else 0:.2f}%, "
+          f"max {max(errors, default=0) * 100:.2f}%, {len(outliers)} outside ±{3 * RELATIVE_STANDARD_ERROR * 100:.1f}% (3σ)")
+    return outliers
+
+
+def main(argv=None):
+    from app.db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify the unique visitor / session sketches")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every sketch from the log tables")
+    parser.add_argument("--verify", action="store_true", help="compare estimates with exact distinct counts")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="verify: range start (hour-aligned)")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="verify: range end (exclusive)")
+    parser.add_argument("--group-by", default="", help=f"verify: comma-separated {', '.join(DIMENSIONS)}")
+    args = parser.parse_args(argv)
+
+    group_by = [d.strip() for d in args.group_by.split(",") if d.strip()]
+    if any(d not in DIMENSIONS for d in group_by):
+        parser.error(f"--group-by takes {', '.join(DIMENSIONS)}")
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            rebuild_uniques(db)
+        if args.verify or not args.rebuild:
+            verify_uniques(db, args.since, args.until, group_by)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# Purpose: Second phase of /log-visit when VISIT_PIPELINE=deferred. The endpoint stores the raw visit
+# plus a visit_jobs row and returns; worker threads (in the API process, or `python -m app.visit_jobs`)
+# claim jobs with FOR UPDATE SKIP LOCKED and fill in the IP enrichment, probable/best-match alias,
+# signature index, VisitorDerivedLog row and rollups — the same steps the inline path runs.
+#
+# Idempotency: a job's results and its "done" mark commit in one transaction, and that transaction
+# is fenced on the claim (status + attempts), so a job reclaimed after its lease expired can never
+# be applied twice. Jobs retry with exponential backoff up to VISIT_JOB_MAX_ATTEMPTS, then stay "failed".
+# Done jobs are deleted VISIT_JOB_RETAIN_HOURS after they finish (by the first worker thread, or --prune).
+
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import logs
+from app.intel import get_probable_alias, index_entropy_signature
+from app.ipinfo import enrich_ip_data
+from app.metrics import Counter, Histogram, Collected, register
+from app.models import VisitorLog, VisitorDerivedLog, VisitJob
+from app.rollups import update_rollups, traffic_type_for, landing_source_for
+from app.uniques import add_uniques
+
+VISIT_PIPELINE = os.getenv("VISIT_PIPELINE", "inline")              # "inline" / "deferred"
+VISIT_WORKERS = int(os.getenv("VISIT_WORKERS", "2"))               # Threads started with the API (deferred only)
+VISIT_JOB_BATCH = int(os.getenv("VISIT_JOB_BATCH", "20"))          # Jobs claimed per round trip
+VISIT_JOB_POLL = float(os.getenv("VISIT_JOB_POLL", "0.5"))         # Seconds between polls when idle
+VISIT_JOB_LEASE = int(os.getenv("VISIT_JOB_LEASE", "300"))         # Seconds before a running job is reclaimed
+VISIT_JOB_MAX_ATTEMPTS = int(os.getenv("VISIT_JOB_MAX_ATTEMPTS", "5"))
+VISIT_JOB_BACKOFF = float(os.getenv("VISIT_JOB_BACKOFF", "2.0"))   # Seconds; doubles per attempt
+VISIT_JOB_RETAIN_HOURS = float(os.getenv("VISIT_JOB_RETAIN_HOURS", "24"))   # Done jobs kept this long; 0 keeps them
+VISIT_JOB_PRUNE_INTERVAL = float(os.getenv("VISIT_JOB_PRUNE_INTERVAL", "600"))   # Seconds between prunes
+VISIT_JOB_PRUNE_CHUNK = 5000
+VISIT_JOB_DEFER = 0.2   # Seconds to wait while an earlier visit of the same session is still in flight
+
+visit_job_lag_seconds = register(Histogram(
+    "visit_job_lag_seconds", "Time from raw visit insert to completed enrichment/scoring",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)))
+visit_jobs_total = register(Counter(
+    "visit_jobs_total", "Deferred visit jobs by outcome", labels=("outcome",)))
+
+
+# Another job for an earlier visit of the same session is pending/running; its rollups must land first
+class EarlierVisitPending(Exception):
+    pass
+
+
+# ✅ Shared by the inline path (app.main.record_visit) and the worker
+def apply_enrichment(record: VisitorLog, enriched: dict):
+    record.city = enriched.get("City")
+    record.region = enriched.get("Region")
+    record.country = enriched.get("Country")
+    record.organization = enriched.get("Organization")
+    record.enriched_source = "IPinfo"
+
+def apply_match(record: VisitorLog, match_result: dict):
+    record.probable_alias = match_result["probable_alias"]
+    record.probable_score = match_result["probable_score"]
+    record.best_match_alias = match_result["best_match_alias"]
+    record.best_match_score = match_result["best_match_score"]
+
+
+# Earliest visit + hit count for a session, as of visit `up_to_id` (the window count ignores LIMIT)
+def session_summary(db: Session, session_id, up_to_id: int = None):
+    query = db.query(VisitorLog, func.count().over()).filter(VisitorLog.session_id == session_id)
+    if up_to_id is not None:
+        query = query.filter(VisitorLog.id <= up_to_id)
+    row = query.order_by(VisitorLog.timestamp.asc(), VisitorLog.id.asc()).limit(1).first()
+    return (row[0], row[1]) if row else (None, 0)
+
+# Derived row + rollups for a flushed visit (same transaction as the visit itself).
+# `summary` is (earliest visit, hits including this one) when the caller already knows it (app.session_state).
+def derive_visit(db: Session, record: VisitorLog, returning_session: bool, summary=None):
+    # Counted up to this visit, so a late worker sees the session exactly as the inline path would
+    earliest, session_entries = summary or session_summary(db, record.session_id, record.id)
+
+    db.add(VisitorDerivedLog(
+        session_id=record.session_id,
+        fingerprint_id=record.fingerprint_id,
+        visit_type="Returning" if returning_session else "New",
+        traffic_type=traffic_type_for(record.utm_source, record.referrer),
+        entry_page=earliest.page if record.session_id and earliest else record.page,
+        bounced="Yes" if session_entries <= 1 else "No",
+        geo_region_type="Domestic" if record.country == "IN" else "International",
+        landing_source=landing_source_for(record.utm_source, record.referrer),
+    ))
+    update_rollups(db, record, not returning_session, session_entries, earliest)
+    add_uniques(db, [record])
+    return earliest, session_entries
+
+
+# ✅ Queue
+def enqueue_visit(db: Session, record: VisitorLog, returning_session: bool):
+    db.add(VisitJob(visit_id=record.id, returning_session=returning_session))
+
+# Claim up to `limit` due jobs (or running jobs whose lease expired) in one statement
+def claim_jobs(db: Session, limit: int = VISIT_JOB_BATCH) -> list:
+    now = datetime.utcnow()
+    claimable = (
+        select(VisitJob.id)
+        .where(or_(
+            and_(VisitJob.status == "pending", VisitJob.run_after <= now),
+            and_(VisitJob.status == "running", VisitJob.locked_at < now - timedelta(seconds=VISIT_JOB_LEASE)),
+        ))
+        .order_by(VisitJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    jobs = db.execute(
+        update(VisitJob)
+        .where(VisitJob.id.in_(claimable))
+        .values(status="running", locked_at=now, attempts=VisitJob.attempts + 1)
+        .returning(VisitJob.id, VisitJob.visit_id, VisitJob.returning_session, VisitJob.attempts, VisitJob.created_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return sorted(jobs, key=lambda job: job.id)
+
+# UPDATE for a job we still hold (fails once the claim has been taken over)
+def _held(job):
+    return (
+        update(VisitJob)
+        .where(VisitJob.id == job.id, VisitJob.status == "running", VisitJob.attempts == job.attempts)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _earlier_visit_pending(db: Session, record: VisitorLog) -> bool:
+    if not record.session_id:
+        return False
+    return db.query(VisitJob.id).join(VisitorLog, VisitorLog.id == VisitJob.visit_id).filter(
+        VisitorLog.session_id == record.session_id,
+        VisitJob.visit_id < record.id,
+        VisitJob.status.in_(["pending", "running"]),
+    ).first() is not None
+
+
+# Enrichment, scoring, signature index, derived row and rollups for one raw visit
+def complete_visit(db: Session, record: VisitorLog, returning_session: bool, enriched: dict):
+    apply_enrichment(record, enriched)
+    entropy = record.entropy_data
+    apply_match(record, get_probable_alias(db, entropy or {}, record.fingerprint_id, before_id=record.id))
+    db.flush()
+    index_entropy_signature(db, record, entropy)
+    derive_visit(db, record, returning_session)
+
+
+# Run one claimed job; returns its outcome ("done" / "deferred" / "retry" / "failed" / "lost")
+def process_job(db: Session, job) -> str:
+    try:
+        # The IP lookup (possibly an HTTP call) happens before any row is locked
+        record = db.get(VisitorLog, job.visit_id)
+        enriched = enrich_ip_data(record.ip_address) if record is not None else {}
+
+        # Fence: takes the job's row lock and proves the claim is still ours
+        if db.execute(_held(job).values(status="done", finished_at=datetime.utcnow(), last_error=None)).rowcount != 1:
+            db.rollback()
+            return "lost"
+        if record is not None:
+            if _earlier_visit_pending(db, record):
+                raise EarlierVisitPending()
+            complete_visit(db, record, job.returning_session, enriched)
+        db.commit()
+        visit_job_lag_seconds.observe(value=(datetime.utcnow() - job.created_at).total_seconds())
+        return "done"
+
+    except EarlierVisitPending:
+        db.rollback()
+        released = db.execute(_held(job).values(
+            status="pending", attempts=job.attempts - 1,
+            run_after=datetime.utcnow() + timedelta(seconds=VISIT_JOB_DEFER),
+        )).rowcount
+        db.commit()
+        return "deferred" if released else "lost"
+
+    except Exception as ex:
+        db.rollback()
+        failed = job.attempts >= VISIT_JOB_MAX_ATTEMPTS
+        released = db.execute(_held(job).values(
+            status="failed" if failed else "pending",
+            run_after=datetime.utcnow() + timedelta(seconds=VISIT_JOB_BACKOFF * 2 ** (job.attempts - 1)),
+            last_error=f"{type(ex).__name__}: {ex}"[:2000],
+        )).rowcount
+        db.commit()
+        if not released:
+            return "lost"
+        log = logs.error if failed else logs.warning
+        log("visit_job_failed", job_id=job.id, visit_id=job.visit_id, attempt=job.attempts, final=failed,
+            error_type=type(ex).__name__, error=str(ex))
+        return "failed" if failed else "retry"
+
+
+# Claim and process one batch; returns the number of jobs claimed
+def run_batch(db: Session, limit: int = VISIT_JOB_BATCH) -> int:
+    jobs = claim_jobs(db, limit)
+    for job in jobs:
+        visit_jobs_total.inc(process_job(db, job))
+    return len(jobs)
+
+
+# Delete done jobs that finished more than `hours` ago; returns the number deleted
+def prune_done_jobs(db: Session, hours: float = VISIT_JOB_RETAIN_HOURS) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    old = select(VisitJob.id).where(VisitJob.status == "done", VisitJob.finished_at < cutoff).limit(VISIT_JOB_PRUNE_CHUNK)
+    deleted = 0
+    while True:
+        ids = db.execute(old).scalars().all()
+        if not ids:
+            return deleted
+        db.query(VisitJob).filter(VisitJob.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+
+
+# Jobs by status and the age of the oldest pending one (the pipeline's lag), in one query
+def queue_stats(db: Session) -> dict:
+    rows = db.query(VisitJob.status, func.count(), func.min(VisitJob.created_at)).group_by(VisitJob.status).all()
+    counts = {status: count for status, count, _ in rows}
+    oldest = next((created for status, _, created in rows if status == "pending"), None)
+    return {
+        **{status: counts.get(status, 0) for status in ("pending", "running", "done", "failed")},
+        "oldest_pending_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+# Both queue gauges read the same snapshot, so a scrape runs queue_stats once
+_queue_snapshot = {"at": 0.0, "stats": None}
+
+def _queue_stats():
+    from app.db import SessionLocal
+
+    if _queue_snapshot["stats"] is None or time.monotonic() - _queue_snapshot["at"] > 1.0:
+        db = SessionLocal()
+        try:
+            _queue_snapshot["stats"] = queue_stats(db)
+        finally:
+            db.close()
+        _queue_snapshot["at"] = time.monotonic()
+    return _queue_snapshot["stats"]
+
+if VISIT_PIPELINE == "deferred":
+    register(Collected("visit_jobs", "Deferred visit jobs by status",
+                       lambda: {k: v for k, v in _queue_stats().items() if k != "oldest_pending_seconds"},
+                       label="status"))
+    register(Collected("visit_job_oldest_pending_seconds", "Age of the oldest pending visit job",
+                       lambda: _queue_stats()["oldest_pending_seconds"]))
+
+
+# ✅ Worker pool: threads polling the queue (sync sessions, like the scoring code they run)
+class VisitWorker:
+    def __init__(self, threads: int = VISIT_WORKERS, batch_size: int = VISIT_JOB_BATCH, poll: float = VISIT_JOB_POLL):
+        self.threads = threads
+        self.batch_size = batch_size
+        self.poll = poll
+        self.stopping = threading.Event()
+        self.workers = []
+
+    def start(self):
+        if self.threads <= 0 or self.workers:
+            return
+        self.stopping.clear()
+        self.workers = [threading.Thread(target=self.run, args=(i == 0,), name=f"visit-worker-{i}", daemon=True)
+                        for i in range(self.threads)]
+        for worker in self.workers:
+            worker.start()
+        logs.info("visit_workers_started", sampled=False, threads=self.threads, batch_size=self.batch_size)
+
+    def stop(self, timeout: float = 10.0):
+        self.stopping.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def run(self, prunes: bool = False):
+        from app.db import SessionLocal
+
+        next_prune = time.monotonic()
+        while not self.stopping.is_set():
+            db = SessionLocal()
+            try:
+                if prunes and VISIT_JOB_RETAIN_HOURS > 0 and time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + VISIT_JOB_PRUNE_INTERVAL
+                    prune_done_jobs(db)
+                claimed = run_batch(db, self.batch_size)
+            except Exception as ex:
+                db.rollback()
+                logs.error("visit_worker_error", error_type=type(ex).__name__, error=str(ex))
+                claimed = 0
+            finally:
+                db.close()
+            if claimed < self.batch_size:
+                self.stopping.wait(self.poll)
+
+    # Process everything due now (CLI --drain, benchmarks); returns jobs claimed
+    def drain(self) -> int:
+        from app.db import SessionLocal
+
+        total = 0
+        db = SessionLocal()
+        try:
+            while True:
+                claimed = run_batch(db, self.batch_size)
+                total += claimed
+                if not claimed:
+                    return total
+        finally:
+            db.close()
+
+
+visit_worker = VisitWorker()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process deferred /log-visit jobs")
+    parser.add_argument("--workers", type=int, default=VISIT_WORKERS)
+    parser.add_argument("--batch", type=int, default=VISIT_JOB_BATCH)
+    parser.add_argument("--drain", action="store_true", help="process what is due now, then exit")
+    parser.add_argument("--prune", action="store_true", help="delete done jobs older than --retain-hours, then exit")
+    parser.add_argument("--retain-hours", type=float, default=VISIT_JOB_RETAIN_HOURS)
+    args = parser.parse_args(argv)
+
+    if args.prune:
+        from app.db import SessionLocal
+
+        db = SessionLocal()
+        try:
+            print(f"🧹 Pruned {prune_done_jobs(db, args.retain_hours)} done visit jobs")
+        finally:
+            db.close()
+        return 0
+
+    worker = VisitWorker(threads=args.workers, batch_size=args.batch)
+    if args.drain:
+        print(f"🧵 Processed {worker.drain()} visit jobs")
+        return 0
+
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# Airtable sync against a local stand-in server that enforces the 10-records/request cap,
+# 5 req/s throttling (429 + Retry-After) and random 503s. Compares one-record-per-request
+# pushes with the batched, rate-limited sync worker, then checks the incremental push of stored
+# ga_sessions: after a second fetch that adds rows and revises some already-pushed counts, only the
+# new and revised rows go out again.
+# Usage: python -m benchmarks.airtable_sync [records]
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import benchmarks.synthetic  # noqa: F401  (default DATABASE_URL)
+
+
+class StandIn(BaseHTTPRequestHandler):
+    records = {}
+    recent = deque()
+    lock = threading.Lock()
+    rng = random.Random(3)
+    stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_write(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            if len(self.recent) >= 5:
+                self.stats["throttled"] += 1
+                return self.reply(429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]}, {"Retry-After": "1"})
+            self.recent.append(now)
+            if self.rng.random() < 0.05:
+                self.stats["errors"] += 1
+                return self.reply(503, {"error": "SERVICE_UNAVAILABLE"})
+
+            records = payload.get("records") or [{"fields": payload.get("fields", {})}]
+            if len(records) > 10:
+                return self.reply(422, {"error": "INVALID_RECORDS", "message": "max 10 records"})
+
+            merge_on = (payload.get("performUpsert") or {}).get("fieldsToMergeOn")
+            out = []
+            for record in records:
+                fields = record["fields"]
+                key = "|".join(str(fields.get(f)) for f in merge_on) if merge_on else f"new-{len(self.records)}"
+                record_id = f"rec{abs(hash(key)) % 10**10:010d}"
+                self.records[key] = fields
+                out.append({"id": record_id, "fields": fields})
+        if "records" in payload:
+            return self.reply(200, {"records": out})
+        return self.reply(200, out[0])
+
+    do_POST = handle_write
+    do_PATCH = handle_write
+
+
+def main(total: int = 200):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/v0"
+
+    import app.airtable as airtable
+    from app import logs
+    from app.db import SessionLocal
+    from app.ga import store_ga_sessions
+    from benchmarks.synthetic import reset_database
+
+    logs.logger.disabled = True   # Keep the JSON report clean
+    airtable.AIRTABLE_GA_DEDUPE_FIELD = "Session Key"
+    reset_database()
+    db = SessionLocal()
+
+    sessions = [
+        {"timestamp": f"20261018{h:02d}{m:02d}", "page": f"/p{i % 7}", "device": "desktop",
+         "city": "Delhi", "country": "India", "sessions": 1}
+        for i, (h, m) in enumerate((i // 60, i % 60) for i in range(total))
+    ]
+    results = []
+
+    # Old behaviour: one POST per record (same limiter/retries, so this is a best case for it)
+    airtable.client = airtable.AirtableClient(token="bench", api_url=api_url)
+    started = time.perf_counter()
+    for s in sessions[: min(total, 50)]:
+        airtable.client.create_records("appBench", "Sessions", [airtable.ga_session_fields(s)])
+    elapsed = time.perf_counter() - started
+    results.append({"mode": "one record per request", "records": min(total, 50),
+                    "seconds": round(elapsed, 2), "records_per_sec": round(min(total, 50) / elapsed, 1)})
+
+    airtable.client = airtable.AirtableClient(token="bench", api_url=api_url)
+    # Second fetch: the rest of the rows (reversed, so keys arrive out of order) plus GA revising
+    # every tenth already-pushed minute
+    revised = [dict(s, sessions=2) for s in sessions[: total // 2 : 10]]
+    runs = (
+        ("incremental push (first half)", sessions[: total // 2], total // 2),
+        ("incremental push (new + revised)", sessions[total // 2 :][::-1] + revised, total - total // 2 + len(revised)),
+        ("incremental push (nothing changed)", [], 0),
+    )
+    for name, fetched, expected in runs:
+        store_ga_sessions(db, fetched)
+        result = airtable.push_stored_ga_sessions(db, chunk_size=40)
+        results.append({"mode": name, "expected_records": expected, **result})
+
+    results.append({"stand_in": StandIn.stats, "distinct_records_stored": len(StandIn.records),
+                    "revised_in_airtable": sum(1 for f in StandIn.records.values() if f.get("Sessions") == 2)})
+    db.close()
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airtable sync against a rate-limited stand-in server")
+    parser.add_argument("records", nargs="?", type=int, default=200)
+    args = parser.parse_args()
+    main(args.records)
@@ -0,0 +1,84 @@
+# Indexed get_probable_alias vs the brute-force scan: parity check + latency. The indexed lookup runs
+# twice: with an unbounded fallback scan (must match the brute-force scan exactly) and with the
+# opt-in ALIAS_FALLBACK_CANDIDATES cap (probable_alias must match; best_match_* may differ).
+# Usage: python -m benchmarks.alias_lookup [rows] [lookups] [--fallback-candidates 5000]
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from benchmarks.synthetic import make_entropy, mutate_entropy, reset_database, seed_visits
+
+
+def main(rows: int = 20000, lookups: int = 200, fallback_candidates: int = 5000):
+    import app.intel as intel
+    from app.db import SessionLocal
+    from app.intel import get_probable_alias, get_probable_alias_bruteforce, rebuild_signature_index
+
+    bounded = fallback_candidates
+    reset_database()
+    db = SessionLocal()
+    try:
+        seed_visits(db, rows)
+        rebuild_signature_index(db)
+
+        rng = random.Random(7)
+        devices = max(1, rows // 5)
+        timings = {"bruteforce": [], "indexed": [], f"capped {bounded}": []}
+        mismatches, capped_alias_mismatches, capped_best_differs = 0, 0, 0
+
+        for _ in range(lookups):
+            device = rng.randrange(devices * 2)  # Half the lookups are unseen devices
+            entropy = make_entropy(rng, device)
+            if rng.random() < 0.3:
+                entropy = mutate_entropy(rng, entropy)
+            fingerprint = f"fp-new-{rng.random()}"
+
+            started = time.perf_counter()
+            expected = get_probable_alias_bruteforce(db, entropy, fingerprint)
+            timings["bruteforce"].append(time.perf_counter() - started)
+
+            intel.ALIAS_FALLBACK_CANDIDATES = 0
+            started = time.perf_counter()
+            actual = get_probable_alias(db, entropy, fingerprint)
+            timings["indexed"].append(time.perf_counter() - started)
+
+            intel.ALIAS_FALLBACK_CANDIDATES = bounded
+            started = time.perf_counter()
+            capped = get_probable_alias(db, entropy, fingerprint)
+            timings[f"capped {bounded}"].append(time.perf_counter() - started)
+            intel.ALIAS_FALLBACK_CANDIDATES = 0
+
+            if (expected["probable_alias"], expected["best_match_alias"], expected["best_match_score"]) != \
+                    (actual["probable_alias"], actual["best_match_alias"], actual["best_match_score"]):
+                mismatches += 1
+                print("❌ Mismatch:", expected, actual)
+            if capped["probable_alias"] != expected["probable_alias"]:
+                capped_alias_mismatches += 1
+                print("❌ Capped probable_alias mismatch:", expected, capped)
+            elif (capped["best_match_alias"], capped["best_match_score"]) != \
+                    (expected["best_match_alias"], expected["best_match_score"]):
+                capped_best_differs += 1
+
+        for name, samples in timings.items():
+            samples.sort()
+            print(f"{name:>12}: p50 {statistics.median(samples) * 1000:.2f} ms, "
+                  f"p99 {samples[int(len(samples) * 0.99) - 1] * 1000:.2f} ms")
+        print(f"Parity: {lookups - mismatches}/{lookups} lookups identical")
+        print(f"Capped: {lookups - capped_alias_mismatches}/{lookups} probable_alias identical, "
+              f"{capped_best_differs} weaker best_match")
+        return 1 if mismatches or capped_alias_mismatches else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexed alias lookup vs the brute-force scan")
+    parser.add_argument("rows", nargs="?", type=int, default=20000)
+    parser.add_argument("lookups", nargs="?", type=int, default=200)
+    parser.add_argument("--fallback-candidates", type=int, default=5000,
+                        help="ALIAS_FALLBACK_CANDIDATES for the capped run")
+    args = parser.parse_args()
+    sys.exit(main(args.rows, args.lookups, args.fallback_candidates))
@@ -0,0 +1,111 @@
+# Batch alias re-scoring: NumPy block scorer (app.rescore) vs the per-row score_match loop.
+# The per-row scorer is O(rows²), so it runs on a sample of rows at each size and its full-run
+# time is extrapolated; the sampled rows double as a parity check. The smallest size also runs
+# the end-to-end DB job (load, score, bulk write, then a no-op second pass).
+# Usage: python -m benchmarks.alias_rescore [sizes...] [--devices N]
+
+import argparse
+import io
+import json
+import sys
+import time
+from contextlib import redirect_stdout
+
+from benchmarks.synthetic import reset_database, seed_visits, synthetic_visits
+
+
+def synthetic_rows(n: int, devices: int):
+    return [
+        (i + 1, row["fingerprint_id"], row["visitor_alias"], row["entropy_data"])
+        for i, row in enumerate(synthetic_visits(n, devices))
+    ]
+
+
+# Per-row reference: every earlier aliased row with another fingerprint, best score, oldest on ties
+def rowwise_best(rows, index: int):
+    from app.intel import score_match
+
+    log_id, fingerprint, _, entropy = rows[index]
+    best_alias, best_score = None, -1.0
+    for past_id, past_fp, past_alias, past_entropy in rows[:index]:
+        if past_entropy is None or not past_alias or past_fp is None or past_fp == fingerprint:
+            continue
+        score = score_match(entropy or {}, past_entropy)
+        if score > best_score:
+            best_alias, best_score = past_alias, score
+    return best_alias, (best_score if best_alias else 0.0)
+
+
+def bench_size(n: int, devices: int) -> dict:
+    from app.rescore import best_matches, encode_rows
+
+    rows = synthetic_rows(n, devices)
+
+    started = time.perf_counter()
+    encoded = encode_rows(rows)
+    encode_seconds = time.perf_counter() - started
+    best_row, best_score, stats = best_matches(encoded)
+    numpy_seconds = time.perf_counter() - started
+
+    sample = max(3, min(200, 2_000_000 // n))
+    step = max(1, n // sample)
+    picks = list(range(n - 1, -1, -step))[:sample]    # Latest rows: the most candidates to scan
+    mismatches = 0
+    started = time.perf_counter()
+    for i in picks:
+        expected = rowwise_best(rows, i)
+        actual_alias = rows[best_row[i]][2] if best_row[i] >= 0 else None
+        if (actual_alias, round(float(best_score[i]), 9)) != (expected[0], round(expected[1], 9)):
+            mismatches += 1
+    rowwise_seconds = time.perf_counter() - started
+    rowwise_per_row = rowwise_seconds / len(picks)
+
+    return {
+        "rows": n,
+        "devices": devices,
+        **stats,
+        "numpy_seconds": round(numpy_seconds, 3),
+        "numpy_encode_seconds": round(encode_seconds, 3),
+        "numpy_rows_per_sec": round(n / numpy_seconds),
+        "rowwise_sampled_rows": len(picks),
+        "rowwise_rows_per_sec": round(1 / rowwise_per_row, 1),
+        "rowwise_extrapolated_seconds": round(rowwise_per_row * n / 2, 1),   # Average row scans n/2 rows
+        "speedup": round(rowwise_per_row * n / 2 / numpy_seconds, 1),
+        "parity": f"{len(picks) - mismatches}/{len(picks)}",
+    }
+
+
+def bench_db(n: int, devices: int) -> dict:
+    from app.db import SessionLocal
+    from app.rescore import rescore_aliases
+
+    reset_database()
+    db = SessionLocal()
+    try:
+        seed_visits(db, n, devices)
+        with redirect_stdout(io.StringIO()):
+            first = rescore_aliases(db)
+            second = rescore_aliases(db, dry_run=True)
+        return {"mode": "db job", "first_pass": first, "second_pass_changed": second["changed"]}
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NumPy batch alias re-scoring vs the per-row score_match loop")
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--devices", type=int, default=2000)
+    args = parser.parse_args(argv)
+    sizes, devices = args.sizes, args.devices
+
+    results = [bench_db(min(sizes), devices)]
+    for n in sizes:
+        results.append(bench_size(n, devices))
+        print(json.dumps(results[-1]), file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    failed = [r for r in results if "parity" in r and r["parity"].split("/")[0] != r["parity"].split("/")[1]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,109 @@
+# Single-event /log-event vs batched /log-events (stubbed IP enrichment, direct inserts — no write-behind).
+# The same interaction stream is posted one event per request and then in batches of `batch` events
+# sharing one envelope, as JSON, gzip-compressed JSON (as sendBeacon would send it: text/plain, no
+# Content-Encoding) and msgpack. Reports events/sec, request bytes per event and rows written.
+# Usage: python -m benchmarks.event_batches [events] [batch] [enrich_ms]
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import random
+import time
+
+from benchmarks.synthetic import make_entropy, reset_database
+
+ENVELOPE_FIELDS = ("session_id", "fingerprint_id", "page", "referrer", "device", "entropy_data")
+
+
+def event_stream(total: int):
+    rng = random.Random(5)
+    entropy = make_entropy(rng, 1)
+    return [{
+        "session_id": "s-1", "fingerprint_id": "fp-1", "page": "/blog", "referrer": "Direct", "device": "desktop",
+        "entropy_data": entropy, "event_type": rng.choice(["click", "scroll", "hover", "copy"]),
+        "event_data": f"#el-{rng.randrange(50)}", "client_timestamp": "2026-10-18T10:00:00Z",
+    } for _ in range(total)]
+
+
+def batch_body(events):
+    envelope = {key: events[0][key] for key in ENVELOPE_FIELDS}
+    envelope["events"] = [{k: v for k, v in e.items() if k not in ENVELOPE_FIELDS} for e in events]
+    return envelope
+
+
+def requests_for(mode: str, stream, batch: int):
+    if mode == "single":
+        return [("/log-event", json.dumps(e).encode(), {"content-type": "application/json"}) for e in stream]
+    chunks = [batch_body(stream[i:i + batch]) for i in range(0, len(stream), batch)]
+    if mode == "batch-json":
+        return [("/log-events", json.dumps(c).encode(), {"content-type": "application/json"}) for c in chunks]
+    if mode == "batch-gzip":
+        return [("/log-events", gzip.compress(json.dumps(c).encode()), {"content-type": "text/plain"}) for c in chunks]
+    import msgpack
+    return [("/log-events", msgpack.packb(c), {"content-type": "application/msgpack"}) for c in chunks]
+
+
+async def post_all(requests):
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    errors = []
+    transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        for path, body, headers in requests:
+            response = await client.post(path, content=body, headers=headers)
+            if response.json().get("status") == "error":
+                errors.append(response.json())
+        elapsed = time.perf_counter() - started
+    await close_async_db()
+    return elapsed, errors
+
+
+def run(mode: str, stream, batch: int, enrich_ms: float) -> dict:
+    import app.main as main
+    from app.db import SessionLocal
+    from app.models import VisitorEventLog
+
+    async def fake_enrich(ip):
+        await asyncio.sleep(enrich_ms / 1000)
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    main.event_buffer.enabled = False
+    reset_database()
+    requests = requests_for(mode, stream, batch)
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, errors = asyncio.run(post_all(requests))
+
+    db = SessionLocal()
+    rows = db.query(VisitorEventLog).count()
+    db.close()
+    return {
+        "mode": mode,
+        "events": len(stream),
+        "requests": len(requests),
+        "events_per_sec": round(len(stream) / elapsed, 1),
+        "bytes_per_event": round(sum(len(body) for _, body, _ in requests) / len(stream), 1),
+        "rows_written": rows,
+        "errors": len(errors),
+    }
+
+
+def main(total: int = 2000, batch: int = 50, enrich_ms: float = 5):
+    stream = event_stream(total)
+    results = [run(mode, stream, batch, enrich_ms) for mode in ("single", "batch-json", "batch-gzip", "batch-msgpack")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single-event /log-event vs batched /log-events")
+    parser.add_argument("events", nargs="?", type=int, default=2000)
+    parser.add_argument("batch", nargs="?", type=int, default=50)
+    parser.add_argument("enrich_ms", nargs="?", type=float, default=5)
+    args = parser.parse_args()
+    main(args.events, args.batch, args.enrich_ms)
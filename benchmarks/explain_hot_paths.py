@@ -0,0 +1,117 @@
+# Print query plans for the ingest hot-path queries and flag full-table scans.
+# EXPLAIN ANALYZE on PostgreSQL, EXPLAIN QUERY PLAN on the SQLite stand-in.
+# Usage: python -m benchmarks.explain_hot_paths [--seed ROWS]
+#   --seed drops and re-seeds the target database with synthetic visits (never point it at production)
+
+import argparse
+import sys
+
+from sqlalchemy import select, func, text
+
+from benchmarks.synthetic import reset_database, seed_visits
+
+# Tables where a sequential scan on the hot path counts as a regression
+HOT_TABLES = ["visitor_logs", "visitor_event_logs", "visitor_aliases", "session_labels",
+              "entropy_signatures", "entropy_signature_terms"]
+
+
+def hot_queries(sample):
+    from app.models import VisitorLog, VisitorAliasMap, SessionLabelMap, EntropySignature, EntropySignatureTerm
+
+    return {
+        "log_exit: latest visit for session + page": (
+            select(VisitorLog)
+            .where(VisitorLog.session_id == sample.session_id, VisitorLog.page == sample.page)
+            .order_by(VisitorLog.timestamp.desc()).limit(1)
+        ),
+        "log_visit: session entry page": (
+            select(VisitorLog.page)
+            .where(VisitorLog.session_id == sample.session_id)
+            .order_by(VisitorLog.timestamp.asc()).limit(1)
+        ),
+        "log_visit: session hit count": (
+            select(func.count()).select_from(VisitorLog).where(VisitorLog.session_id == sample.session_id)
+        ),
+        "labels: first alias for fingerprint": (
+            select(VisitorLog.visitor_alias)
+            .where(VisitorLog.fingerprint_id == sample.fingerprint_id, VisitorLog.visitor_alias.isnot(None))
+            .order_by(VisitorLog.id.asc()).limit(1)
+        ),
+        "labels: alias mapping lookup": (
+            select(VisitorAliasMap.visitor_alias).where(VisitorAliasMap.fingerprint_id == sample.fingerprint_id)
+        ),
+        "labels: session mapping lookup": (
+            select(SessionLabelMap.session_label).where(SessionLabelMap.session_id == sample.session_id)
+        ),
+        "intel: signature term shortlist": (
+            select(EntropySignatureTerm.signature_id).where(EntropySignatureTerm.term.in_(["0" * 24, "f" * 24]))
+        ),
+        "intel: oldest signature fallback": (
+            select(EntropySignature.visitor_alias)
+            .where(EntropySignature.fingerprint_id != sample.fingerprint_id)
+            .order_by(EntropySignature.first_log_id.asc()).limit(1)
+        ),
+    }
+
+
+def full_scans(dialect: str, plan: str):
+    flagged = []
+    for line in plan.splitlines():
+        stripped = line.strip().lstrip("-> ").strip()
+        for table in HOT_TABLES:
+            if dialect == "postgresql" and stripped.startswith(f"Seq Scan on {table} "):
+                flagged.append(table)
+            if dialect == "sqlite" and (stripped == f"SCAN {table}" or stripped.startswith(f"SCAN {table} ")) \
+                    and "USING" not in stripped:
+                flagged.append(table)
+    return flagged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=0, help="drop + seed this many synthetic visits first")
+    args = parser.parse_args(argv)
+
+    from app.db import SessionLocal, engine
+    from app.intel import rebuild_signature_index
+    from app.labels import backfill_label_mappings
+    from app.models import VisitorLog
+
+    if args.seed:
+        reset_database()
+        db = SessionLocal()
+        seed_visits(db, args.seed)
+        rebuild_signature_index(db)
+        backfill_label_mappings(db)
+        db.close()
+
+    dialect = engine.dialect.name
+    prefix = "EXPLAIN (ANALYZE, BUFFERS)" if dialect == "postgresql" else "EXPLAIN QUERY PLAN"
+    regressions = []
+
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+        sample = conn.execute(select(VisitorLog).order_by(VisitorLog.id.desc()).limit(1)).first()
+        if sample is None:
+            print("No visitor_logs rows to plan against; run with --seed N")
+            return 1
+
+        for name, query in hot_queries(sample).items():
+            sql = str(query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            rows = conn.execute(text(f"{prefix} {sql}")).fetchall()
+            plan = "\n".join(str(row[-1]) for row in rows)
+            scans = full_scans(dialect, plan)
+            print(f"=== {name}{'  ⚠️ FULL SCAN: ' + ', '.join(scans) if scans else ''}")
+            print(plan)
+            print()
+            regressions.extend((name, table) for table in scans)
+
+    if regressions:
+        print(f"❌ {len(regressions)} hot-path queries fall back to full table scans")
+        return 1
+    print("✅ All hot-path queries use indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
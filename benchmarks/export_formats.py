@@ -0,0 +1,76 @@
+# JSON/NDJSON scraping vs columnar export of visitor_logs: wall time and output size.
+# Usage: python -m benchmarks.export_formats [rows]
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import reset_database, seed_visits
+
+
+def main(rows: int = 50000):
+    from app.db import SessionLocal
+    from app.dashboard import PageParams, build_query, serialize_row, stream_rows
+    from app.export import export_table, export_to_file
+    from app.models import VisitorLog
+
+    reset_database()
+    db = SessionLocal()
+    out_dir = tempfile.mkdtemp(prefix="export-bench-")
+    results = []
+    try:
+        seed_visits(db, rows)
+
+        # Paged JSON, the way analysts scrape /dashboard/visits today
+        started = time.perf_counter()
+        size, after_id, fetched = 0, None, 0
+        while True:
+            params = PageParams(after_id=after_id, limit=1000, fields=None, since=None, until=None,
+                                order="asc", format="json")
+            page = [serialize_row(r) for r in db.execute(build_query(VisitorLog, params).limit(1000)).mappings()]
+            if not page:
+                break
+            size += len(json.dumps(page))
+            fetched += len(page)
+            after_id = page[-1]["id"]
+        results.append({"path": "json pages", "rows": fetched, "seconds": round(time.perf_counter() - started, 3),
+                        "bytes": size})
+
+        params = PageParams(after_id=None, limit=None, fields=None, since=None, until=None,
+                            order="asc", format="ndjson")
+        started = time.perf_counter()
+        size = sum(len(chunk) for chunk in stream_rows(build_query(VisitorLog, params)))
+        results.append({"path": "ndjson stream", "rows": rows, "seconds": round(time.perf_counter() - started, 3),
+                        "bytes": size})
+
+        for fmt in ("parquet", "arrow"):
+            started = time.perf_counter()
+            stats = export_table(db, "visits", out_dir, fmt)
+            results.append({"path": f"{fmt} partitioned", "rows": stats["rows"],
+                            "seconds": round(time.perf_counter() - started, 3), "bytes": stats["bytes"]})
+
+            started = time.perf_counter()
+            again = export_table(db, "visits", out_dir, fmt)
+            results.append({"path": f"{fmt} incremental (no new rows)", "rows": again["rows"],
+                            "seconds": round(time.perf_counter() - started, 3), "bytes": again["bytes"]})
+
+        path = os.path.join(out_dir, "single.parquet")
+        started = time.perf_counter()
+        exported = export_to_file(db, "visits", path)
+        results.append({"path": "parquet download", "rows": exported,
+                        "seconds": round(time.perf_counter() - started, 3), "bytes": os.path.getsize(path)})
+    finally:
+        db.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON/NDJSON scraping vs columnar export of visitor_logs")
+    parser.add_argument("rows", nargs="?", type=int, default=50000)
+    args = parser.parse_args()
+    main(args.rows)
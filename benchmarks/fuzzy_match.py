@@ -0,0 +1,254 @@
+# Fuzzy entropy matching: MinHash/LSH shortlist (app.fuzzy) vs brute-force SequenceMatcher.
+#
+# 1. Field level — a corpus of realistic user agents / GPU renderers; queries are version-bumped
+#    copies of corpus values (the re-identification case) plus unrelated values. Reports recall
+#    of the brute-force near set (ratio >= threshold), recall of the value each query was bumped
+#    from, and per-query latency, for a few stop-band / shortlist settings.
+# 2. End to end — get_probable_alias vs get_probable_alias_bruteforce with ENTROPY_FUZZY on, and the
+#    batch re-scorer (app.rescore) vs get_probable_alias on the same lookups.
+#
+# Usage: python -m benchmarks.fuzzy_match [corpus] [queries] [rows] [lookups]
+
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import time
+from contextlib import redirect_stdout
+
+os.environ.setdefault("ENTROPY_FUZZY", "true")   # Before app.fuzzy is imported
+
+from benchmarks.synthetic import make_entropy, reset_database, with_profiles
+
+WINDOWS = ["Windows NT 10.0; Win64; x64", "Windows NT 6.1; Win64; x64"]
+MACS = ["Macintosh; Intel Mac OS X 10_15_7", "Macintosh; Intel Mac OS X 13_4_1"]
+ANDROIDS = ["Pixel 8", "SM-S918B", "SM-A546E", "M2101K6G", "CPH2451", "moto g54 5G"]
+NVIDIA = ["RTX 3060", "RTX 3070 Ti", "RTX 4070", "GTX 1650", "GTX 1660 SUPER", "RTX 4090", "RTX 2060"]
+INTEL = ["UHD Graphics 620", "UHD Graphics 630", "Iris(R) Xe Graphics", "HD Graphics 520"]
+
+
+def chrome_version(rng):
+    return f"{rng.randint(110, 131)}.0.{rng.randint(5000, 6800)}.{rng.randint(0, 220)}"
+
+def user_agent(rng):
+    kind = rng.random()
+    if kind < 0.4:
+        return (f"Mozilla/5.0 ({rng.choice(WINDOWS)}) AppleWebKit/537.36 (KHTML, like Gecko) "
+                f"Chrome/{chrome_version(rng)} Safari/537.36")
+    if kind < 0.55:
+        v = chrome_version(rng)
+        return (f"Mozilla/5.0 ({rng.choice(WINDOWS)}) AppleWebKit/537.36 (KHTML, like Gecko) "
+                f"Chrome/{v} Safari/537.36 Edg/{v.rsplit('.', 1)[0]}.{rng.randint(0, 99)}")
+    if kind < 0.7:
+        major = rng.randint(110, 132)
+        return f"Mozilla/5.0 ({rng.choice(WINDOWS + MACS)}; rv:{major}.0) Gecko/20100101 Firefox/{major}.0"
+    if kind < 0.85:
+        a, b = rng.randint(15, 18), rng.randint(0, 7)
+        return (f"Mozilla/5.0 (iPhone; CPU iPhone OS {a}_{b} like Mac OS X) AppleWebKit/605.1.15 "
+                f"(KHTML, like Gecko) Version/{a}.{b} Mobile/15E148 Safari/604.1")
+    return (f"Mozilla/5.0 (Linux; Android {rng.randint(11, 14)}; {rng.choice(ANDROIDS)}) AppleWebKit/537.36 "
+            f"(KHTML, like Gecko) Chrome/{chrome_version(rng)} Mobile Safari/537.36")
+
+def gpu_renderer(rng):
+    kind = rng.random()
+    driver = f"{rng.randint(27, 31)}.{rng.randint(0, 21)}.{rng.randint(10, 15)}.{rng.randint(1000, 9999)}"
+    if kind < 0.45:
+        return f"ANGLE (NVIDIA, NVIDIA GeForce {rng.choice(NVIDIA)} Direct3D11 vs_5_0 ps_5_0, D3D11-{driver})"
+    if kind < 0.8:
+        return f"ANGLE (Intel, Intel(R) {rng.choice(INTEL)} Direct3D11 vs_5_0 ps_5_0, D3D11-{driver})"
+    if kind < 0.9:
+        return f"ANGLE (Apple, ANGLE Metal Renderer: Apple M{rng.randint(1, 3)}{rng.choice(['', ' Pro', ' Max'])}, Unspecified Version)"
+    return f"Adreno (TM) {rng.choice([610, 619, 642, 650, 660, 730, 740])}"
+
+# Browser update / driver update: bump the last number in the string
+def bump(rng, value):
+    digits = [i for i, ch in enumerate(value) if ch.isdigit()]
+    if not digits:
+        return value + " 2"
+    end = digits[-1] + 1
+    start = end
+    while start > 0 and value[start - 1].isdigit():
+        start -= 1
+    return value[:start] + str(int(value[start:end]) + rng.randint(1, 30)) + value[end:]
+
+
+# In-memory mirror of intel._fuzzy_candidates for one field (same bands, stop-bands, ranking, cap)
+class MemoryIndex:
+    def __init__(self, key, values):
+        from app.fuzzy import band_terms
+
+        self.key = key
+        self.values = values
+        self.buckets = {}
+        for i, value in enumerate(values):
+            for band in band_terms(key, value):
+                self.buckets.setdefault(band, []).append(i)
+
+    def near(self, query, bucket_max, limit):
+        from app.fuzzy import FUZZY_THRESHOLD, band_terms, rank_near
+        from app.intel import fuzzy_match
+
+        shared = {}
+        for band in band_terms(self.key, query):
+            bucket = self.buckets.get(band, ())
+            if len(bucket) > bucket_max:
+                continue
+            for i in bucket:
+                if self.values[i] != query:
+                    shared[self.values[i]] = shared.get(self.values[i], 0) + 1
+        return {text for text, _ in rank_near(shared, limit) if fuzzy_match(query, text) >= FUZZY_THRESHOLD}
+
+
+def brute_force_near(values, query):
+    from app.fuzzy import FUZZY_THRESHOLD
+    from app.intel import fuzzy_match
+
+    return {v for v in values if v != query and fuzzy_match(query, v) >= FUZZY_THRESHOLD}
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+def field_level(corpus: int, queries: int):
+    from app.fuzzy import FUZZY_BUCKET_MAX, FUZZY_SHORTLIST_MAX
+
+    rng = random.Random(11)
+    results = []
+    configs = [("no stop-bands, no cap", 10 ** 9, 10 ** 9), ("defaults", FUZZY_BUCKET_MAX, FUZZY_SHORTLIST_MAX)]
+    for key, make in (("user_agent", user_agent), ("gpu_renderer", gpu_renderer)):
+        values = sorted({make(rng) for _ in range(corpus)})
+        started = time.perf_counter()
+        index = MemoryIndex(key, values)
+        build_seconds = time.perf_counter() - started
+
+        probes = []
+        for _ in range(queries):
+            if rng.random() < 0.7:
+                origin = rng.choice(values)
+                probes.append((bump(rng, origin), origin))
+            else:
+                probes.append((make(rng), None))
+
+        brute, brute_times = [], []
+        for query, _ in probes:
+            started = time.perf_counter()
+            brute.append(brute_force_near(values, query))
+            brute_times.append(time.perf_counter() - started)
+        results.append({
+            "field": key, "mode": "brute-force SequenceMatcher", "values": len(values),
+            "avg_near": round(statistics.mean(len(b) for b in brute), 1),
+            "p50_ms": round(percentile(brute_times, 0.5), 2), "p99_ms": round(percentile(brute_times, 0.99), 2),
+        })
+
+        for name, bucket_max, limit in configs:
+            found, expected, origins, origin_hits, times = 0, 0, 0, 0, []
+            for (query, origin), truth in zip(probes, brute):
+                started = time.perf_counter()
+                near = index.near(query, bucket_max, limit)
+                times.append(time.perf_counter() - started)
+                found += len(near & truth)
+                expected += len(truth)
+                if origin is not None and origin in truth:
+                    origins += 1
+                    origin_hits += origin in near
+            results.append({
+                "field": key, "mode": f"LSH ({name})", "bucket_max": bucket_max, "shortlist": limit,
+                "build_seconds": round(build_seconds, 2),
+                "near_set_recall": round(found / expected, 4) if expected else None,
+                "bumped_origin_recall": round(origin_hits / origins, 4) if origins else None,
+                "p50_ms": round(percentile(times, 0.5), 2), "p99_ms": round(percentile(times, 0.99), 2),
+            })
+    return results
+
+
+def end_to_end(rows: int, lookups: int):
+    from app.db import SessionLocal
+    from app.models import VisitorLog, EntropyProfile
+    from app.intel import get_probable_alias, get_probable_alias_bruteforce, rebuild_signature_index
+    from app.rescore import best_matches, encode_rows
+
+    rng = random.Random(5)
+    devices = max(1, rows // 5)
+    profiles = {}
+
+    def profile(device):
+        if device not in profiles:
+            local = random.Random(device)
+            profiles[device] = {**make_entropy(rng, device), "userAgent": user_agent(local),
+                                "webglRenderer": gpu_renderer(local)}
+        return profiles[device]
+
+    reset_database()
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(VisitorLog, with_profiles(db, [
+            {"fingerprint_id": f"fp-{d}", "visitor_alias": f"Visitor_{d + 1:04d}", "entropy_data": profile(d)}
+            for d in (rng.randrange(devices) for _ in range(rows))
+        ]))
+        db.commit()
+        with redirect_stdout(io.StringIO()):
+            rebuild_signature_index(db)
+
+        timings = {"bruteforce": [], "indexed": []}
+        identical = 0
+        probes = []
+        for _ in range(lookups):
+            entropy = dict(profile(rng.randrange(devices)))
+            entropy["userAgent"] = bump(rng, entropy["userAgent"])     # Browser updated since last visit
+            if rng.random() < 0.5:
+                entropy["webglRenderer"] = bump(rng, entropy["webglRenderer"])
+            fingerprint = f"fp-new-{rng.random()}"
+
+            with redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                expected = get_probable_alias_bruteforce(db, entropy, fingerprint)
+                timings["bruteforce"].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                actual = get_probable_alias(db, entropy, fingerprint)
+                timings["indexed"].append(time.perf_counter() - started)
+            identical += (expected["best_match_alias"], expected["best_match_score"]) == \
+                         (actual["best_match_alias"], actual["best_match_score"])
+            probes.append((fingerprint, entropy, actual))
+
+        # Probes are stored without an alias, so they never become candidates for each other
+        db.bulk_insert_mappings(VisitorLog, with_profiles(db, [{"fingerprint_id": fp, "entropy_data": e} for fp, e, _ in probes]))
+        db.commit()
+        stored = db.query(VisitorLog.id, VisitorLog.fingerprint_id, VisitorLog.visitor_alias, EntropyProfile.entropy_data) \
+            .outerjoin(EntropyProfile, EntropyProfile.id == VisitorLog.entropy_profile_id) \
+            .order_by(VisitorLog.id.asc()).all()
+        encoded = encode_rows(stored)
+        best_row, best_score, _ = best_matches(encoded)
+        batch_identical = sum(
+            (encoded["aliases"][best_row[i]] if best_row[i] >= 0 else None, float(best_score[i])) ==
+            (actual["best_match_alias"], actual["best_match_score"])
+            for i, (_, _, actual) in zip(range(len(stored) - len(probes), len(stored)), probes)
+        )
+
+        return [{
+            "mode": f"get_probable_alias ({name})", "rows": rows,
+            "p50_ms": round(percentile(samples, 0.5), 2), "p99_ms": round(percentile(samples, 0.99), 2),
+        } for name, samples in timings.items()] + [{
+            "indexed_identical_to_bruteforce": f"{identical}/{lookups}",
+            "rescore_identical_to_indexed": f"{batch_identical}/{lookups}",
+        }]
+    finally:
+        db.close()
+
+
+def main(corpus: int = 5000, queries: int = 200, rows: int = 5000, lookups: int = 100):
+    results = field_level(corpus, queries) + end_to_end(rows, lookups)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MinHash/LSH fuzzy matching vs brute-force SequenceMatcher")
+    parser.add_argument("corpus", nargs="?", type=int, default=5000)
+    parser.add_argument("queries", nargs="?", type=int, default=200)
+    parser.add_argument("rows", nargs="?", type=int, default=5000)
+    parser.add_argument("lookups", nargs="?", type=int, default=100)
+    args = parser.parse_args()
+    main(args.corpus, args.queries, args.rows, args.lookups)
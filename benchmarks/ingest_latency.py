@@ -0,0 +1,98 @@
+# Concurrent /log-visit + /log-event latency with a slow (stubbed) IP enrichment upstream.
+# "blocking" mimics the previous requests.get on the event loop; "async" is the current path.
+# Usage: python -m benchmarks.ingest_latency [requests] [concurrency] [enrich_ms]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import time
+
+from benchmarks.synthetic import make_entropy, reset_database
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run(mode: str, total: int, concurrency: int, enrich_ms: float):
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    async def fake_enrich(ip):
+        if mode == "blocking":
+            time.sleep(enrich_ms / 1000)
+        else:
+            await asyncio.sleep(enrich_ms / 1000)
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    reset_database()
+
+    rng = random.Random(1)
+    latencies = []
+    errors = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(client):
+        while not queue.empty():
+            i = queue.get_nowait()
+            device = rng.randrange(max(1, total // 10))
+            if i % 3 == 0:
+                path, payload = "/log-visit", {
+                    "page": "/", "referrer": "Direct", "device": "desktop",
+                    "session_id": f"s-{device}", "fingerprint_id": f"fp-{device}",
+                    "entropy_data": make_entropy(rng, device),
+                }
+            else:
+                path, payload = "/log-event", {
+                    "session_id": f"s-{device}", "fingerprint_id": f"fp-{device}", "event_type": "click",
+                    "page": "/", "referrer": "Direct", "device": "desktop",
+                    "entropy_data": make_entropy(rng, device),
+                }
+            started = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            if response.json().get("status") == "error":
+                errors.append(response.json())
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    await close_async_db()  # Pool connections are bound to this run's event loop
+
+    return {
+        "mode": mode,
+        "requests": total,
+        "concurrency": concurrency,
+        "enrich_ms": enrich_ms,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "errors": len(errors),
+    }
+
+
+def main(total: int = 300, concurrency: int = 20, enrich_ms: float = 50):
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence the per-request prints
+        results = [asyncio.run(run(mode, total, concurrency, enrich_ms)) for mode in ("blocking", "async")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent /log-visit + /log-event latency with slow IP enrichment")
+    parser.add_argument("requests", nargs="?", type=int, default=300)
+    parser.add_argument("concurrency", nargs="?", type=int, default=20)
+    parser.add_argument("enrich_ms", nargs="?", type=float, default=50)
+    args = parser.parse_args()
+    main(args.requests, args.concurrency, args.enrich_ms)
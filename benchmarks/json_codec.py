@@ -0,0 +1,124 @@
+# JSON codec micro-benchmark (app.codec), both directions, per available codec (std / orjson / msgspec).
+# Decode: /log-visit, /log-event and /log-exit bodies (bytes -> validated model) vs the previous
+#   request.json() + Model(**body). Visit/event bodies carry a large entropy_data payload.
+# Encode: a page of /dashboard/visits rows (entropy profile fields rejoined) to a JSON response body and
+#   to NDJSON, vs the previous serialize_row() + JSONResponse. Outputs are checked to decode identically.
+# Usage: python -m benchmarks.json_codec [rows] [iterations]
+
+import argparse
+import importlib
+import json
+import os
+import random
+import time
+
+from benchmarks.synthetic import make_entropy, reset_database, seed_visits
+
+CODECS = ["std", "orjson", "msgspec"]
+
+
+def bodies():
+    rng = random.Random(11)
+    entropy = make_entropy(rng, 7)
+    entropy.update({f"plugin{i}": f"Plugin {i} " + "x" * rng.randint(20, 60) for i in range(40)})   # Heavy payload
+    visit = {"page": "/blog", "referrer": "https://google.com", "device": "desktop", "session_id": "s-1",
+             "fingerprint_id": "fp-1", "utm_source": "newsletter", "utm_campaign": "launch",
+             "entropy_data": entropy, "client_timestamp": "2026-10-18T10:00:00Z"}
+    event = {"session_id": "s-1", "fingerprint_id": "fp-1", "event_type": "click", "event_data": "#cta",
+             "page": "/blog", "referrer": "Direct", "device": "desktop", "entropy_data": entropy,
+             "client_timestamp": "2026-10-18T10:00:05Z"}
+    exit_ = {"session_id": "s-1", "page": "/blog", "exit_time": "2026-10-18T10:01:00Z"}
+    return {"VisitLog": json.dumps(visit).encode(), "EventLog": json.dumps(event).encode(),
+            "ExitLogRequest": json.dumps(exit_).encode()}
+
+
+def per_op_us(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+
+def load_codec(name):
+    os.environ["JSON_CODEC"] = name
+    import app.codec as codec
+    try:
+        return importlib.reload(codec)
+    except RuntimeError:
+        return None
+
+
+def dashboard_page(rows: int):
+    from app.db import SessionLocal
+    from app.dashboard import PageParams, build_query
+    from app.models import VisitorLog
+
+    db = SessionLocal()
+    try:
+        seed_visits(db, rows)
+        params = PageParams(after_id=None, limit=rows, fields=None, since=None, until=None, order="desc", format="json")
+        result = db.execute(build_query(VisitorLog, params).limit(rows))
+        keys = list(result.keys())
+        return keys, result.all()
+    finally:
+        db.close()
+
+
+def main(rows: int = 1000, iterations: int = 2000):
+    import app.main as main_module
+    from fastapi.responses import JSONResponse
+    from app.dashboard import serialize_row
+
+    reset_database()
+    keys, page = dashboard_page(rows)
+    payloads = bodies()
+    models = {name: getattr(main_module, name) for name in payloads}
+    page_iterations = max(5, iterations // 100)
+
+    def baseline_page():
+        return JSONResponse([serialize_row(dict(zip(keys, row))) for row in page]).body
+
+    results = {"decode": [], "encode": []}
+    for name, raw in payloads.items():
+        results["decode"].append({"model": name, "codec": "baseline (json.loads + Model(**body))", "bytes": len(raw),
+                                  "us_per_op": per_op_us(lambda: models[name](**json.loads(raw)), iterations)})
+    results["encode"].append({"output": f"json, {rows} rows", "codec": "baseline (serialize_row + JSONResponse)",
+                              "us_per_op": per_op_us(baseline_page, page_iterations), "identical": True})
+    expected = json.loads(baseline_page())
+
+    for name in CODECS:
+        codec = load_codec(name)
+        if codec is None:
+            results["decode"].append({"codec": name, "skipped": "not installed"})
+            continue
+        for model_name, raw in payloads.items():
+            model = models[model_name]
+            results["decode"].append({
+                "model": model_name, "codec": name, "bytes": len(raw),
+                "us_per_op": per_op_us(lambda: codec.decode_model(raw, model), iterations),
+                "identical": codec.decode_model(raw, model) == model(**json.loads(raw)),
+            })
+
+        def codec_page():
+            return codec.CodecJSONResponse([dict(zip(keys, row)) for row in page]).body
+
+        def codec_ndjson():
+            return b"".join(codec.dumps_line(dict(zip(keys, row))) for row in page)
+
+        results["encode"].append({"output": f"json, {rows} rows", "codec": name,
+                                  "us_per_op": per_op_us(codec_page, page_iterations),
+                                  "identical": json.loads(codec_page()) == expected})
+        results["encode"].append({"output": f"ndjson, {rows} rows", "codec": name,
+                                  "us_per_op": per_op_us(codec_ndjson, page_iterations),
+                                  "identical": [json.loads(line) for line in codec_ndjson().splitlines()] == expected})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON codec decode / encode micro-benchmark")
+    parser.add_argument("rows", nargs="?", type=int, default=1000)
+    parser.add_argument("iterations", nargs="?", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.rows, args.iterations)
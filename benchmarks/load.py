@@ -0,0 +1,295 @@
+# Load-generation suite for the ingest and dashboard routes, with results as JSON for run-to-run comparison.
+# Seeds `scale` visits (plus events, entropy profiles, derived rows, rollups, unique sketches, label
+# mappings and the signature index) into DATABASE_URL (a throwaway SQLite file by default; point it
+# at a local Postgres for real numbers), then drives a fixed, seeded request mix of /log-visit, /log-event, /log-exit and
+# /dashboard/* at fixed concurrency. IP enrichment is a local fake with `--enrich-ms` latency.
+# Reports per-route and overall throughput, latency percentiles, SQL statements per request and
+# process memory. `--compare old.json` prints the change against an earlier run.
+#
+# Usage: python -m benchmarks.load [--scale 10000] [--requests 2000] [--concurrency 16]
+#            [--mix visit=30,event=40,exit=10,dashboard=20] [--enrich-ms 5] [--seed 1]
+#            [--reuse] [--out results.json] [--compare baseline.json]
+
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import io
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import (
+    PAGES, REFERRERS, make_entropy, reset_database, seed_visits, seed_events, seed_derived,
+)
+
+DEFAULT_MIX = "visit=30,event=40,exit=10,dashboard=20"
+EXIT_TARGETS = 2000   # Seeded (session, page) pairs /log-exit picks from
+
+# Per-request SQL statement counter: the worker sets a fresh box before each request; the app's
+# threads / tasks inherit the context, so every statement the request runs lands in it
+_statements = contextvars.ContextVar("bench_statements", default=None)
+
+
+def _count_statement(*args):
+    box = _statements.get()
+    if box is not None:
+        box[0] += 1
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+# Current and peak resident set size, both in MiB
+def rss_mb() -> dict:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # KiB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        current = None
+    return {"rss_mb": round(current, 1) if current is not None else None, "peak_rss_mb": round(peak, 1)}
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("visit", "event", "exit", "dashboard"):
+            raise SystemExit(f"Unknown mix entry: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ✅ Seeding
+def seed(scale: int) -> dict:
+    from app.db import SessionLocal
+    from app.intel import rebuild_signature_index
+    from app.labels import backfill_label_mappings, label_cache
+    from app.models import EntropyProfile, VisitorLog
+    from app.rollups import rebuild_rollups
+    from app.uniques import rebuild_uniques
+
+    started = time.perf_counter()
+    reset_database()
+    label_cache.clear()
+    db = SessionLocal()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_visits(db, scale)
+            seed_events(db, scale)
+            seed_derived(db)
+            rebuild_rollups(db)
+            rebuild_uniques(db)
+            rebuild_signature_index(db)
+            backfill_label_mappings(db)
+        counts = {
+            "visits": db.query(VisitorLog).count(),
+            "sessions": db.query(VisitorLog.session_id).distinct().count(),
+            "entropy_profiles": db.query(EntropyProfile).count(),
+            "events": scale,
+        }
+    finally:
+        db.close()
+    return {**counts, "seconds": round(time.perf_counter() - started, 1)}
+
+
+def exit_targets(rng: random.Random) -> list:
+    from app.db import SessionLocal
+    from app.models import VisitorLog
+
+    db = SessionLocal()
+    try:
+        top = db.query(VisitorLog.id).order_by(VisitorLog.id.desc()).limit(1).scalar() or 0
+        ids = rng.sample(range(1, top + 1), min(EXIT_TARGETS, top))
+        return [tuple(r) for r in db.query(VisitorLog.session_id, VisitorLog.page).filter(VisitorLog.id.in_(ids))]
+    finally:
+        db.close()
+
+
+# ✅ Request plan (deterministic for a given seed / scale / mix)
+def request_plan(total: int, mix: dict, scale: int, seed: int) -> list:
+    rng = random.Random(seed)
+    devices = max(1, scale // 5)
+    targets = exit_targets(rng) or [("s-0-0", "/")]
+    now = datetime.utcnow()
+    dashboards = [
+        "/dashboard/visits?limit=100",
+        "/dashboard/events?limit=100",
+        "/dashboard/derived?limit=100",
+        "/dashboard/visits?limit=100&fields=id,page,country,visitor_alias&order=asc",
+        f"/dashboard/stats/timeseries?granularity=day&since={(now - timedelta(days=30)):%Y-%m-%d}",
+        "/dashboard/stats/breakdown?group_by=country,traffic_type",
+        f"/dashboard/uniques?since={(now - timedelta(days=7)):%Y-%m-%d}&group_by=country",
+    ]
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=total)
+    plan = []
+    for kind in kinds:
+        # Mostly returning devices from the seeded population, some brand-new ones
+        device = rng.randrange(devices) if rng.random() < 0.8 else devices + rng.randrange(devices)
+        ts = (now - timedelta(seconds=rng.randrange(600))).isoformat() + "Z"
+        if kind == "visit":
+            plan.append(("/log-visit", "POST", "/log-visit", {
+                "page": rng.choice(PAGES), "referrer": rng.choice(REFERRERS), "device": "desktop",
+                "session_id": f"load-{device}-{rng.randrange(3)}", "fingerprint_id": f"fp-{device}",
+                "entropy_data": make_entropy(rng, device), "client_timestamp": ts,
+            }))
+        elif kind == "event":
+            plan.append(("/log-event", "POST", "/log-event", {
+                "session_id": f"load-{device}-{rng.randrange(3)}", "fingerprint_id": f"fp-{device}",
+                "event_type": rng.choice(["click", "scroll", "hover", "copy"]), "event_data": f"#el-{rng.randrange(50)}",
+                "page": rng.choice(PAGES), "referrer": rng.choice(REFERRERS), "device": "desktop",
+                "entropy_data": make_entropy(rng, device), "client_timestamp": ts,
+            }))
+        elif kind == "exit":
+            session_id, page = rng.choice(targets)
+            plan.append(("/log-exit", "POST", "/log-exit", {"session_id": session_id, "page": page, "exit_time": now.isoformat() + "Z"}))
+        else:
+            path = rng.choice(dashboards)
+            plan.append((path.split("?")[0], "GET", path, None))
+    return plan
+
+
+def failed(response) -> bool:
+    if response.status_code >= 400:
+        return True
+    if response.headers.get("content-type", "").startswith("application/json"):
+        body = response.json()
+        return isinstance(body, dict) and body.get("status") == "error"
+    return False
+
+
+async def drive(plan: list, concurrency: int, enrich_ms: float) -> tuple:
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    async def fake_enrich(ip):
+        await asyncio.sleep(enrich_ms / 1000)
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    samples = {}   # route -> [(seconds, statements, error)]
+    queue = asyncio.Queue()
+    for request in plan:
+        queue.put_nowait(request)
+
+    async def worker(client):
+        while not queue.empty():
+            route, method, path, payload = queue.get_nowait()
+            box = [0]
+            _statements.set(box)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=payload)
+            samples.setdefault(route, []).append((time.perf_counter() - started, box[0], failed(response)))
+
+    transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    await close_async_db()
+    return samples, elapsed
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = [s[0] for s in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s[2]),
+        "throughput_rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+        "queries_per_request": round(sum(s[1] for s in samples) / len(samples), 2),
+    }
+
+
+def run(args) -> dict:
+    from sqlalchemy import event
+    from app.db import engine, read_engine, async_engine, DATABASE_URL
+
+    for target in {engine, read_engine, async_engine.sync_engine}:
+        event.listen(target, "before_cursor_execute", _count_statement)
+
+    mix = parse_mix(args.mix)
+    memory = {"start": rss_mb()}
+    seeded = None if args.reuse else seed(args.scale)
+    memory["after_seed"] = rss_mb()
+    plan = request_plan(args.requests, mix, args.scale, args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        samples, elapsed = asyncio.run(drive(plan, args.concurrency, args.enrich_ms))
+    memory["after_run"] = rss_mb()
+
+    every = [s for route in samples.values() for s in route]
+    return {
+        "benchmark": "load",
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "database_url": engine.url.render_as_string(hide_password=True) if DATABASE_URL else None,
+        "config": {"scale": args.scale, "requests": args.requests, "concurrency": args.concurrency,
+                   "mix": mix, "enrich_ms": args.enrich_ms, "seed": args.seed, "reused_database": args.reuse},
+        "seed": seeded,
+        "overall": summarize(every, elapsed),
+        "routes": {route: summarize(route_samples, elapsed) for route, route_samples in sorted(samples.items())},
+        "memory": memory,
+    }
+
+
+# Relative change of the headline numbers against an earlier result file
+def compare(current: dict, baseline: dict) -> dict:
+    keys = ("throughput_rps", "p50_ms", "p99_ms", "queries_per_request")
+
+    def delta(new, old):
+        return {key: f"{old[key]} → {new[key]} ({(new[key] - old[key]) / old[key] * 100:+.1f}%)" if old.get(key) else None
+                for key in keys}
+
+    routes = {route: delta(stats, baseline["routes"][route])
+              for route, stats in current["routes"].items() if route in baseline.get("routes", {})}
+    return {"baseline_commit": baseline.get("git_commit"), "overall": delta(current["overall"], baseline["overall"]),
+            "routes": routes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive the ingest + dashboard routes and report JSON results")
+    parser.add_argument("--scale", type=int, default=10000, help="visits (and events) to seed, e.g. 10000 .. 10000000")
+    parser.add_argument("--requests", type=int, default=2000, help="requests in the load phase")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of visit / event / exit / dashboard")
+    parser.add_argument("--enrich-ms", type=float, default=5, help="latency of the fake IP enrichment")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the request plan")
+    parser.add_argument("--reuse", action="store_true", help="skip seeding; reuse the database of an earlier run")
+    parser.add_argument("--out", help="also write the results to this file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = compare(results, json.load(f))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,121 @@
+# Connection pool behaviour under a burst of concurrent requests, using app.db.make_engine.
+# Each worker checks out a connection, runs a query and holds it for `hold_ms` (a slow request).
+# The pool configurations differ in size / overflow / timeout; per-run stats come from app.db.pool_stats.
+# The last section closes every idle DBAPI connection behind the pool's back, the way a server drops
+# idle sessions, and shows what the next checkout sees with and without pre-ping.
+# Runs against DATABASE_URL (point it at PostgreSQL for real numbers).
+# Usage: python -m benchmarks.pool_burst [workers] [hold_ms]
+
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+
+from sqlalchemy import text
+
+import benchmarks.synthetic   # noqa: F401  (defaults DATABASE_URL to a throwaway SQLite file)
+
+CONFIGS = [
+    {"name": "size5-overflow0-timeout0.5", "pool_size": 5, "max_overflow": 0, "pool_timeout": 0.5},
+    {"name": "size5-overflow0-timeout30", "pool_size": 5, "max_overflow": 0, "pool_timeout": 30},
+    {"name": "size5-overflow15-timeout30", "pool_size": 5, "max_overflow": 15, "pool_timeout": 30},
+    {"name": "size20-overflow10-timeout30", "pool_size": 20, "max_overflow": 10, "pool_timeout": 30},
+]
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def burst(url: str, config: dict, workers: int, hold_ms: float) -> dict:
+    from app.db import make_engine, pool_stats
+
+    options = {k: v for k, v in config.items() if k != "name"}
+    engine = make_engine(url, name=config["name"], **options)
+    latencies, errors = [], []
+    peak = {"checked_out": 0}
+    gate = threading.Barrier(workers)
+
+    def worker():
+        gate.wait()   # Everyone arrives at once
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1")).scalar()
+                peak["checked_out"] = max(peak["checked_out"], engine.pool.checkedout())
+                time.sleep(hold_ms / 1000)
+            latencies.append(time.perf_counter() - started)
+        except Exception as ex:
+            errors.append(type(ex).__name__)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    stats = pool_stats[config["name"]].snapshot()
+    engine.dispose()
+    return {
+        **config,
+        "workers": workers,
+        "hold_ms": hold_ms,
+        "completed": len(latencies),
+        "errors": {name: errors.count(name) for name in sorted(set(errors))},
+        "elapsed_s": round(elapsed, 3),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "peak_checked_out": peak["checked_out"],
+        "connects": stats["connects"],
+        "avg_wait_ms": stats["avg_wait_ms"],
+        "max_wait_ms": stats["max_wait_ms"],
+        "timeouts": stats["timeouts"],
+    }
+
+
+# Idle connections die server-side; does the next request fail or transparently reconnect?
+def stale_connections(url: str, pre_ping: bool) -> dict:
+    from app.db import make_engine, pool_stats
+
+    name = f"stale-pre_ping={pre_ping}"
+    engine = make_engine(url, name=name, pool_size=3, max_overflow=0, pool_pre_ping=pre_ping)
+    conns = [engine.connect() for _ in range(3)]
+    for conn in conns:
+        conn.execute(text("SELECT 1"))
+    raw = [conn.connection.dbapi_connection for conn in conns]
+    for conn in conns:
+        conn.close()
+    for dbapi_connection in raw:
+        dbapi_connection.close()
+
+    failures = 0
+    for _ in range(3):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1")).scalar()
+        except Exception:
+            failures += 1
+    stats = pool_stats[name].snapshot()
+    engine.dispose()
+    return {"mode": name, "requests": 3, "failed": failures, "invalidated": stats["invalidated"],
+            "reconnects": stats["connects"] - 3}
+
+
+def main(workers: int = 60, hold_ms: float = 50):
+    url = os.environ["DATABASE_URL"]
+    results = [burst(url, config, workers, hold_ms) for config in CONFIGS]
+    results += [stale_connections(url, pre_ping) for pre_ping in (False, True)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connection pool behaviour under a burst of concurrent checkouts")
+    parser.add_argument("workers", nargs="?", type=int, default=60)
+    parser.add_argument("hold_ms", nargs="?", type=float, default=50)
+    args = parser.parse_args()
+    main(args.workers, args.hold_ms)
@@ -0,0 +1,122 @@
+# /log-visit + /log-exit with and without the per-session state cache (SESSION_STATE_BACKEND).
+# Each session views `pages` pages and sends an exit for every view; the same stream runs with the
+# cache off (every request reads the DB) and with the local backend. Reports SQL statements per
+# visit / exit, requests/sec, and whether visitor_logs (incl. time_on_page), visitor_derived_logs and
+# visit_rollups end up identical. IP enrichment is stubbed and the inline pipeline is used.
+# Usage: python -m benchmarks.session_state [sessions] [pages]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import make_entropy
+from benchmarks.visit_pipeline import reset, snapshot
+
+PAGES = ["/", "/about", "/blog", "/projects", "/contact"]
+
+
+def request_stream(sessions: int, pages: int):
+    rng = random.Random(21)
+    start = datetime(2026, 10, 18, 10, 0, 0)
+    devices = max(1, sessions // 3)
+    stream = []
+    for s in range(sessions):
+        device = rng.randrange(devices)
+        entropy = make_entropy(rng, device)
+        ts = start + timedelta(minutes=s)
+        for _ in range(pages):
+            page = rng.choice(PAGES)
+            stay = rng.randrange(2, 120)
+            stream.append(("/log-visit", {
+                "page": page, "referrer": rng.choice(["Direct", "https://google.com"]), "device": "desktop",
+                "session_id": f"s-{s}", "fingerprint_id": f"fp-{device}", "entropy_data": entropy,
+                "client_timestamp": ts.isoformat() + "Z",
+            }))
+            ts += timedelta(seconds=stay)
+            stream.append(("/log-exit", {"session_id": f"s-{s}", "page": page, "exit_time": ts.isoformat() + "Z"}))
+    return stream
+
+
+async def post_all(stream):
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    statements = {"/log-visit": 0, "/log-exit": 0}
+    errors = []
+    transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        for path, payload in stream:
+            before = statement_count[0]
+            response = await client.post(path, json=payload)
+            statements[path] += statement_count[0] - before
+            if response.json().get("status") not in ("success", "updated"):
+                errors.append(response.json())
+        elapsed = time.perf_counter() - started
+    await close_async_db()
+    return statements, errors, elapsed
+
+
+statement_count = [0]
+
+def count_statement(*args):
+    statement_count[0] += 1
+
+
+def run(backend: str, stream) -> dict:
+    import app.main as main
+    import app.session_state as session_state
+    from app.models import VisitorLog
+
+    async def fake_enrich(ip):
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    main.VISIT_PIPELINE = "inline"
+    session_state.session_store = session_state.make_store(backend)
+    reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        statements, errors, elapsed = asyncio.run(post_all(stream))
+
+    from app.db import SessionLocal
+    db = SessionLocal()
+    exits = sorted(tuple(r) for r in db.query(VisitorLog.id, VisitorLog.page_exit_time, VisitorLog.time_on_page))
+    db.close()
+    visits = sum(1 for path, _ in stream if path == "/log-visit")
+    return {
+        "backend": backend,
+        "requests": len(stream),
+        "requests_per_sec": round(len(stream) / elapsed, 1),
+        "statements_per_visit": round(statements["/log-visit"] / visits, 2),
+        "statements_per_exit": round(statements["/log-exit"] / (len(stream) - visits), 2),
+        "errors": len(errors),
+        "_snapshot": {**snapshot(), "exits": exits},
+    }
+
+
+def main(sessions: int = 300, pages: int = 4):
+    from sqlalchemy import event
+    from app.db import engine, async_engine
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", count_statement)
+    stream = request_stream(sessions, pages)
+    results = [run(backend, stream) for backend in ("off", "local")]
+    baseline = results[0].pop("_snapshot")
+    cached = results[1].pop("_snapshot")
+    results.append({f"{key}_identical": baseline[key] == cached[key] for key in baseline})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/log-visit + /log-exit with and without the session state cache")
+    parser.add_argument("sessions", nargs="?", type=int, default=300)
+    parser.add_argument("pages", nargs="?", type=int, default=4)
+    args = parser.parse_args()
+    main(args.sessions, args.pages)
@@ -0,0 +1,215 @@
+# Ingest with and without the local spool (INGEST_SPOOL) while the database is slow or down.
+# Each session posts its visits, one /log-events batch and its exits in order (sessions run concurrently).
+# Database trouble is injected in front of the app's AsyncSession: `--db-ms` extra latency on every call
+# (execute / commit / run_sync), or `--outage-s` seconds during which every call fails. The spool run
+# drains once the run is over and the database has recovered.
+# Reports ingest latency percentiles and errors per mode, replay rate, and whether every visit, event
+# and exit reached the database (no loss). IP enrichment is a local fake.
+# Usage: python -m benchmarks.spool [--sessions 200] [--pages 3] [--events 5] [--concurrency 16]
+#            [--db-ms 50] [--outage-s 2] [--enrich-ms 5]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import make_entropy
+from benchmarks.visit_pipeline import reset
+
+PAGES = ["/", "/about", "/blog", "/projects", "/contact"]
+fault = {"delay": 0.0, "down_until": 0.0}   # Injected database trouble
+
+
+def session_streams(sessions: int, pages: int, events: int) -> list:
+    rng = random.Random(5)
+    start = datetime(2026, 10, 18, 10, 0, 0)
+    devices = max(1, sessions // 3)
+    streams = []
+    for s in range(sessions):
+        device = rng.randrange(devices)
+        entropy = make_entropy(rng, device)
+        ts = start + timedelta(minutes=s)
+        stream, viewed = [], []
+        for _ in range(pages):
+            page = rng.choice(PAGES)
+            viewed.append(page)
+            stream.append(("/log-visit", {
+                "page": page, "referrer": rng.choice(["Direct", "https://google.com"]), "device": "desktop",
+                "session_id": f"s-{s}", "fingerprint_id": f"fp-{device}", "entropy_data": entropy,
+                "client_timestamp": ts.isoformat() + "Z",
+            }))
+            ts += timedelta(seconds=rng.randrange(2, 120))
+        stream.append(("/log-events", {
+            "session_id": f"s-{s}", "fingerprint_id": f"fp-{device}", "page": viewed[-1], "referrer": "Direct",
+            "device": "desktop", "entropy_data": entropy,
+            "events": [{"event_type": rng.choice(["click", "scroll"]), "event_data": f"#el-{i}"} for i in range(events)],
+        }))
+        for page in viewed:
+            ts += timedelta(seconds=1)
+            stream.append(("/log-exit", {"session_id": f"s-{s}", "page": page, "exit_time": ts.isoformat() + "Z"}))
+        streams.append(stream)
+    return streams
+
+
+def faulty_sessionmaker():
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+    from app.db import async_engine
+
+    async def trouble():
+        if time.monotonic() < fault["down_until"]:
+            raise OperationalError("simulated outage", None, ConnectionError("database unavailable"))
+        if fault["delay"]:
+            await asyncio.sleep(fault["delay"])
+
+    class FaultySession(AsyncSession):
+        async def execute(self, *args, **kwargs):
+            await trouble()
+            return await super().execute(*args, **kwargs)
+
+        async def scalar(self, *args, **kwargs):
+            await trouble()
+            return await super().scalar(*args, **kwargs)
+
+        async def run_sync(self, *args, **kwargs):
+            await trouble()
+            return await super().run_sync(*args, **kwargs)
+
+        async def commit(self):
+            await trouble()
+            return await super().commit()
+
+    return async_sessionmaker(async_engine, class_=FaultySession, autoflush=False, expire_on_commit=False)
+
+
+async def drive(streams: list, concurrency: int, spool, args) -> dict:
+    import httpx
+    import app.main as main
+    from app.db import close_async_db, get_async_db
+
+    sessions = faulty_sessionmaker()
+
+    async def faulty_db():
+        async with sessions() as db:
+            yield db
+
+    main.app.dependency_overrides[get_async_db] = faulty_db
+    main.AsyncSessionLocal = sessions
+    main.ingest_spool = spool
+    if spool.enabled:
+        spool.start(main.replay_spooled)
+
+    latencies, errors = [], 0
+    pending = list(streams)
+
+    async def worker(client):
+        nonlocal errors
+        while pending:
+            for path, payload in pending.pop():
+                started = time.perf_counter()
+                response = await client.post(path, json=payload)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400 or response.json().get("status") == "error":
+                    errors += 1
+
+    fault["delay"] = args.db_ms / 1000
+    fault["down_until"] = time.monotonic() + args.outage_s
+    transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 1234), raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    # The database recovers; the spool drains
+    fault["delay"], fault["down_until"] = 0.0, 0.0
+    drain = None
+    if spool.enabled:
+        backlog, drain_started = spool.pending, time.perf_counter()
+        spool.wakeup.set()
+        while spool.pending:
+            await asyncio.sleep(0.05)
+        drain_seconds = time.perf_counter() - drain_started
+        stats = spool.snapshot()
+        drain = {"backlog_after_run": backlog, "seconds_after_run": round(drain_seconds, 2),
+                 "replay_entries_per_sec": stats["avg_replay_rate"], "replay_failures": stats["replay_failures"],
+                 "group_commits": stats["group_commits"], "avg_group": stats["avg_group"], "max_group": stats["max_group"]}
+        await spool.stop()
+
+    main.app.dependency_overrides.clear()
+    await close_async_db()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "drain": drain,
+    }
+
+
+def stored() -> dict:
+    from app.db import SessionLocal
+    from app.models import VisitorLog, VisitorEventLog
+
+    db = SessionLocal()
+    try:
+        return {"visits": db.query(VisitorLog).count(), "events": db.query(VisitorEventLog).count(),
+                "exits": db.query(VisitorLog).filter(VisitorLog.page_exit_time.isnot(None)).count()}
+    finally:
+        db.close()
+
+
+def run(mode: str, streams: list, args) -> dict:
+    import app.main as main
+    from app.spool import IngestSpool
+
+    async def fake_enrich(ip):
+        await asyncio.sleep(args.enrich_ms / 1000)
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    main.VISIT_PIPELINE = "inline"
+    path = os.path.join(tempfile.mkdtemp(prefix="spool-bench-"), "ingest.db")
+    spool = IngestSpool(path=path, enabled=mode == "spool")
+    with contextlib.redirect_stdout(io.StringIO()):
+        reset()
+        result = asyncio.run(drive(streams, args.concurrency, spool, args))
+    expected = {
+        "visits": sum(1 for stream in streams for path, _ in stream if path == "/log-visit"),
+        "events": sum(len(payload["events"]) for stream in streams for path, payload in stream if path == "/log-events"),
+        # A page viewed twice in a session gets both exits on its latest visit
+        "exits": len({(payload["session_id"], payload["page"]) for stream in streams for path, payload in stream
+                      if path == "/log-exit"}),
+    }
+    rows = stored()
+    return {"mode": mode, **result, "stored": rows, "expected": expected,
+            "lost": {key: expected[key] - rows[key] for key in expected}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest latency and data loss with / without the local spool")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--events", type=int, default=5, help="events in each session's /log-events batch")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--db-ms", type=float, default=50, help="injected latency per database call")
+    parser.add_argument("--outage-s", type=float, default=2, help="seconds the database is down at the start")
+    parser.add_argument("--enrich-ms", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    streams = session_streams(args.sessions, args.pages, args.events)
+    results = {"config": vars(args), "runs": [run(mode, streams, args) for mode in ("direct", "spool")]}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
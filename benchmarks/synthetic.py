@@ -0,0 +1,168 @@
+# Synthetic visitors / entropy profiles shared by the benchmark scripts
+
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+# Benchmarks default to a throwaway SQLite file unless DATABASE_URL points elsewhere
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'visitor_intel_bench.db')}"
+)
+
+TIMEZONES = ["Asia/Kolkata", "Europe/London", "America/New_York", "Europe/Berlin", "Asia/Singapore"]
+LANGUAGES = ["en-US", "en-GB", "en-IN", "de-DE", "hi-IN"]
+PLATFORMS = ["Win32", "MacIntel", "Linux x86_64", "iPhone"]
+SCREENS = ["1920x1080", "1440x900", "2560x1440", "390x844", "1366x768"]
+GPU_VENDORS = ["Google Inc. (NVIDIA)", "Google Inc. (Intel)", "Apple Inc.", "Google Inc. (AMD)"]
+PAGES = ["/", "/about", "/projects", "/blog", "/contact", "/resume"]
+REFERRERS = ["Direct", "https://google.com", "https://linkedin.com", "https://github.com"]
+COUNTRIES = ["IN", "US", "GB", "DE", "SG"]
+
+
+def make_entropy(rng: random.Random, device: int) -> dict:
+    # Deterministic per device so repeat visits share a profile
+    local = random.Random(device)
+    major = local.randint(110, 130)
+    return {
+        "userAgent": f"Mozilla/5.0 (X11; Linux x86_64) Chrome/{major}.0.{local.randint(1000, 6999)}.0 Safari/537.36",
+        "screen": local.choice(SCREENS),
+        "colorDepth": local.choice([24, 30, 32]),
+        "timezone": local.choice(TIMEZONES),
+        "language": local.choice(LANGUAGES),
+        "platform": local.choice(PLATFORMS),
+        "deviceMemory": local.choice([4, 8, 16]),
+        "hardwareConcurrency": local.choice([4, 8, 12, 16]),
+        "webglVendor": local.choice(GPU_VENDORS),
+        "webglRenderer": f"ANGLE (GPU {local.randint(1, 400)} Direct3D11)",
+        "canvas": f"canvas-{local.getrandbits(48):012x}",
+        "audio": f"{local.uniform(30, 40):.8f}",
+    }
+
+
+def mutate_entropy(rng: random.Random, entropy: dict) -> dict:
+    # Browser update / driver change: perturb one or two fields
+    entropy = dict(entropy)
+    for key in rng.sample(["userAgent", "webglRenderer", "screen", "timezone"], rng.randint(1, 2)):
+        entropy[key] = f"{entropy[key]}~{rng.randint(0, 9)}"
+    return entropy
+
+
+def synthetic_visits(n: int, devices: int = None, seed: int = 42):
+    rng = random.Random(seed)
+    devices = devices or max(1, n // 5)
+    start = datetime.utcnow() - timedelta(days=30)
+    for i in range(n):
+        device = rng.randrange(devices)
+        entropy = make_entropy(rng, device)
+        if rng.random() < 0.1:
+            entropy = mutate_entropy(rng, entropy)
+        yield {
+            "timestamp": start + timedelta(seconds=i * (30 * 86400 // max(n, 1))),
+            "page": rng.choice(PAGES),
+            "referrer": rng.choice(REFERRERS),
+            "device": rng.choice(["desktop", "mobile"]),
+            "session_id": f"s-{device}-{i // 7}",
+            "fingerprint_id": f"fp-{device}" if rng.random() < 0.9 else f"fp-{device}-{rng.randint(0, 3)}",
+            "country": rng.choice(COUNTRIES),
+            "entropy_data": entropy,
+            "visitor_alias": f"Visitor_{str(device + 1).zfill(3)}",
+        }
+
+
+def reset_database():
+    from app.db import engine
+    from app.models import Base
+    from app.profiles import profile_cache
+    import app.session_state as session_state
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    profile_cache.clear()
+    if session_state.session_store is not None:
+        session_state.session_store.clear()
+
+
+# Bulk-insert mappings carry entropy_profile_id, not the payload itself
+def with_profiles(db, rows):
+    from app.profiles import resolve_profile
+
+    for row in rows:
+        row["entropy_profile_id"] = resolve_profile(db, row.pop("entropy_data", None))
+    return rows
+
+
+def seed_visits(db, n: int, devices: int = None, seed: int = 42, chunk_size: int = 5000):
+    from app.models import VisitorLog
+
+    batch = []
+    for row in synthetic_visits(n, devices, seed):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            db.bulk_insert_mappings(VisitorLog, with_profiles(db, batch))
+            batch = []
+    if batch:
+        db.bulk_insert_mappings(VisitorLog, with_profiles(db, batch))
+    db.commit()
+
+
+def synthetic_events(n: int, devices: int = None, seed: int = 7):
+    rng = random.Random(seed)
+    devices = devices or max(1, n // 10)
+    start = datetime.utcnow() - timedelta(days=30)
+    for i in range(n):
+        device = rng.randrange(devices)
+        yield {
+            "timestamp": start + timedelta(seconds=i * (30 * 86400 // max(n, 1))),
+            "session_id": f"s-{device}-{i // 20}",
+            "fingerprint_id": f"fp-{device}",
+            "event_type": rng.choice(["click", "scroll", "hover", "copy"]),
+            "event_data": f"#el-{rng.randrange(50)}",
+            "page": rng.choice(PAGES),
+            "referrer": rng.choice(REFERRERS),
+            "device": rng.choice(["desktop", "mobile"]),
+            "country": rng.choice(COUNTRIES),
+            "entropy_data": make_entropy(rng, device),
+        }
+
+
+def seed_events(db, n: int, devices: int = None, seed: int = 7, chunk_size: int = 5000):
+    from app.models import VisitorEventLog
+
+    batch = []
+    for row in synthetic_events(n, devices, seed):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            db.bulk_insert_mappings(VisitorEventLog, with_profiles(db, batch))
+            batch = []
+    if batch:
+        db.bulk_insert_mappings(VisitorEventLog, with_profiles(db, batch))
+    db.commit()
+
+
+# One derived row per seeded visit, the way derive_visit would have written it (first visit = entry, bounce)
+def seed_derived(db, chunk_size: int = 5000):
+    from app.models import VisitorLog, VisitorDerivedLog
+    from app.rollups import traffic_type_for, landing_source_for
+
+    entry_pages, batch, last_id = {}, [], 0
+    while True:
+        rows = db.query(VisitorLog.id, VisitorLog.session_id, VisitorLog.fingerprint_id, VisitorLog.page,
+                        VisitorLog.utm_source, VisitorLog.referrer, VisitorLog.country, VisitorLog.timestamp) \
+            .filter(VisitorLog.id > last_id).order_by(VisitorLog.id).limit(chunk_size).all()
+        if not rows:
+            break
+        for row in rows:
+            first = row.session_id not in entry_pages
+            entry_pages.setdefault(row.session_id, row.page)
+            batch.append({
+                "session_id": row.session_id, "fingerprint_id": row.fingerprint_id,
+                "visit_type": "New" if first else "Returning", "traffic_type": traffic_type_for(row.utm_source, row.referrer),
+                "entry_page": entry_pages[row.session_id], "bounced": "Yes" if first else "No",
+                "geo_region_type": "Domestic" if row.country == "IN" else "International",
+                "landing_source": landing_source_for(row.utm_source, row.referrer),
+                "timestamp": row.timestamp,
+            })
+        db.bulk_insert_mappings(VisitorDerivedLog, batch)
+        batch, last_id = [], rows[-1].id
+    db.commit()
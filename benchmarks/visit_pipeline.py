@@ -0,0 +1,209 @@
+# Inline vs deferred /log-visit (VISIT_PIPELINE) with a slow IP-enrichment upstream (stubbed).
+# The same visit stream runs through both pipelines; the deferred run has worker threads draining
+# visit_jobs while the load is applied. Reports endpoint latency, job lag, retries, and whether
+# the final visitor_logs / visitor_derived_logs / visit_rollups contents match the inline run.
+# A second deferred run makes ~10% of enrichment calls fail once (retries) and has a "zombie" worker
+# whose claims expire and get taken over — its late results must be fenced off, not applied twice.
+# Usage: python -m benchmarks.visit_pipeline [visits] [concurrency] [enrich_ms] [workers]
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import make_entropy, reset_database
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def visit_stream(total: int):
+    rng = random.Random(3)
+    devices = max(1, total // 6)
+    stream = []
+    for i in range(total):
+        device = rng.randrange(devices)
+        stream.append({
+            "page": rng.choice(["/", "/about", "/blog", "/projects"]), "referrer": rng.choice(["Direct", "https://google.com"]),
+            "device": "desktop", "session_id": f"s-{device}-{i // (total // 4 or 1)}", "fingerprint_id": f"fp-{device}",
+            "entropy_data": make_entropy(rng, device), "client_timestamp": "2026-10-18T10:00:00Z",
+        })
+    return stream
+
+
+def reset():
+    from app.db import SessionLocal
+    from app.labels import backfill_label_mappings, label_cache
+
+    reset_database()
+    label_cache.clear()
+    db = SessionLocal()
+    backfill_label_mappings(db)
+    db.close()
+
+
+def snapshot():
+    from app.db import SessionLocal
+    from app.models import VisitorLog, VisitorDerivedLog, VisitRollup
+
+    db = SessionLocal()
+    try:
+        visits = [tuple(r) for r in db.query(
+            VisitorLog.id, VisitorLog.visitor_alias, VisitorLog.session_label, VisitorLog.city, VisitorLog.country,
+            VisitorLog.probable_alias, VisitorLog.best_match_alias, VisitorLog.best_match_score,
+        ).order_by(VisitorLog.id)]
+        derived = sorted(tuple(r) for r in db.query(
+            VisitorDerivedLog.session_id, VisitorDerivedLog.fingerprint_id, VisitorDerivedLog.visit_type,
+            VisitorDerivedLog.entry_page, VisitorDerivedLog.bounced, VisitorDerivedLog.geo_region_type,
+        ))
+        rollups = sorted(tuple(r) for r in db.query(
+            VisitRollup.granularity, VisitRollup.page, VisitRollup.country, VisitRollup.traffic_type,
+            VisitRollup.visits, VisitRollup.sessions, VisitRollup.bounced_sessions,
+        ).filter((VisitRollup.visits != 0) | (VisitRollup.sessions != 0) | (VisitRollup.bounced_sessions != 0)))
+        return {"visits": visits, "derived": derived, "rollups": rollups}
+    finally:
+        db.close()
+
+
+async def post_all(stream, concurrency: int):
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    latencies, errors = [], []
+    queue = asyncio.Queue()
+    for payload in stream:
+        queue.put_nowait(payload)
+
+    async def worker(client):
+        while not queue.empty():
+            payload = queue.get_nowait()
+            started = time.perf_counter()
+            response = await client.post("/log-visit", json=payload)
+            latencies.append(time.perf_counter() - started)
+            if response.json().get("status") != "success":
+                errors.append(response.json())
+
+    transport = httpx.ASGITransport(app=main.app, client=("203.0.113.7", 1234))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    await close_async_db()
+    return latencies, errors, elapsed
+
+
+def run(mode: str, stream, concurrency: int, enrich_ms: float, workers: int, chaos: bool = False) -> dict:
+    import app.main as main
+    import app.visit_jobs as visit_jobs
+    from app.db import SessionLocal
+    from app.models import VisitJob
+
+    rng = random.Random(9)
+    enriched = {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    async def fake_enrich_async(ip):
+        await asyncio.sleep(enrich_ms / 1000)
+        return enriched
+
+    def fake_enrich(ip):
+        if chaos and rng.random() < 0.1:
+            raise ConnectionError("ipinfo timeout (injected)")
+        time.sleep(enrich_ms / 1000)
+        return enriched
+
+    main.enrich_ip_data_async = fake_enrich_async
+    visit_jobs.enrich_ip_data = fake_enrich
+    main.VISIT_PIPELINE = mode
+    visit_jobs.VISIT_JOB_BACKOFF = 0.05
+    reset()
+
+    zombie_lost = None
+    pool = visit_jobs.VisitWorker(threads=workers, poll=0.05)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "deferred":
+            pool.start()
+        latencies, errors, elapsed = asyncio.run(post_all(stream, concurrency))
+
+        if mode == "deferred":
+            if chaos:
+                # Zombie: claims a batch, stalls past its lease, and only then tries to finish
+                pool.stop()
+                zombie_db = SessionLocal()
+                zombie_jobs = visit_jobs.claim_jobs(zombie_db, 25)
+                zombie_db.query(VisitJob).filter(VisitJob.id.in_([job.id for job in zombie_jobs])).update(
+                    {VisitJob.locked_at: datetime.utcnow() - timedelta(hours=1)}, synchronize_session=False)
+                zombie_db.commit()   # ...as if it had stalled for an hour: the lease has expired
+                pool.start()
+            deadline = time.time() + 300
+            db = SessionLocal()
+            while time.time() < deadline:
+                stats = visit_jobs.queue_stats(db)
+                db.rollback()
+                if stats["pending"] == 0 and stats["running"] == 0:
+                    break
+                time.sleep(0.05)
+            db.close()
+            pool.stop()
+            if chaos:
+                zombie_lost = sum(visit_jobs.process_job(zombie_db, job) == "lost" for job in zombie_jobs)
+                zombie_db.close()
+
+    result = {
+        "mode": mode + (" + injected failures + zombie worker" if chaos else ""),
+        "visits": len(stream),
+        "concurrency": concurrency,
+        "enrich_ms": enrich_ms,
+        "endpoint_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "endpoint_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "endpoint_rps": round(len(stream) / elapsed, 1),
+        "errors": len(errors),
+    }
+    if errors:
+        result["error_reasons"] = sorted({e.get("reason") for e in errors})
+    if mode == "deferred":
+        db = SessionLocal()
+        jobs = db.query(VisitJob.created_at, VisitJob.finished_at, VisitJob.attempts, VisitJob.status).all()
+        db.close()
+        lags = [(f - c).total_seconds() for c, f, _, _ in jobs if f is not None]
+        result.update({
+            "workers": workers,
+            "jobs_done": sum(1 for job in jobs if job.status == "done"),
+            "jobs_failed": sum(1 for job in jobs if job.status == "failed"),
+            "jobs_retried": sum(1 for job in jobs if job.attempts > 1),
+            "lag_p50_ms": round(percentile(lags, 50) * 1000, 1) if lags else None,
+            "lag_p99_ms": round(percentile(lags, 99) * 1000, 1) if lags else None,
+        })
+        if chaos:
+            result["zombie_results_fenced_off"] = f"{zombie_lost}/{len(zombie_jobs)}"
+    return result
+
+
+# Concurrency defaults to 1 so visit ids line up across runs (the parity check compares row by row)
+def main(total: int = 300, concurrency: int = 1, enrich_ms: float = 30, workers: int = 2):
+    stream = visit_stream(total)
+    results = [run("inline", stream, concurrency, enrich_ms, workers)]
+    inline = snapshot()
+    for chaos in (False, True):
+        results.append(run("deferred", stream, concurrency, enrich_ms, workers, chaos))
+        deferred = snapshot()
+        results[-1]["matches_inline"] = {key: deferred[key] == inline[key] for key in inline}
+        results[-1]["visit_rows_matching"] = f"{sum(a == b for a, b in zip(deferred['visits'], inline['visits']))}/{len(inline['visits'])}"
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inline vs deferred /log-visit pipeline")
+    parser.add_argument("visits", nargs="?", type=int, default=300)
+    parser.add_argument("concurrency", nargs="?", type=int, default=1)
+    parser.add_argument("enrich_ms", nargs="?", type=float, default=30)
+    parser.add_argument("workers", nargs="?", type=int, default=2)
+    args = parser.parse_args()
+    main(args.visits, args.concurrency, args.enrich_ms, args.workers)
@@ -0,0 +1,92 @@
+# Where /log-visit time goes: drives visits through the app (stubbed IP enrichment), then reads the
+# per-stage histograms and DB round-trip counts back out of app.metrics. Also compares request
+# throughput with the structured request log on (INFO, written to /dev/null) vs LOG_LEVEL=OFF.
+# Concurrency defaults to 1: on the SQLite stand-in, parallel writers mostly measure lock waits.
+# Usage: python -m benchmarks.visit_stages [visits] [concurrency]
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+
+from benchmarks.synthetic import make_entropy, reset_database
+
+
+async def drive(total: int, concurrency: int, seed: int):
+    import httpx
+    import app.main as main
+    from app.db import close_async_db
+
+    async def fake_enrich(ip):
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Bench"}
+
+    main.enrich_ip_data_async = fake_enrich
+    rng = random.Random(seed)
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker(client):
+        while not queue.empty():
+            queue.get_nowait()
+            device = rng.randrange(max(1, total // 5))
+            response = await client.post("/log-visit", json={
+                "page": "/", "referrer": "Direct", "device": "desktop",
+                "session_id": f"s-{device}-{seed}", "fingerprint_id": f"fp-{device}",
+                "entropy_data": make_entropy(rng, device),
+            })
+            response.raise_for_status()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    await close_async_db()
+    return elapsed
+
+
+def stage_breakdown():
+    from app.metrics import visit_stage_seconds, visit_db_round_trips
+
+    stages = {
+        key[0]: {"count": series[-1], "mean_ms": round(series[-2] / series[-1] * 1000, 3)}
+        for key, series in sorted(visit_stage_seconds.series.items()) if series[-1]
+    }
+    trips = visit_db_round_trips.series.get(())
+    return stages, (round(trips[-2] / trips[-1], 2) if trips else None)
+
+
+def main(total: int = 500, concurrency: int = 1):
+    from app import logs
+    from app.metrics import request_errors_total
+    from app.db import SessionLocal
+    from app.labels import backfill_label_mappings
+
+    reset_database()
+    results = []
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        db = SessionLocal()
+        backfill_label_mappings(db)    # Seeds the label counters, as init_db does at startup
+        db.close()
+        for name, disabled in (("LOG_LEVEL=INFO", False), ("LOG_LEVEL=OFF", True), ("LOG_LEVEL=INFO", False)):
+            logs.logger.disabled = disabled
+            elapsed = asyncio.run(drive(total, concurrency, seed=len(results)))
+            results.append({"logging": name, "visits": total, "throughput_rps": round(total / elapsed, 1),
+                            "errors": sum(request_errors_total.values.values())})
+    logs.logger.disabled = False
+
+    stages, round_trips = stage_breakdown()
+    results.append({"stage_mean_ms": stages, "db_round_trips_per_visit": round_trips})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Where /log-visit time goes, per stage")
+    parser.add_argument("visits", nargs="?", type=int, default=500)
+    parser.add_argument("concurrency", nargs="?", type=int, default=1)
+    args = parser.parse_args()
+    main(args.visits, args.concurrency)
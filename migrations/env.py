@@ -0,0 +1,54 @@
+# Alembic environment: runs against DATABASE_URL with the app's model metadata.
+# Invoked by app.db.init_db on startup (stopping short of migrations marked `heavy = True` on an
+# existing database), or manually / as the deploy step: `alembic upgrade head`.
+
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool, text
+
+from app.models import Base
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logging", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# Serializes concurrent upgrades when several uvicorn workers start at once
+MIGRATION_LOCK_ID = 73_451_001
+
+
+def run_migrations_offline():
+    context.configure(
+        url=os.environ["DATABASE_URL"],
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    engine = create_engine(os.environ["DATABASE_URL"], poolclass=pool.NullPool)
+
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            connection.commit()
+        try:
+            context.configure(connection=connection, target_metadata=target_metadata)
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
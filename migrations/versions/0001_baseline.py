@@ -0,0 +1,161 @@
+"""Baseline schema (tables previously created by Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+EntropyJSON = postgresql.JSONB().with_variant(sa.JSON(), "sqlite")
+
+
+def entropy_columns():
+    return [
+        sa.Column("entropy_data", EntropyJSON),
+        sa.Column("user_agent", sa.Text()),
+        sa.Column("screen_res", sa.String()),
+        sa.Column("color_depth", sa.String()),
+        sa.Column("timezone", sa.String()),
+        sa.Column("language", sa.String()),
+        sa.Column("platform", sa.String()),
+        sa.Column("device_memory", sa.String()),
+        sa.Column("cpu_cores", sa.String()),
+        sa.Column("gpu_vendor", sa.String()),
+        sa.Column("gpu_renderer", sa.String()),
+        sa.Column("canvas_hash", sa.String()),
+        sa.Column("audio_hash", sa.String()),
+    ]
+
+
+def geo_columns():
+    return [
+        sa.Column("page", sa.String()),
+        sa.Column("referrer", sa.String()),
+        sa.Column("device", sa.String()),
+        sa.Column("ip_address", sa.String()),
+        sa.Column("city", sa.String()),
+        sa.Column("region", sa.String()),
+        sa.Column("country", sa.String()),
+        sa.Column("organization", sa.String()),
+        sa.Column("enriched_source", sa.String()),
+    ]
+
+
+# Databases created before Alembic already have some of these tables
+def create_table(name, *columns, **kwargs):
+    if sa.inspect(op.get_bind()).has_table(name):
+        return False
+    op.create_table(name, *columns, **kwargs)
+    return True
+
+
+def upgrade():
+    if create_table(
+        "visitor_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("client_timestamp", sa.DateTime(), nullable=True),
+        sa.Column("session_id", sa.String()),
+        sa.Column("fingerprint_id", sa.String()),
+        *geo_columns(),
+        sa.Column("utm_source", sa.String()),
+        sa.Column("utm_medium", sa.String()),
+        sa.Column("utm_campaign", sa.String()),
+        sa.Column("utm_term", sa.String()),
+        sa.Column("utm_content", sa.String()),
+        *entropy_columns(),
+        sa.Column("visitor_alias", sa.String()),
+        sa.Column("session_label", sa.String()),
+        sa.Column("probable_alias", sa.String()),
+        sa.Column("probable_score", sa.Float()),
+        sa.Column("best_match_alias", sa.String()),
+        sa.Column("best_match_score", sa.Float()),
+        sa.Column("page_exit_time", sa.DateTime(), nullable=True),
+        sa.Column("time_on_page", sa.Integer(), nullable=True),
+    ):
+        op.create_index("ix_visitor_logs_id", "visitor_logs", ["id"])
+
+    if create_table(
+        "visitor_event_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("timestamp", sa.DateTime()),
+        sa.Column("client_timestamp", sa.DateTime(), nullable=True),
+        sa.Column("session_id", sa.String()),
+        sa.Column("fingerprint_id", sa.String()),
+        sa.Column("event_type", sa.String()),
+        sa.Column("event_data", sa.String()),
+        *geo_columns(),
+        *entropy_columns(),
+    ):
+        op.create_index("ix_visitor_event_logs_id", "visitor_event_logs", ["id"])
+
+    if create_table(
+        "visitor_derived_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.String()),
+        sa.Column("fingerprint_id", sa.String()),
+        sa.Column("visit_type", sa.String()),
+        sa.Column("traffic_type", sa.String()),
+        sa.Column("entry_page", sa.String()),
+        sa.Column("bounced", sa.String()),
+        sa.Column("geo_region_type", sa.String()),
+        sa.Column("landing_source", sa.String()),
+        sa.Column("timestamp", sa.DateTime()),
+    ):
+        op.create_index("ix_visitor_derived_logs_id", "visitor_derived_logs", ["id"])
+
+    if create_table(
+        "entropy_signatures",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("visitor_alias", sa.String(), nullable=False),
+        sa.Column("fingerprint_id", sa.String(), nullable=False),
+        sa.Column("signature", sa.String(), nullable=False),
+        sa.Column("first_log_id", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("visitor_alias", "fingerprint_id", "signature", name="uq_entropy_signature"),
+    ):
+        op.create_index("ix_entropy_signatures_id", "entropy_signatures", ["id"])
+
+    if create_table(
+        "entropy_signature_terms",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("signature_id", sa.Integer(), sa.ForeignKey("entropy_signatures.id", ondelete="CASCADE")),
+        sa.Column("field", sa.String(), nullable=False),
+        sa.Column("term", sa.String(), nullable=False),
+    ):
+        op.create_index("ix_entropy_signature_terms_signature_id", "entropy_signature_terms", ["signature_id"])
+        op.create_index("ix_entropy_signature_terms_term", "entropy_signature_terms", ["term"])
+
+    create_table(
+        "label_counters",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("value", sa.Integer(), nullable=False),
+    )
+    create_table(
+        "visitor_aliases",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("fingerprint_id", sa.String(), nullable=False, unique=True),
+        sa.Column("visitor_alias", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    create_table(
+        "session_labels",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("session_id", sa.String(), nullable=False, unique=True),
+        sa.Column("session_label", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+
+
+def downgrade():
+    for name in [
+        "session_labels", "visitor_aliases", "label_counters", "entropy_signature_terms",
+        "entropy_signatures", "visitor_derived_logs", "visitor_event_logs", "visitor_logs",
+    ]:
+        op.drop_table(name)
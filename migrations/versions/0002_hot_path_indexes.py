@@ -0,0 +1,46 @@
+"""Composite and partial indexes for the ingest hot path
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def partial(condition):
+    return {"postgresql_where": sa.text(condition), "sqlite_where": sa.text(condition)}
+
+
+INDEXES = [
+    # (name, table, columns, extra kwargs)
+    ("ix_visitor_logs_session_ts", "visitor_logs", ["session_id", "timestamp"], {}),
+    ("ix_visitor_logs_session_page_ts", "visitor_logs", ["session_id", "page", "timestamp"], {}),
+    ("ix_visitor_logs_alias_by_fingerprint", "visitor_logs", ["fingerprint_id", "id"],
+     partial("visitor_alias IS NOT NULL")),
+    ("ix_visitor_logs_entropy_rows", "visitor_logs", ["id"], partial("entropy_data IS NOT NULL")),
+    ("ix_visitor_event_logs_session_ts", "visitor_event_logs", ["session_id", "timestamp"], {}),
+    ("ix_visitor_derived_logs_session_id", "visitor_derived_logs", ["session_id"], {}),
+    ("ix_entropy_signatures_first_log_id", "entropy_signatures", ["first_log_id"], {}),
+]
+
+
+def upgrade():
+    # Build without blocking ingest writes on PostgreSQL (CONCURRENTLY can't run in a transaction)
+    postgres = op.get_bind().dialect.name == "postgresql"
+    with op.get_context().autocommit_block() if postgres else nullcontext():
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=postgres, **kwargs)
+    op.execute("ANALYZE")
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
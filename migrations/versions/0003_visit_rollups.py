@@ -0,0 +1,33 @@
+"""Hourly/daily visit rollups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+DIMENSIONS = ["page", "country", "traffic_type", "landing_source", "device", "utm_campaign"]
+
+
+def upgrade():
+    op.create_table(
+        "visit_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("granularity", sa.String(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        *[sa.Column(name, sa.String(), nullable=False) for name in DIMENSIONS],
+        sa.Column("visits", sa.Integer(), nullable=False),
+        sa.Column("sessions", sa.Integer(), nullable=False),
+        sa.Column("bounced_sessions", sa.Integer(), nullable=False),
+        sa.UniqueConstraint("granularity", "bucket", *DIMENSIONS, name="uq_visit_rollup"),
+    )
+
+
+def downgrade():
+    op.drop_table("visit_rollups")
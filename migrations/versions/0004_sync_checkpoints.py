@@ -0,0 +1,26 @@
+"""Checkpoints for sync/ingestion jobs
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "sync_checkpoints",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("value", sa.String(), nullable=True),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table("sync_checkpoints")
@@ -0,0 +1,35 @@
+"""Local GA4 sessions table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ga_sessions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("date_hour_minute", sa.String(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.Column("page", sa.String(), nullable=False),
+        sa.Column("device", sa.String(), nullable=False),
+        sa.Column("city", sa.String(), nullable=False),
+        sa.Column("country", sa.String(), nullable=False),
+        sa.Column("sessions", sa.Integer(), nullable=False),
+        sa.Column("fetched_at", sa.DateTime()),
+        sa.UniqueConstraint("date_hour_minute", "page", "device", "city", "country", name="uq_ga_session"),
+    )
+    op.create_index("ix_ga_sessions_timestamp", "ga_sessions", ["timestamp"])
+
+
+def downgrade():
+    op.drop_index("ix_ga_sessions_timestamp", table_name="ga_sessions")
+    op.drop_table("ga_sessions")
@@ -0,0 +1,37 @@
+"""MinHash LSH index for fuzzy entropy matching
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "entropy_fuzzy_values",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("field", sa.String(), nullable=False),
+        sa.Column("term", sa.String(), nullable=False, unique=True),
+        sa.Column("value", sa.Text(), nullable=False),
+    )
+    op.create_table(
+        "entropy_fuzzy_bands",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("band", sa.String(), nullable=False),
+        sa.Column("value_id", sa.Integer(), sa.ForeignKey("entropy_fuzzy_values.id", ondelete="CASCADE"), nullable=False),
+        sa.UniqueConstraint("band", "value_id", name="uq_entropy_fuzzy_band"),
+    )
+    op.create_index("ix_entropy_fuzzy_bands_value_id", "entropy_fuzzy_bands", ["value_id"])
+
+
+def downgrade():
+    op.drop_index("ix_entropy_fuzzy_bands_value_id", table_name="entropy_fuzzy_bands")
+    op.drop_table("entropy_fuzzy_bands")
+    op.drop_table("entropy_fuzzy_values")
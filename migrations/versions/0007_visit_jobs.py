@@ -0,0 +1,41 @@
+"""Job queue for deferred /log-visit enrichment and scoring
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def partial(condition):
+    return {"postgresql_where": sa.text(condition), "sqlite_where": sa.text(condition)}
+
+
+def upgrade():
+    op.create_table(
+        "visit_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("visit_id", sa.Integer(), nullable=False, unique=True),
+        sa.Column("returning_session", sa.Boolean(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("locked_at", sa.DateTime()),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime()),
+    )
+    op.create_index("ix_visit_jobs_pending", "visit_jobs", ["run_after", "id"], **partial("status = 'pending'"))
+    op.create_index("ix_visit_jobs_running", "visit_jobs", ["locked_at"], **partial("status = 'running'"))
+
+
+def downgrade():
+    op.drop_index("ix_visit_jobs_running", table_name="visit_jobs")
+    op.drop_index("ix_visit_jobs_pending", table_name="visit_jobs")
+    op.drop_table("visit_jobs")
@@ -0,0 +1,169 @@
+"""Deduplicate entropy payloads into content-addressed entropy_profiles
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+visitor_logs / visitor_event_logs stop storing entropy_data and its twelve denormalized columns
+on every row; they reference an entropy_profiles row (keyed by sha256 of the normalized JSON,
+hashed exactly like app.profiles.profile_hash) instead. Existing rows are deduplicated here and
+the logical size of the moved columns is reported. Rewrites both log tables, so it is marked
+heavy: run `alembic upgrade head` as a deploy step rather than on startup. PostgreSQL only
+hands the freed pages back to the OS after VACUUM FULL (or pg_repack) on the two log tables.
+"""
+import json
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+heavy = True   # Rewrites both log tables; skipped by app.db.migrate_on_startup
+
+EntropyJSON = postgresql.JSONB().with_variant(sa.JSON(), "sqlite")
+LOG_TABLES = ["visitor_logs", "visitor_event_logs"]
+CHUNK_SIZE = 5000
+
+# Denormalized column -> entropy payload key
+PROFILE_COLUMNS = {
+    "user_agent": "userAgent",
+    "screen_res": "screen",
+    "color_depth": "colorDepth",
+    "timezone": "timezone",
+    "language": "language",
+    "platform": "platform",
+    "device_memory": "deviceMemory",
+    "cpu_cores": "hardwareConcurrency",
+    "gpu_vendor": "webglVendor",
+    "gpu_renderer": "webglRenderer",
+    "canvas_hash": "canvas",
+    "audio_hash": "audio",
+}
+
+
+def partial(condition):
+    return {"postgresql_where": sa.text(condition), "sqlite_where": sa.text(condition)}
+
+
+def normalize(entropy):
+    return json.dumps(entropy, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def profile_columns():
+    return [sa.Column(name, sa.Text() if name == "user_agent" else sa.String()) for name in PROFILE_COLUMNS]
+
+
+# Bytes the entropy columns take for one row (JSON text + denormalized strings)
+def payload_bytes(entropy, values):
+    return len(normalize(entropy).encode("utf-8")) + sum(len(str(v).encode("utf-8")) for v in values if v is not None)
+
+
+def dedup_table(conn, name, profiles, profile_table, stats):
+    log = sa.table(name, sa.column("id", sa.Integer()), sa.column("timestamp", sa.DateTime()),
+                   sa.column("entropy_profile_id", sa.Integer()),
+                   sa.column("entropy_data", EntropyJSON), *[sa.column(c) for c in PROFILE_COLUMNS])
+    rows, before, last_id = 0, 0, 0
+    while True:
+        chunk = conn.execute(
+            sa.select(log.c.id, log.c.timestamp, log.c.entropy_data, *[log.c[c] for c in PROFILE_COLUMNS])
+            .where(log.c.id > last_id, log.c.entropy_data.isnot(None))
+            .order_by(log.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not chunk:
+            break
+        assigned = {}   # log id -> profile id
+        for log_id, timestamp, entropy, *values in chunk:
+            digest = hashlib.sha256(normalize(entropy).encode("utf-8")).hexdigest()
+            if digest not in profiles:
+                profiles[digest] = conn.execute(
+                    profile_table.insert().values(
+                        profile_hash=digest, entropy_data=entropy, first_seen=timestamp,
+                        **{column: entropy.get(key) for column, key in PROFILE_COLUMNS.items()},
+                    ).returning(profile_table.c.id)
+                ).scalar_one()
+                stats["profile_bytes"] += payload_bytes(entropy, [entropy.get(key) for key in PROFILE_COLUMNS.values()])
+            assigned[log_id] = profiles[digest]
+            before += payload_bytes(entropy, values)
+
+        # One UPDATE ... FROM per chunk: rows point at the chunk's profile with the same payload
+        in_chunk = sa.and_(log.c.id >= chunk[0][0], log.c.id <= chunk[-1][0], log.c.entropy_data.isnot(None))
+        conn.execute(
+            log.update()
+            .where(in_chunk, profile_table.c.id.in_(set(assigned.values())),
+                   log.c.entropy_data == profile_table.c.entropy_data)
+            .values(entropy_profile_id=profile_table.c.id)
+        )
+        # Equal payloads that compare unequal in SQL (other key order in SQLite's JSON text) go by hash
+        leftover = conn.execute(sa.select(log.c.id).where(in_chunk, log.c.entropy_profile_id.is_(None))).scalars().all()
+        if leftover:
+            conn.execute(
+                log.update().where(log.c.id == sa.bindparam("log_id")).values(entropy_profile_id=sa.bindparam("profile_id")),
+                [{"log_id": log_id, "profile_id": assigned[log_id]} for log_id in leftover],
+            )
+        rows += len(chunk)
+        last_id = chunk[-1][0]
+    stats["tables"][name] = {"rows": rows, "bytes": before}
+
+
+def upgrade():
+    profile_table = op.create_table(
+        "entropy_profiles",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("profile_hash", sa.String(64), nullable=False, unique=True),
+        sa.Column("entropy_data", EntropyJSON, nullable=False),
+        *profile_columns(),
+        sa.Column("first_seen", sa.DateTime()),
+    )
+    for name in LOG_TABLES:
+        with op.batch_alter_table(name) as batch:
+            batch.add_column(sa.Column("entropy_profile_id", sa.Integer()))
+            batch.create_foreign_key(f"fk_{name}_entropy_profile", "entropy_profiles", ["entropy_profile_id"], ["id"])
+
+    conn = op.get_bind()
+    profiles = {}
+    stats = {"tables": {}, "profile_bytes": 0}
+    for name in LOG_TABLES:
+        dedup_table(conn, name, profiles, profile_table, stats)
+
+    op.drop_index("ix_visitor_logs_entropy_rows", table_name="visitor_logs")
+    for name in LOG_TABLES:
+        with op.batch_alter_table(name) as batch:
+            for column in ["entropy_data", *PROFILE_COLUMNS]:
+                batch.drop_column(column)
+    op.create_index("ix_visitor_logs_entropy_rows", "visitor_logs", ["id"], **partial("entropy_profile_id IS NOT NULL"))
+
+    rows = sum(t["rows"] for t in stats["tables"].values())
+    if not rows:
+        return
+    before = sum(t["bytes"] for t in stats["tables"].values())
+    after = stats["profile_bytes"] + 4 * rows   # Profiles + one integer reference per row
+    print(f"🗜️ Entropy dedup: {rows} rows → {len(profiles)} profiles; "
+          f"entropy columns ~{before / 1e6:.2f} MB → ~{after / 1e6:.2f} MB (saved ~{(before - after) / 1e6:.2f} MB)")
+    for name, table in stats["tables"].items():
+        print(f"   {name}: {table['rows']} rows, {table['bytes'] / 1e6:.2f} MB of entropy columns moved")
+
+
+def downgrade():
+    op.drop_index("ix_visitor_logs_entropy_rows", table_name="visitor_logs")
+    for name in LOG_TABLES:
+        with op.batch_alter_table(name) as batch:
+            batch.add_column(sa.Column("entropy_data", EntropyJSON))
+            for column in profile_columns():
+                batch.add_column(column)
+
+        # Rehydrate the inline columns from the referenced profile
+        columns = ["entropy_data", *PROFILE_COLUMNS]
+        op.execute(
+            f"UPDATE {name} SET "
+            + ", ".join(f"{c} = (SELECT p.{c} FROM entropy_profiles p WHERE p.id = {name}.entropy_profile_id)" for c in columns)
+            + " WHERE entropy_profile_id IS NOT NULL"
+        )
+        with op.batch_alter_table(name) as batch:
+            batch.drop_constraint(f"fk_{name}_entropy_profile", type_="foreignkey")
+            batch.drop_column("entropy_profile_id")
+    op.create_index("ix_visitor_logs_entropy_rows", "visitor_logs", ["id"], **partial("entropy_data IS NOT NULL"))
+    op.drop_table("entropy_profiles")
@@ -0,0 +1,112 @@
+"""Monthly range partitioning of visitor_logs / visitor_event_logs by timestamp
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+PostgreSQL: each table is rebuilt as a partitioned table (PARTITION BY RANGE (timestamp)) with
+one partition per month from the oldest row to PARTITION_MONTHS_AHEAD months ahead, plus a
+DEFAULT partition. The primary key becomes (id, timestamp), since a partitioned table's unique
+keys must include the partition key; ids still come from the same sequence. Rows are copied in
+one statement, so it is marked heavy: startup does not run it on an existing database; run
+`alembic upgrade head` as a deploy step, in a maintenance window on large tables. Later months
+are created by app.partitions (init_db / `python -m app.partitions`).
+SQLite stand-in: tables stay plain; only timestamp becomes NOT NULL to match.
+"""
+import os
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+heavy = True   # Rewrites both log tables; skipped by app.db.migrate_on_startup
+
+TABLES = ["visitor_logs", "visitor_event_logs"]
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+
+def month_start(ts):
+    return datetime(ts.year, ts.month, 1)
+
+
+def add_months(ts, months):
+    index = ts.year * 12 + ts.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+# Non-primary-key index definitions, replayed verbatim on the rebuilt table
+def index_defs(conn, table):
+    return conn.execute(sa.text(
+        "SELECT i.indexname, i.indexdef FROM pg_indexes i "
+        "WHERE i.schemaname = current_schema() AND i.tablename = :table "
+        "AND i.indexname NOT IN (SELECT conname FROM pg_constraint WHERE contype = 'p')"
+    ), {"table": table}).all()
+
+
+def rebuild(conn, table, partitioned):
+    old = f"{table}_old"
+    indexes = index_defs(conn, table)
+    foreign_keys = conn.execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+    ), {"table": table}).all()
+
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"ALTER INDEX {table}_pkey RENAME TO {old}_pkey")
+    for name, _ in indexes:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name}_old")
+
+    op.execute(f'UPDATE {old} SET "timestamp" = COALESCE(client_timestamp, now() AT TIME ZONE \'UTC\') '
+               f'WHERE "timestamp" IS NULL')
+    if partitioned:
+        op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING STORAGE) '
+                   f'PARTITION BY RANGE ("timestamp")')
+        op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "timestamp")')
+        oldest = conn.execute(sa.text(f'SELECT min("timestamp") FROM {old}')).scalar() or datetime.utcnow()
+        month, last = month_start(oldest), add_months(month_start(datetime.utcnow()), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+                       f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+            month = add_months(month, 1)
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    else:
+        op.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING STORAGE)")
+        op.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+    op.execute(f'ALTER TABLE {table} ALTER COLUMN "timestamp" SET NOT NULL')
+
+    for name, definition in indexes:
+        op.execute(definition.replace(" ON ONLY ", " ON "))
+    for name, definition in foreign_keys:
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {old} CASCADE")
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        for table in TABLES:
+            op.execute(f"UPDATE {table} SET timestamp = COALESCE(client_timestamp, CURRENT_TIMESTAMP) WHERE timestamp IS NULL")
+            with op.batch_alter_table(table) as batch:
+                batch.alter_column("timestamp", existing_type=sa.DateTime(), nullable=False)
+        return
+    for table in TABLES:
+        rebuild(conn, table, partitioned=True)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != "postgresql":
+        for table in TABLES:
+            with op.batch_alter_table(table) as batch:
+                batch.alter_column("timestamp", existing_type=sa.DateTime(), nullable=True)
+        return
+    for table in TABLES:
+        rebuild(conn, table, partitioned=False)
+        op.execute(f'ALTER TABLE {table} ALTER COLUMN "timestamp" DROP NOT NULL')
@@ -0,0 +1,33 @@
+"""Hourly HyperLogLog sketches of distinct visitors / sessions
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+
+Filled on ingest from here on; `python -m app.backfill` (or `python -m app.uniques --rebuild`) backfills existing rows.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+DIMENSIONS = ["page", "country", "utm_campaign"]
+
+
+def upgrade():
+    op.create_table(
+        "unique_sketches",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        *[sa.Column(name, sa.String(), nullable=False) for name in DIMENSIONS],
+        sa.Column("visitors", sa.LargeBinary(), nullable=False),
+        sa.Column("sessions", sa.LargeBinary(), nullable=False),
+        sa.UniqueConstraint("bucket", *DIMENSIONS, name="uq_unique_sketch"),
+    )
+
+
+def downgrade():
+    op.drop_table("unique_sketches")
@@ -0,0 +1,24 @@
+"""Change cursor index on ga_sessions for incremental Airtable pushes
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18
+
+fetched_at now moves whenever a row is stored or its sessions count is revised; pushes select
+rows past the (fetched_at, id) checkpoint.
+"""
+from alembic import op
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE ga_sessions SET fetched_at = timestamp WHERE fetched_at IS NULL")
+    op.create_index("ix_ga_sessions_fetched", "ga_sessions", ["fetched_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_ga_sessions_fetched", table_name="ga_sessions")
@@ -0,0 +1,25 @@
+"""Index done visit jobs by finish time for pruning
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def partial(condition):
+    return {"postgresql_where": sa.text(condition), "sqlite_where": sa.text(condition)}
+
+
+def upgrade():
+    op.create_index("ix_visit_jobs_done", "visit_jobs", ["finished_at"], **partial("status = 'done'"))
+
+
+def downgrade():
+    op.drop_index("ix_visit_jobs_done", table_name="visit_jobs")
@@ -0,0 +1,33 @@
+# Tests run against a throwaway SQLite file; DATABASE_URL is replaced before any app module reads it
+import os
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='visitor-intel-tests-'), 'test.db')}"
+
+import pytest
+
+
+def reset_database(session):
+    from app.db import engine
+    from app.labels import backfill_label_mappings, label_cache
+    from app.models import Base
+    from app.profiles import profile_cache
+
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    profile_cache.clear()
+    label_cache.clear()
+    backfill_label_mappings(session)   # Seeds the label counters, as init_db does at startup
+
+
+@pytest.fixture
+def db():
+    from app.db import SessionLocal
+
+    session = SessionLocal()
+    reset_database(session)
+    try:
+        yield session
+    finally:
+        session.close()
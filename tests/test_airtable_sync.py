@@ -0,0 +1,62 @@
+import pytest
+
+import app.airtable as airtable
+from app.airtable import GA_SYNC_CHECKPOINT, AirtableError, push_stored_ga_sessions
+from app.checkpoints import get_checkpoint
+from app.ga import store_ga_sessions
+
+
+class FakeAirtable:
+    def __init__(self, fail_requests=()):
+        self.stats = {"requests": 0, "retries": 0}
+        self.records = {}   # dedupe key -> fields
+        self.pushed = []    # (timestamp, sessions) in push order
+        self.fail_requests = set(fail_requests)
+
+    def upsert_records(self, base_id, table, fields_list, merge_on):
+        self.stats["requests"] += 1
+        if self.stats["requests"] in self.fail_requests:
+            raise AirtableError(503, "SERVICE_UNAVAILABLE")
+        for fields in fields_list:
+            self.records[fields[merge_on[0]]] = fields
+            self.pushed.append((fields["Timestamp"], fields["Sessions"]))
+        return [f"rec{len(self.pushed) - i}" for i in range(len(fields_list))]
+
+
+def session(minute: str, sessions: int = 1, page: str = "/") -> dict:
+    return {"timestamp": f"2026101810{minute}", "page": page, "device": "desktop", "city": "Delhi",
+            "country": "India", "sessions": sessions}
+
+
+@pytest.fixture(autouse=True)
+def upserts(monkeypatch):
+    monkeypatch.setattr(airtable, "AIRTABLE_GA_DEDUPE_FIELD", "Session Key")
+
+
+def test_late_and_revised_rows_are_pushed(db):
+    fake = FakeAirtable()
+    store_ga_sessions(db, [session("10"), session("20")])
+    assert push_stored_ga_sessions(db, airtable=fake)["records"] == 2
+
+    # A late row whose session key sorts before everything already pushed, plus a revised count
+    store_ga_sessions(db, [session("05"), session("10", sessions=4), session("20")])
+    assert push_stored_ga_sessions(db, airtable=fake)["records"] == 2
+    assert fake.pushed[2:] == [("202610181005", 1), ("202610181010", 4)]
+    assert {fields["Timestamp"]: fields["Sessions"] for fields in fake.records.values()} == \
+        {"202610181005": 1, "202610181010": 4, "202610181020": 1}
+
+    assert push_stored_ga_sessions(db, airtable=fake)["records"] == 0
+
+
+def test_failed_batch_holds_the_checkpoint(db):
+    store_ga_sessions(db, [session(f"{minute:02d}", page=f"/p{minute}") for minute in range(25)])
+
+    fake = FakeAirtable(fail_requests={2})
+    first = push_stored_ga_sessions(db, chunk_size=10, airtable=fake)
+    assert (first["records"], first["failed_batches"]) == (10, 1)
+    checkpoint = get_checkpoint(db, GA_SYNC_CHECKPOINT)
+
+    second = push_stored_ga_sessions(db, chunk_size=10, airtable=fake)
+    assert (second["records"], second["failed_batches"]) == (15, 0)
+    assert get_checkpoint(db, GA_SYNC_CHECKPOINT) > checkpoint
+    assert len(fake.pushed) == len(fake.records) == 25
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import app.intel as intel
+from app.intel import get_probable_alias, get_probable_alias_bruteforce, index_entropy_signature, rebuild_signature_index
+from app.models import VisitorLog
+from app.profiles import resolve_profile
+from benchmarks.synthetic import make_entropy, mutate_entropy, seed_visits
+
+ROWS = 1500
+
+
+@pytest.fixture
+def seeded(db):
+    seed_visits(db, ROWS)
+    rebuild_signature_index(db)
+    db.commit()
+    return db
+
+
+def lookups(count: int = 60):
+    rng = random.Random(11)
+    devices = ROWS // 5
+    for i in range(count):
+        entropy = make_entropy(rng, rng.randrange(devices * 2))   # Half are unseen devices
+        if rng.random() < 0.3:
+            entropy = mutate_entropy(rng, entropy)
+        yield entropy, f"fp-test-{i}"
+
+
+def outcome(result):
+    return result["probable_alias"], result["best_match_alias"], result["best_match_score"]
+
+
+def test_indexed_lookup_matches_bruteforce(seeded):
+    assert intel.ALIAS_FALLBACK_CANDIDATES == 0   # Exact by default
+    for entropy, fingerprint in lookups():
+        assert outcome(get_probable_alias(seeded, entropy, fingerprint)) == \
+            outcome(get_probable_alias_bruteforce(seeded, entropy, fingerprint))
+
+
+def test_numerically_equal_values_match_like_the_bruteforce_scan(seeded):
+    for device in range(5):
+        entropy = make_entropy(random.Random(0), device)
+        entropy.update({key: float(entropy[key]) for key in ("colorDepth", "deviceMemory", "hardwareConcurrency")})
+        expected = get_probable_alias_bruteforce(seeded, entropy, "fp-other")
+        assert expected["best_match_score"] == 1.0   # 8 == 8.0 for the reference scorer
+        assert outcome(get_probable_alias(seeded, entropy, "fp-other")) == outcome(expected)
+
+
+def test_capped_fallback_keeps_probable_alias(seeded, monkeypatch):
+    monkeypatch.setattr(intel, "ALIAS_FALLBACK_CANDIDATES", 25)
+    for entropy, fingerprint in lookups():
+        capped = get_probable_alias(seeded, entropy, fingerprint)
+        expected = get_probable_alias_bruteforce(seeded, entropy, fingerprint)
+        assert capped["probable_alias"] == expected["probable_alias"]
+        assert capped["best_match_score"] <= expected["best_match_score"]
+
+
+def test_incrementally_indexed_visit_is_matched(seeded):
+    entropy = make_entropy(random.Random(0), 10_000)
+    assert get_probable_alias(seeded, entropy, "fp-other")["probable_alias"] is None
+
+    record = VisitorLog(page="/", session_id="s-new", fingerprint_id="fp-new", visitor_alias="Visitor_9999",
+                        entropy_profile_id=resolve_profile(seeded, entropy))
+    seeded.add(record)
+    seeded.flush()
+    index_entropy_signature(seeded, record, entropy)
+    seeded.commit()
+
+    result = get_probable_alias(seeded, entropy, "fp-other")
+    assert (result["probable_alias"], result["probable_score"]) == ("Visitor_9999", 1.0)
+    assert get_probable_alias(seeded, entropy, "fp-new")["probable_alias"] != "Visitor_9999"
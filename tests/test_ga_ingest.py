@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from app.checkpoints import get_checkpoint
+from app.ga import GA4_WATERMARK, ingest_ga_sessions, stored_ga_sessions
+from benchmarks.ga_ingest import TODAY, FakeGAClient
+
+
+def stored_rows(db) -> list:
+    return sorted((s["timestamp"], s["page"], s["device"], s["city"], s["country"], s["sessions"])
+                  for s in stored_ga_sessions(db))
+
+
+def test_backfill_pages_through_every_row(db):
+    fake = FakeGAClient()
+    for days_ago in (2, 1):
+        fake.add_day(TODAY - timedelta(days=days_ago), 120)
+
+    stats = ingest_ga_sessions(db, fake, "test", page_size=50)
+
+    assert stats["stored"] == 240
+    assert fake.calls == 5   # 240 rows in pages of 50
+    assert stored_rows(db) == sorted(fake.rows)
+    assert get_checkpoint(db, GA4_WATERMARK) == max(row[0] for row in fake.rows)
+
+
+def test_incremental_run_rereads_from_the_watermark_day_only(db):
+    fake = FakeGAClient()
+    fake.add_day(TODAY - timedelta(days=2), 100)
+    fake.add_day(TODAY - timedelta(days=1), 100)
+    ingest_ga_sessions(db, fake, "test", page_size=40)
+    watermark = get_checkpoint(db, GA4_WATERMARK)
+
+    # GA revises the watermark minute (it was partial) and a new day arrives
+    fake.rows = [row[:5] + (row[5] + 10,) if row[0] == watermark else row for row in fake.rows]
+    fake.add_day(TODAY, 30)
+    fake.rows_served = 0
+    stats = ingest_ga_sessions(db, fake, "test", page_size=40)
+
+    assert stats["start_date"] == (TODAY - timedelta(days=1)).strftime("%Y-%m-%d")
+    assert fake.rows_served == 130       # The watermark's day and today, not the backfill window
+    assert stats["stored"] == 31         # The revised watermark minute + the new day
+    assert stored_rows(db) == sorted(fake.rows)
+
+    fake.rows_served = 0
+    assert ingest_ga_sessions(db, fake, "test", page_size=40)["stored"] == 1   # Just the watermark minute
+    assert stored_rows(db) == sorted(fake.rows)
@@ -0,0 +1,117 @@
+import random
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.session_state as session_state
+from app.models import VisitorLog, VisitorDerivedLog
+from app.session_state import LocalSessionStore, session_state_total
+from benchmarks.synthetic import make_entropy
+from tests.conftest import reset_database
+
+
+class RacingStore(LocalSessionStore):
+    """Another worker moves every session on between this request's read and its write, once."""
+
+    def __init__(self):
+        super().__init__()
+        self.raced = set()
+
+    def put(self, key, state, expected):
+        if expected is not None and key not in self.raced:
+            self.raced.add(key)
+            current, expires = self.entries[key]
+            self.entries[key] = ({**current, "version": current["version"] + 1}, expires)
+        return super().put(key, state, expected)
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    import app.main as main
+
+    async def fake_enrich(ip):
+        return {"City": "Delhi", "Region": "Delhi", "Country": "IN", "Organization": "AS0 Test"}
+
+    monkeypatch.setattr(main, "enrich_ip_data_async", fake_enrich)
+    monkeypatch.setattr(main, "VISIT_PIPELINE", "inline")
+    return TestClient(main.app)
+
+
+def outcomes(before: dict) -> dict:
+    return {key[0]: value - before.get(key, 0) for key, value in session_state_total.values.items()
+            if value != before.get(key, 0)}
+
+
+def visit(client, session_id: str, page: str, second: int, device: int = 1):
+    response = client.post("/log-visit", json={
+        "page": page, "referrer": "Direct", "device": "desktop", "session_id": session_id,
+        "fingerprint_id": f"fp-{device}", "entropy_data": make_entropy(random.Random(device), device),
+        "client_timestamp": f"2026-10-18T10:00:{second:02d}Z",
+    })
+    assert response.status_code == 200 and response.json().get("status") != "error", response.text
+
+
+def exit_page(client, session_id: str, page: str, second: int):
+    response = client.post("/log-exit", json={"session_id": session_id, "page": page,
+                                             "exit_time": f"2026-10-18T10:00:{second:02d}Z"})
+    assert response.status_code == 200, response.text
+
+
+def play(client, session_id: str):
+    visit(client, session_id, "/", 0)
+    visit(client, session_id, "/about", 10)
+    exit_page(client, session_id, "/", 30)
+    visit(client, session_id, "/blog", 40)
+    exit_page(client, session_id, "/about", 50)
+
+
+def results(db) -> tuple:
+    db.expire_all()
+    visits = db.query(VisitorLog.page, VisitorLog.session_label, VisitorLog.time_on_page).order_by(VisitorLog.id).all()
+    derived = db.query(VisitorDerivedLog.entry_page, VisitorDerivedLog.bounced, VisitorDerivedLog.visit_type) \
+        .order_by(VisitorDerivedLog.id).all()
+    return visits, derived
+
+
+def test_local_store_compare_and_set():
+    store = LocalSessionStore(ttl=60)
+    assert store.put("s", {"version": 1}, expected=None)
+    assert store.put("s", {"version": 2}, expected=1)
+    assert not store.put("s", {"version": 3}, expected=1)   # Someone else's write: entry dropped
+    assert store.get("s") is None
+    assert store.put("s", {"version": 1}, expected=None)
+
+    store.entries["s"] = (store.entries["s"][0], time.time() - 1)   # Expired entries read as missing
+    assert store.get("s") is None
+
+
+def test_cache_hits_after_the_first_visit(db, client, monkeypatch):
+    monkeypatch.setattr(session_state, "session_store", None)
+    play(client, "s-1")
+    uncached = results(db)
+    reset_database(db)   # Same starting point for the cached replay
+    store = LocalSessionStore()
+    monkeypatch.setattr(session_state, "session_store", store)
+    before = dict(session_state_total.values)
+    play(client, "s-1")
+
+    assert outcomes(before) == {"miss": 1, "hit": 4, "stored": 3}
+    state = store.get("s-1")
+    assert (state["version"], state["hits"], list(state["pages"])) == (3, 3, ["/", "/about", "/blog"])
+    assert results(db) == uncached
+
+
+def test_conflicting_write_drops_the_entry_and_rebuilds_from_the_db(db, client, monkeypatch):
+    monkeypatch.setattr(session_state, "session_store", None)
+    play(client, "s-1")
+    uncached = results(db)
+    reset_database(db)   # Same starting point for the cached replay
+    store = RacingStore()
+    monkeypatch.setattr(session_state, "session_store", store)
+    before = dict(session_state_total.values)
+    play(client, "s-1")
+
+    # Visit 2 loses the race (entry dropped), so exit 1 and visit 3 fall back to the DB
+    assert outcomes(before) == {"miss": 3, "hit": 2, "stored": 2, "conflict": 1}
+    assert results(db) == uncached